@@ -1,23 +1,59 @@
 from __future__ import annotations
+import startup
+startup.install_import_timer()
+
+import functools
+import hashlib
 import os
+import socket
+import threading
+import uuid
 from datetime import datetime
-from flask import Flask, jsonify, request, redirect
+from flask import Flask, Response, g, jsonify, request, redirect, stream_with_context
 from psycopg2 import sql
 import psycopg2
 import psycopg2.extras
 from psycopg2.pool import PoolError
 
-from chatbots.orchestrater import callAgents
-from data.database_postgres import get_db, json_error, parse_yyyy_mm_dd, get_profilehistory_columns
+from chatbots.orchestrater import callAgents, regenerate_sections, SECTION_NAMES
+from chatbots.llm_usage import set_usage_sink
+from chatbots.llm_runtime import load_env
+from chatbots.FullAgents import warm_up as warm_up_llm
+from chatbots.prompt_budget import PromptBudgeter, replace_vars
+from chatbots.message_assembly import prefix_stats
+from chatbots.repair import repair_stats
+from chatbots.local_compiler import resolve_mode as resolve_compiler_mode
+from chatbots.agent_executor import PRIORITIES, Overloaded, get_agent_executor
+from chatbots.cancellation import Cancelled, get_cancel_registry
+from chatbots.retry_policy import retry_budget, retry_stats
+from chatbots.shared_state import get_shared_state, set_shared_state
+from chatbots.live_status import live_snapshot
+from data.database_postgres import get_db, db_pool_stats, json_error, parse_yyyy_mm_dd, get_profilehistory_columns
+from data.token_ledger import record_llm_call, fetch_month_usage, build_month_series, parse_yyyy_mm
+from data.history_writer import record_generation, record_section_done
+from data.migrations import apply_migrations
+from data.history_search import search_profile_history, parse_cursor, SEARCH_PAGE_DEFAULT
+from data.json_stream import stream_query, wants_stream, NDJSON_MIMETYPE
+from web_assets import init_web_assets
+from data.example_index import (
+    CORPORA, AUTO_EXAMPLES_DEFAULT_K, EXAMPLE_INDEX_BACKEND, get_example_index, index_available, suggest_examples,
+)
+from data.example_store import get_example_store
+from data.draft_store import get_draft_store, new_run_id
+from data.shared_state_pg import PostgresSharedState
+from data.http_cache import (
+    make_etag, table_version, history_day_version, is_not_modified, not_modified_response,
+    apply_cache_headers, TABLE_CACHE_CONTROL, PAST_DAY_CACHE_CONTROL, TODAY_CACHE_CONTROL,
+)
 
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    pass
+load_env()
 
 DEBUGGING_MODE = True
 SECRET_KEY = os.getenv("SECRET_KEY")
+AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+# memory: per-process router/quota/job state | postgres: shared by every node (migration 8)
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").strip().lower()
+HISTORY_PAGE_MAX = 500
 
 app = Flask(
     "Writer's Block",
@@ -25,8 +61,295 @@ app = Flask(
     static_url_path="/web_files"
 )
 app.secret_key = SECRET_KEY
+# Precompressed + fingerprinted web_files, gzip/brotli for API JSON
+init_web_assets(app)
+
+set_usage_sink(record_llm_call)
+if SHARED_STATE_BACKEND == "postgres":
+    # Lazy: the first call borrows from the worker's pool, nothing connects at import
+    set_shared_state(PostgresSharedState())
+
+startup.mark("app_imported")
+startup.log_import_report()
+
+
+# -----------------------------
+# WORKER LIFECYCLE
+# -----------------------------
+# Nothing touches the DB at import time, so pre-fork servers never share sockets
+# opened in the master. Each worker initialises on first request (or eagerly from
+# the gunicorn post_worker_init hook).
+_worker_lock = threading.Lock()
+_worker_ready = False
+_draining = threading.Event()
+_inflight_lock = threading.Lock()
+_inflight_chats = 0
+
+
+def init_worker() -> None:
+    global _worker_ready
+    if _worker_ready:
+        return
+    with _worker_lock:
+        if _worker_ready:
+            return
+        get_db()
+        if AUTO_MIGRATE:
+            try:
+                apply_migrations(get_db())
+            except Exception as e:
+                print(f"[API][ERROR] schema migrations failed: {e}")
+        _worker_ready = True
+
+
+def start_background_warmup() -> None:
+    """
+    Called once the server is accepting traffic: builds the DB pool (+ migrations)
+    and loads the LLM client stack on a daemon thread. Requests that arrive first
+    still initialise on demand (init_worker is idempotent and locked).
+    """
+    startup.start_warmup([
+        ("db_pool", init_worker),
+        ("llm_clients", warm_up_llm),
+        ("example_index", _warm_example_index),
+        ("example_store", _warm_example_store),
+    ])
+
+
+def _warm_example_store():
+    store = get_example_store()
+    if store is None:
+        return {"skipped": "disabled or zstandard not installed"}
+    return store.warm(get_db())
+
+
+def _warm_example_index():
+    if not index_available() and EXAMPLE_INDEX_BACKEND != "pgvector":
+        return {"skipped": "numpy not installed"}
+    return get_example_index().warm(get_db())
+
+
+def begin_drain() -> None:
+    """
+    Called on SIGTERM/SIGINT: readiness flips to 503 so the load balancer stops
+    routing here while in-flight pipelines finish.
+    """
+    _draining.set()
+
+
+def inflight_chats() -> int:
+    return _inflight_chats
+
+
+@app.before_request
+def _ensure_worker_ready():
+    if _worker_ready or request.endpoint in ("healthz", "readyz", "static", "api_ops_startup", "api_ops_live"):
+        return
+    try:
+        init_worker()
+    except Exception as e:
+        # Endpoints surface their own DB errors; init is retried on the next request
+        app.logger.error(f"Worker init failed: {e}")
+
+
+@app.route("/healthz")
+def healthz():
+    # Liveness: the process is serving requests (no DB round trip)
+    return jsonify({"success": True, "status": "alive", "pid": os.getpid()}), 200
+
+
+@app.route("/api/ops/startup")
+def api_ops_startup():
+    # Cold-start report: milestones, warm-up steps and (STARTUP_PROFILE=1) import times
+    try:
+        top = int(request.args.get("top", str(startup.STARTUP_REPORT_TOP)))
+    except ValueError:
+        return json_error("BAD_TOP", "top must be an integer.", 400)
+    return jsonify({"success": True, "startup": startup.startup_report(max(1, min(top, 200)))}), 200
+
+
+@app.route("/api/ops/prompt-cache")
+def api_ops_prompt_cache():
+    # Estimated provider prefix-cache reuse per model (this worker, since start)
+    return jsonify({"success": True, "prompt_cache": prefix_stats()}), 200
+
+
+@app.route("/api/ops/retries")
+def api_ops_retries():
+    # LLM errors per class (rate_limit, server, auth, ...) and whether they were retried (this worker)
+    return jsonify({"success": True, "retries": retry_stats()}), 200
+
+
+@app.route("/api/ops/repairs")
+def api_ops_repairs():
+    # Repair rate, how invalid outputs were fixed, and estimated tokens saved (this worker)
+    return jsonify({"success": True, "repairs": repair_stats()}), 200
+
+
+@app.route("/readyz")
+def readyz():
+    # Readiness: not draining and the DB answers
+    if _draining.is_set():
+        return json_error("DRAINING", "Worker is shutting down.", 503, inflight_chats=_inflight_chats)
+    try:
+        get_db().fetchone("SELECT 1 AS ok;")
+    except Exception as e:
+        return json_error("DB_UNAVAILABLE", "Database is not reachable.", 503, details=str(e))
+    return jsonify({"success": True, "status": "ready", "inflight_chats": _inflight_chats}), 200
+
+
+@app.route("/api/ops/agents")
+def api_ops_agents():
+    # Shared agent executor: queue depth, wait times, admissions and rejections (this worker)
+    return jsonify({"success": True, "agents": get_agent_executor().stats(), "cancellation": get_cancel_registry().stats()}), 200
+
+
+@app.route("/api/ops/shared-state")
+def api_ops_shared_state():
+    # Backend used for router counters, tenant token buckets and job/cancel flags
+    return jsonify({"success": True, "shared_state": get_shared_state().stats()}), 200
 
-db = get_db()
+
+def _hit_rate(hits: int, total: int):
+    return round(hits / total, 3) if total else None
+
+
+def _cache_rates() -> dict:
+    prefix = prefix_stats()
+    drafts = get_draft_store().stats()
+    draft_total = drafts["memory_hits"] + drafts["db_hits"] + drafts["misses"]
+    out = {
+        "prompt_prefix": {
+            "reuse_ratio": prefix["reuse_ratio"],
+            "models": {m: {"calls": st["calls"], "hit_rate": _hit_rate(st["hits"], st["calls"]), "reuse_ratio": st["reuse_ratio"]}
+                       for m, st in prefix["models"].items()},
+        },
+        "drafts": {"lookups": draft_total, "memory_hit_rate": _hit_rate(drafts["memory_hits"], draft_total),
+                   "db_hit_rate": _hit_rate(drafts["db_hits"], draft_total)},
+    }
+    store = get_example_store()
+    if store is not None:
+        st = store.stats()
+        lookups = st["snapshot_hits"] + st["sql_fallbacks"]
+        out["example_snapshot"] = {"lookups": lookups, "hit_rate": _hit_rate(st["snapshot_hits"], lookups)}
+    return out
+
+
+@app.route("/api/ops/live")
+def api_ops_live():
+    # Operator dashboard (web_files/opsDashboard.html): in-memory only, no DB round trip (this worker)
+    agents = get_agent_executor().stats()
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "draining": _draining.is_set(),
+        "inflight_chats": _inflight_chats,
+        "live": live_snapshot(),
+        "db_pool": db_pool_stats(),
+        "executor": {k: agents[k] for k in (
+            "workers", "active", "queue_depth", "queue_max", "oldest_wait_ms",
+            "pipelines_in_flight", "max_pipelines", "rejected", "wait_ms", "run_ms",
+        )},
+        "caches": _cache_rates(),
+        "cancellation": get_cancel_registry().stats(),
+    }), 200
+
+
+def _request_id() -> str:
+    """Client-chosen X-Request-ID (or body request_id) so it can cancel; otherwise a fresh one."""
+    data = request.get_json(silent=True) or {}
+    rid = request.headers.get("X-Request-ID") or data.get("request_id")
+    rid = rid.strip() if isinstance(rid, str) else ""
+    return rid[:128] if rid else uuid.uuid4().hex
+
+
+def _disconnect_probe():
+    """
+    Returns a callable that reports whether the HTTP client has gone away, or None
+    when the server doesn't expose the socket. The request body is already read,
+    so a readable socket with nothing to peek means the peer closed it.
+    """
+    sock = request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+    if sock is None:
+        return None
+
+    def _gone() -> bool:
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+    return _gone
+
+
+def _cancelled_response(request_id: str, e: Cancelled):
+    return json_error("CANCELLED", "Request was cancelled.", 499, request_id=request_id, reason=e.reason)
+
+
+@app.route("/api/chat/<request_id>/cancel", methods=["POST"])
+def cancel_chat(request_id: str):
+    """
+    Cancels an in-flight /api/chat or /regenerate started with this X-Request-ID
+    (any node with a shared state backend). Only the tenant that started the run
+    can cancel it: send the same X-API-Key (or COMPANY_NAME) as the run.
+    """
+    if not get_cancel_registry().cancel(request_id, tenant=_request_tenant()):
+        return json_error("REQUEST_NOT_FOUND", "No running request with this ID.", 404)
+    return jsonify({"success": True, "request_id": request_id, "cancelled": True}), 200
+
+
+def _request_tenant():
+    """Scheduling tenant: the API key (hashed) when one is sent, else the body's COMPANY_NAME."""
+    api_key = (request.headers.get("X-API-Key") or "").strip()
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    data = request.get_json(silent=True) or {}
+    vars_payload = data.get("vars") if isinstance(data.get("vars"), dict) else {}
+    name = vars_payload.get("COMPANY_NAME") or data.get("COMPANY_NAME")
+    return name.strip() if isinstance(name, str) and name.strip() else None
+
+
+def _request_priority() -> str:
+    data = request.get_json(silent=True) or {}
+    vars_payload = data.get("vars") if isinstance(data.get("vars"), dict) else {}
+    raw = request.headers.get("X-Priority") or vars_payload.get("PRIORITY") or data.get("PRIORITY")
+    return str(raw or "interactive").strip().lower()
+
+
+def admission_controlled(view):
+    """
+    Reserves a pipeline slot on the shared agent executor for the whole request.
+    When the executor is saturated the request is refused immediately with
+    503 OVERLOADED + Retry-After instead of queueing until it times out; a tenant
+    over its own quota gets 429 TENANT_QUOTA + Retry-After.
+    The tenant and priority are left on flask.g for the view.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.priority = _request_priority()
+        if g.priority not in PRIORITIES:
+            return json_error("BAD_PRIORITY", f"priority must be one of {', '.join(PRIORITIES)}", 400)
+        g.tenant = _request_tenant()
+        try:
+            with get_agent_executor().admission(g.tenant):
+                return view(*args, **kwargs)
+        except Overloaded as e:
+            message = "Server is busy, retry shortly." if e.status == 503 else "Tenant quota exceeded, retry shortly."
+            err, status = json_error(
+                e.code, message, e.status,
+                reason=e.reason, retry_after_s=e.retry_after_s,
+            )
+            err.headers["Retry-After"] = str(e.retry_after_s)
+            return err, status
+    return wrapper
+
+
+def _stream_response(chunks, fmt: str, headers=None) -> Response:
+    mimetype = NDJSON_MIMETYPE if fmt == "ndjson" else "application/json"
+    resp = Response(stream_with_context(chunks), mimetype=mimetype, headers=headers or {})
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @app.route("/")
@@ -42,7 +365,7 @@ def api_db_table(table_name: str):
         if not req:
             return json_error("MISSING_TABLE", "Missing table_name in URL path.", 400)
 
-        with db.conn() as conn:
+        with get_db().conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute("""
                     SELECT tablename
@@ -53,13 +376,21 @@ def api_db_table(table_name: str):
                 allowed = [r["tablename"] for r in cur.fetchall()]
                 allowed_lc = {t.lower(): t for t in allowed}
 
-                if req.lower() in excluded:
+                # profileHistory partitions (profilehistory_YYYY_MM / _default) are private too
+                if req.lower() in excluded or req.lower().startswith("profilehistory_"):
                     return json_error("TABLE_EXCLUDED", "This table is excluded from DB views.", 403, table=req)
 
                 actual_name = allowed_lc.get(req.lower())
                 if not actual_name:
                     return json_error("UNKNOWN_TABLE", "Table not found.", 404, table=req, available=allowed)
 
+                # Conditional GET: answer 304 before touching the table itself
+                stream_fmt = wants_stream(request.args, request.headers)
+                version, last_modified = table_version(conn, actual_name)
+                etag = make_etag("table", actual_name, version, stream_fmt)
+                if is_not_modified(etag, last_modified):
+                    return not_modified_response(etag, last_modified, TABLE_CACHE_CONTROL)
+
                 cur.execute("""
                     SELECT column_name
                     FROM information_schema.columns
@@ -69,10 +400,26 @@ def api_db_table(table_name: str):
                 columns = [r["column_name"] for r in cur.fetchall()]
 
                 tbl_ident = sql.Identifier(actual_name)
-                cur.execute(sql.SQL("SELECT * FROM {}").format(tbl_ident))
-                rows = cur.fetchall()
+                select_all = sql.SQL("SELECT * FROM {}").format(tbl_ident)
 
-        return jsonify({
+                if stream_fmt is None:
+                    cur.execute(select_all)
+                    rows = cur.fetchall()
+
+        if stream_fmt is not None:
+            # Rows are fetched by the generator through a server-side cursor
+            resp = _stream_response(
+                stream_query(
+                    get_db(), select_all, None, stream_fmt,
+                    head={"success": True, "table": {"name": actual_name, "columns": columns}},
+                    rows_path=("table", "rows"),
+                ),
+                stream_fmt,
+                headers={"X-Table-Name": actual_name},
+            )
+            return apply_cache_headers(resp, etag, last_modified, TABLE_CACHE_CONTROL)
+
+        resp = jsonify({
             "success": True,
             "table": {
                 "name": actual_name,
@@ -80,7 +427,8 @@ def api_db_table(table_name: str):
                 "row_count": len(rows),
                 "rows": rows
             }
-        }), 200
+        })
+        return apply_cache_headers(resp, etag, last_modified, TABLE_CACHE_CONTROL), 200
 
     except PoolError as e:
         return json_error("POOL_EXHAUSTED", "DB connection pool exhausted.", 500, details=str(e))
@@ -99,27 +447,77 @@ def api_profile_history_by_date():
     except ValueError:
         return json_error("BAD_DATE_FORMAT", "Invalid date format. Use YYYY-MM-DD", 400, received=d)
 
+    # Optional keyset pagination within the day: ?limit=N&after_id=<last id seen>
+    limit_raw = (request.args.get("limit") or "").strip()
+    after_raw = (request.args.get("after_id") or "").strip()
+    try:
+        limit = min(max(int(limit_raw), 1), HISTORY_PAGE_MAX) if limit_raw else None
+        after_id = int(after_raw) if after_raw else 0
+    except ValueError:
+        return json_error("BAD_PAGINATION", "limit and after_id must be integers.", 400,
+                          limit=limit_raw, after_id=after_raw)
+
     try:
-        with db.conn() as conn:
+        stream_fmt = wants_stream(request.args, request.headers)
+        # Past days never change: long-lived cache; today revalidates every time
+        cache_control = PAST_DAY_CACHE_CONTROL if parsed_date < datetime.now().date() else TODAY_CACHE_CONTROL
+
+        with get_db().conn() as conn:
+            etag = make_etag("history", d, history_day_version(conn, parsed_date), limit, after_id, stream_fmt)
+            if is_not_modified(etag):
+                return not_modified_response(etag, None, cache_control)
+
             user_col, resp_col = get_profilehistory_columns(conn)
 
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                sql_query = f"""
-                    SELECT
-                        id,
-                        entry AS entry,
-                        entry_date AS entry_date,
-                        {user_col} AS userprompt,
-                        {resp_col} AS chatresponse
-                    FROM profileHistory
-                    WHERE entry_date = %s
-                    ORDER BY id ASC;
-                """
-                cur.execute(sql_query, (parsed_date,))
-                rows = cur.fetchall()
+            # (entry_date, id) index makes this a single index range scan
+            sql_query = f"""
+                SELECT
+                    id,
+                    entry AS entry,
+                    entry_date AS entry_date,
+                    {user_col} AS userprompt,
+                    {resp_col} AS chatresponse
+                FROM profileHistory
+                WHERE entry_date = %s AND id > %s
+                ORDER BY id ASC
+                {"LIMIT %s" if limit else ""};
+            """
+
+            if stream_fmt is None:
+                params = (parsed_date, after_id, limit + 1) if limit else (parsed_date, after_id)
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    cur.execute(sql_query, params)
+                    rows = cur.fetchall()
+
+        if stream_fmt is not None:
+            # Streamed mode: no has_more/next_after_id (the client reads to the end)
+            params = (parsed_date, after_id, limit) if limit else (parsed_date, after_id)
+            resp = _stream_response(
+                stream_query(
+                    get_db(), sql_query, params, stream_fmt,
+                    head={"success": True, "code": "OK", "date": d},
+                    rows_path=("rows",),
+                    count_key=None,
+                ),
+                stream_fmt,
+            )
+            return apply_cache_headers(resp, etag, None, cache_control)
+
+        has_more = bool(limit) and len(rows) > limit
+        if has_more:
+            rows = rows[:limit]
+        next_after_id = rows[-1]["id"] if has_more else None
 
         # Important: rows may be empty; frontend will show default message
-        return jsonify({"success": True, "code": "OK", "date": d, "rows": rows}), 200
+        resp = jsonify({
+            "success": True,
+            "code": "OK",
+            "date": d,
+            "rows": rows,
+            "has_more": has_more,
+            "next_after_id": next_after_id,
+        })
+        return apply_cache_headers(resp, etag, None, cache_control), 200
 
     except PoolError as e:
         return json_error("POOL_EXHAUSTED", "DB pool exhausted.", 500, details=str(e))
@@ -127,7 +525,127 @@ def api_profile_history_by_date():
         return json_error("PROFILE_HISTORY_FAIL", "Failed to load profile history.", 500, details=str(e))
 
 
+@app.route("/api/profile/history/search")
+def api_profile_history_search():
+    d_from = (request.args.get("from") or "").strip()
+    d_to = (request.args.get("to") or "").strip()
+    keyword = (request.args.get("q") or "").strip()
+    if not d_from or not d_to:
+        return json_error("MISSING_DATE", "Missing date range. Use ?from=YYYY-MM-DD&to=YYYY-MM-DD", 400)
+
+    try:
+        date_from = parse_yyyy_mm_dd(d_from)
+        date_to = parse_yyyy_mm_dd(d_to)
+    except ValueError:
+        return json_error("BAD_DATE_FORMAT", "Invalid date format. Use YYYY-MM-DD", 400, received=[d_from, d_to])
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+
+    try:
+        limit = int(request.args.get("limit") or SEARCH_PAGE_DEFAULT)
+        cursor = parse_cursor(request.args.get("cursor") or "")
+    except ValueError:
+        return json_error("BAD_PAGINATION", "limit must be an integer and cursor must be YYYY-MM-DD:id.", 400)
+
+    try:
+        with get_db().conn() as conn:
+            rows, next_cursor = search_profile_history(conn, date_from, date_to, keyword, limit=limit, cursor=cursor)
+
+        return jsonify({
+            "success": True,
+            "code": "OK",
+            "from": date_from.isoformat(),
+            "to": date_to.isoformat(),
+            "q": keyword,
+            "rows": rows,
+            "next_cursor": next_cursor,
+        }), 200
+
+    except PoolError as e:
+        return json_error("POOL_EXHAUSTED", "DB pool exhausted.", 500, details=str(e))
+    except Exception as e:
+        return json_error("PROFILE_SEARCH_FAIL", "Failed to search profile history.", 500, details=str(e))
+
+
+@app.route("/api/examples/suggest")
+def api_examples_suggest():
+    """
+    Top-k example IDs for a query from the local BM25 index (or pgvector).
+    Query params: corpus (blogdata | intro | final_cta | faqs | business_description |
+    integrate_references | short_cta), q, k (default 2).
+    """
+    corpus = (request.args.get("corpus") or "blogdata").strip().lower()
+    query = (request.args.get("q") or "").strip()
+    if corpus not in CORPORA:
+        return json_error("BAD_CORPUS", f"Unknown corpus '{corpus}'.", 400, corpora=sorted(CORPORA))
+    if not query:
+        return json_error("MISSING_QUERY", "Missing q.", 400)
+    try:
+        k = int(request.args.get("k", str(AUTO_EXAMPLES_DEFAULT_K)))
+    except ValueError:
+        return json_error("BAD_PAGINATION", "k must be an integer.", 400)
+    if not index_available() and EXAMPLE_INDEX_BACKEND != "pgvector":
+        return json_error("INDEX_UNAVAILABLE", "Example index is unavailable (numpy is not installed).", 503)
+
+    try:
+        hits, info = suggest_examples(get_db(), corpus, query, k)
+        return jsonify({
+            "success": True,
+            "corpus": corpus,
+            "query": query,
+            "results": [{"id": doc_id, "score": score} for doc_id, score in hits],
+            **info,
+        }), 200
+    except PoolError as e:
+        return json_error("POOL_EXHAUSTED", "DB pool exhausted.", 500, details=str(e))
+    except Exception as e:
+        return json_error("EXAMPLE_SUGGEST_FAIL", "Failed to suggest examples.", 500, details=str(e))
+
+
+@app.route("/api/examples/stats")
+def api_examples_stats():
+    # Index sizes/sync state and compressed-store footprint (this worker's view)
+    store = get_example_store()
+    return jsonify({
+        "success": True,
+        "index": get_example_index().stats() if (index_available() or EXAMPLE_INDEX_BACKEND == "pgvector") else None,
+        "store": store.stats() if store is not None else None,
+    }), 200
+
+
+@app.route("/api/stats/tokens/month")
+def api_stats_tokens_month():
+    m = (request.args.get("month") or "").strip()
+    today = datetime.now().date()
+    try:
+        year, month = parse_yyyy_mm(m) if m else (today.year, today.month)
+    except ValueError:
+        return json_error("BAD_MONTH_FORMAT", "Invalid month format. Use YYYY-MM", 400, received=m)
+
+    try:
+        with get_db().conn() as conn:
+            rows = fetch_month_usage(conn, year, month)
+
+        daily = build_month_series(year, month, rows, upto=today)
+        return jsonify({
+            "success": True,
+            "month_label": datetime(year, month, 1).strftime("%b %Y"),
+            "totals": {
+                "calls": sum(d["calls"] for d in daily),
+                "input_tokens": sum(d["input_tokens"] for d in daily),
+                "output_tokens": sum(d["output_tokens"] for d in daily),
+            },
+            "daily": daily,
+        }), 200
+
+    except PoolError as e:
+        return json_error("POOL_EXHAUSTED", "DB pool exhausted.", 500, details=str(e))
+    except Exception as e:
+        return json_error("TOKENS_MONTH_FAIL", "Failed to compute token statistics.", 500, details=str(e))
+
+
 @app.route('/api/chat', methods=['POST'])
+@admission_controlled
 def handle_chat():
     """
     Chat endpoint:
@@ -136,6 +654,11 @@ def handle_chat():
     - Substitutes placeholders inside prompt templates
     - Calls orchestrator
     """
+    if _draining.is_set():
+        err, status = json_error("DRAINING", "Server is restarting, retry shortly.", 503)
+        err.headers["Retry-After"] = "5"
+        return err, status
+
     try:
         data = request.get_json(silent=True) or {}
         user_message = (data.get("message") or "").strip()
@@ -157,6 +680,10 @@ def handle_chat():
         COMPANY_EMPLOYEE = (vars_payload.get("COMPANY_EMPLOYEE") or "").strip()
 
         BLOGTYPE = (vars_payload.get("BLOGTYPE") or "Legal").strip()
+        try:
+            COMPILER_MODE = resolve_compiler_mode(vars_payload.get("COMPILER_MODE"))
+        except ValueError as e:
+            return json_error("BAD_COMPILER_MODE", str(e), 400)
         try:
             TEMPERATURE = float(vars_payload.get("TEMPERATURE", 0.70))
         except Exception:
@@ -180,6 +707,36 @@ def handle_chat():
         BLOGPART_BUSINESSDESC_IDS = _coerce_int_list(vars_payload.get("BLOGPART_BUSINESSDESC", []))
         BLOGPART_SHORTCTA_IDS = _coerce_int_list(vars_payload.get("BLOGPART_SHORTCTA", []))
 
+        # -----------------------------
+        # Auto-select examples (BM25 index) for slots left empty
+        # -----------------------------
+        auto_examples = {}
+        if str(vars_payload.get("AUTO_EXAMPLES", "")).strip().lower() in ("1", "true", "yes", "on"):
+            auto_query = " ".join(x for x in (TITLE, KEYWORDS) if x) or user_message
+            try:
+                auto_k = int(vars_payload.get("AUTO_EXAMPLES_K", AUTO_EXAMPLES_DEFAULT_K))
+            except (TypeError, ValueError):
+                auto_k = AUTO_EXAMPLES_DEFAULT_K
+
+            def auto_pick(ids, corpus):
+                if ids:
+                    return ids
+                try:
+                    hits, info = suggest_examples(get_db(), corpus, auto_query, auto_k)
+                except Exception as e:
+                    app.logger.error(f"Example auto-selection failed ({corpus}): {e}")
+                    auto_examples[corpus] = {"error": str(e)}
+                    return ids
+                auto_examples[corpus] = {"ids": [h[0] for h in hits], "scores": [h[1] for h in hits], **info}
+                return [h[0] for h in hits]
+
+            BLOGFOREXAMPLE_IDS = auto_pick(BLOGFOREXAMPLE_IDS, "blogdata")
+            BLOGPART_INTRO_IDS = auto_pick(BLOGPART_INTRO_IDS, "intro")
+            BLOGPART_FINALCTA_IDS = auto_pick(BLOGPART_FINALCTA_IDS, "final_cta")
+            BLOGPART_FAQS_IDS = auto_pick(BLOGPART_FAQS_IDS, "faqs")
+            BLOGPART_BUSINESSDESC_IDS = auto_pick(BLOGPART_BUSINESSDESC_IDS, "business_description")
+            BLOGPART_SHORTCTA_IDS = auto_pick(BLOGPART_SHORTCTA_IDS, "short_cta")
+
         PROMPT_FULLBLOG = (vars_payload.get("PROMPT_FULLBLOG") or "").strip()
         PROMPT_INTRO = (vars_payload.get("PROMPT_INTRO") or "").strip()
         PROMPT_FINALCTA = (vars_payload.get("PROMPT_FINALCTA") or "").strip()
@@ -191,11 +748,26 @@ def handle_chat():
         # -----------------------------
         # DB: fetch examples once
         # -----------------------------
+        store = get_example_store()
+
+        def fetch_from_store(ids, corpus):
+            # Local compressed snapshot; None -> read from Postgres
+            if store is None:
+                return None
+            try:
+                return store.get_texts(get_db(), corpus, ids)
+            except Exception as e:
+                app.logger.error(f"Example store read failed ({corpus}), using SQL: {e}")
+                return None
+
         def fetch_blog_examples(blog_ids, table_name="blogdata", id_column="blogID", text_column="blogText"):
             if not blog_ids:
-                return ""
+                return []
+            stored = fetch_from_store(blog_ids, "blogdata") if table_name == "blogdata" else None
+            if stored is not None:
+                return stored
             try:
-                with db.conn() as conn:
+                with get_db().conn() as conn:
                     with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                         query = f"""
                             SELECT {id_column}, {text_column}
@@ -205,21 +777,19 @@ def handle_chat():
                         """
                         cur.execute(query, (blog_ids,))
                         results = cur.fetchall()
-
-                        examples = []
-                        for idx, row in enumerate(results, 1):
-                            text = row.get(text_column, "") or ""
-                            examples.append(f"Example {idx}:\n{text}")
-                        return "\n\n".join(examples)
+                        return [row.get(text_column, "") or "" for row in results]
             except Exception as e:
                 app.logger.error(f"Error fetching blog examples: {e}")
-                return ""
+                return []
 
         def fetch_blog_part_examples(part_ids, column_name):
             if not part_ids:
-                return ""
+                return []
+            stored = fetch_from_store(part_ids, column_name.lower())
+            if stored is not None:
+                return stored
             try:
-                with db.conn() as conn:
+                with get_db().conn() as conn:
                     with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                         query = f"""
                             SELECT blogID, {column_name}
@@ -229,53 +799,55 @@ def handle_chat():
                         """
                         cur.execute(query, (part_ids,))
                         results = cur.fetchall()
-
-                        examples = []
-                        for idx, row in enumerate(results, 1):
-                            text = row.get(column_name, "") or ""
-                            examples.append(f"Example {idx}:\n{text}")
-                        return "\n\n".join(examples)
+                        return [row.get(column_name, "") or "" for row in results]
             except Exception as e:
                 app.logger.error(f"Error fetching blog part examples ({column_name}): {e}")
-                return ""
+                return []
 
-        BLOGFOREXAMPLE = fetch_blog_examples(BLOGFOREXAMPLE_IDS)
-        BLOGPART_INTRO = fetch_blog_part_examples(BLOGPART_INTRO_IDS, "intro")
-        BLOGPART_FINALCTA = fetch_blog_part_examples(BLOGPART_FINALCTA_IDS, "final_cta")
-        BLOGPART_FAQS = fetch_blog_part_examples(BLOGPART_FAQS_IDS, "FAQs")
-        BLOGPART_BUSINESSDESC = fetch_blog_part_examples(BLOGPART_BUSINESSDESC_IDS, "business_description")
-        BLOGPART_SHORTCTA = fetch_blog_part_examples(BLOGPART_SHORTCTA_IDS, "short_cta")
+        example_sets = {
+            "{BLOGFOREXAMPLE}": fetch_blog_examples(BLOGFOREXAMPLE_IDS),
+            "{BLOGPART_INTRO}": fetch_blog_part_examples(BLOGPART_INTRO_IDS, "intro"),
+            "{BLOGPART_FINALCTA}": fetch_blog_part_examples(BLOGPART_FINALCTA_IDS, "final_cta"),
+            "{BLOGPART_FAQS}": fetch_blog_part_examples(BLOGPART_FAQS_IDS, "FAQs"),
+            "{BLOGPART_BUSINESSDESC}": fetch_blog_part_examples(BLOGPART_BUSINESSDESC_IDS, "business_description"),
+            "{BLOGPART_SHORTCTA}": fetch_blog_part_examples(BLOGPART_SHORTCTA_IDS, "short_cta"),
+        }
 
         # -----------------------------
         # Replace placeholders in prompts
         # -----------------------------
-        def replace_vars(prompt_text: str) -> str:
-            prompt_text = prompt_text or ""
-            replacements = {
-                "{TITLE}": TITLE,
-                "{KEYWORDS}": KEYWORDS,
-                "{INSERT_INTRO_QUESTION}": INSERT_INTRO_QUESTION,
-                "{INSERT_FAQ_QUESTIONS}": INSERT_FAQ_QUESTIONS,
-                "{SOURCE}": SOURCE,
-                "{BLOGFOREXAMPLE}": BLOGFOREXAMPLE,
-                "{BLOGPART_INTRO}": BLOGPART_INTRO,
-                "{BLOGPART_FINALCTA}": BLOGPART_FINALCTA,
-                "{BLOGPART_FAQS}": BLOGPART_FAQS,
-                "{BLOGPART_BUSINESSDESC}": BLOGPART_BUSINESSDESC,
-                "{BLOGPART_SHORTCTA}": BLOGPART_SHORTCTA,
-            }
-            result = prompt_text
-            for placeholder, value in replacements.items():
-                result = result.replace(placeholder, value or "")
-            return result
-
-        PROMPT_FULLBLOG_FINAL = replace_vars(PROMPT_FULLBLOG)
-        PROMPT_INTRO_FINAL = replace_vars(PROMPT_INTRO)
-        PROMPT_FINALCTA_FINAL = replace_vars(PROMPT_FINALCTA)
-        PROMPT_FULLFAQS_FINAL = replace_vars(PROMPT_FULLFAQS)
-        PROMPT_BUSINESSDESC_FINAL = replace_vars(PROMPT_BUSINESSDESC)
-        PROMPT_REFERENCES_FINAL = replace_vars(PROMPT_REFERENCES)
-        PROMPT_SHORTCTA_FINAL = replace_vars(PROMPT_SHORTCTA)
+        text_replacements = {
+            "{TITLE}": TITLE,
+            "{KEYWORDS}": KEYWORDS,
+            "{INSERT_INTRO_QUESTION}": INSERT_INTRO_QUESTION,
+            "{INSERT_FAQ_QUESTIONS}": INSERT_FAQ_QUESTIONS,
+            "{SOURCE}": SOURCE,
+        }
+
+        # -----------------------------
+        # Token budget: fit examples to each section's budget
+        # -----------------------------
+        budgeter = PromptBudgeter(example_sets, query=" ".join([TITLE, KEYWORDS, user_message]))
+        # {BLOGFOREXAMPLE} goes to the section agents once, as a shared prefix segment
+        SHARED_EXAMPLES = budgeter.fit_shared({
+            "intro": PROMPT_INTRO,
+            "finalcta": PROMPT_FINALCTA,
+            "faqs": PROMPT_FULLFAQS,
+            "businessdesc": PROMPT_BUSINESSDESC,
+            "references": PROMPT_REFERENCES,
+            "shortcta": PROMPT_SHORTCTA,
+        }, text_replacements)
+
+        def build_prompt(prompt_key: str, template: str) -> str:
+            return replace_vars(template, {**text_replacements, **budgeter.fit(prompt_key, template, text_replacements)})
+
+        PROMPT_FULLBLOG_FINAL = build_prompt("fullblog", PROMPT_FULLBLOG)
+        PROMPT_INTRO_FINAL = build_prompt("intro", PROMPT_INTRO)
+        PROMPT_FINALCTA_FINAL = build_prompt("finalcta", PROMPT_FINALCTA)
+        PROMPT_FULLFAQS_FINAL = build_prompt("faqs", PROMPT_FULLFAQS)
+        PROMPT_BUSINESSDESC_FINAL = build_prompt("businessdesc", PROMPT_BUSINESSDESC)
+        PROMPT_REFERENCES_FINAL = build_prompt("references", PROMPT_REFERENCES)
+        PROMPT_SHORTCTA_FINAL = build_prompt("shortcta", PROMPT_SHORTCTA)
 
         # -----------------------------
         # Debug summary (no giant prompt dumps)
@@ -289,23 +861,56 @@ def handle_chat():
         # -----------------------------
         # Call orchestrator
         # -----------------------------
-        bot_response = callAgents(
-            user_message,
-            COMPANY_NAME,
-            CALL_NUMBER,
-            ADDRESS,
-            STATE_NAME,
-            LINK,
-            COMPANY_EMPLOYEE,
-            PROMPT_FULLBLOG_FINAL,
-            PROMPT_INTRO_FINAL,
-            PROMPT_FINALCTA_FINAL,
-            PROMPT_FULLFAQS_FINAL,
-            PROMPT_BUSINESSDESC_FINAL,
-            PROMPT_REFERENCES_FINAL,
-            PROMPT_SHORTCTA_FINAL,
-            TEMPERATURE
-        )
+        # Drafts are kept per run so /api/chat/<run_id>/regenerate can redo single sections
+        run_id = new_run_id()
+        request_id = _request_id()
+        run_inputs = {}
+
+        def keep_run(variables, prompts, drafts):
+            run_inputs.update(variables=variables, prompts=prompts, drafts=drafts)
+
+        global _inflight_chats
+        with _inflight_lock:
+            _inflight_chats += 1
+        try:
+            with get_cancel_registry().request(request_id, _disconnect_probe(), tenant=g.tenant), retry_budget():
+                bot_response = callAgents(
+                    user_message,
+                    COMPANY_NAME,
+                    CALL_NUMBER,
+                    ADDRESS,
+                    STATE_NAME,
+                    LINK,
+                    COMPANY_EMPLOYEE,
+                    PROMPT_FULLBLOG_FINAL,
+                    PROMPT_INTRO_FINAL,
+                    PROMPT_FINALCTA_FINAL,
+                    PROMPT_FULLFAQS_FINAL,
+                    PROMPT_BUSINESSDESC_FINAL,
+                    PROMPT_REFERENCES_FINAL,
+                    PROMPT_SHORTCTA_FINAL,
+                    TEMPERATURE,
+                    on_section_done=record_section_done,
+                    compiler_mode=COMPILER_MODE,
+                    title=TITLE,
+                    on_drafts=keep_run,
+                    tenant=g.tenant,
+                    priority=g.priority,
+                    shared_examples=SHARED_EXAMPLES,
+                )
+        except Cancelled as e:
+            return _cancelled_response(request_id, e)
+        finally:
+            with _inflight_lock:
+                _inflight_chats -= 1
+
+        # Persisted by the background history writer (off the request path)
+        record_generation(user_message, bot_response)
+        if run_inputs:
+            get_draft_store().save({
+                "run_id": run_id, **run_inputs, "final": bot_response,
+                "temperature": TEMPERATURE, "compiler_mode": COMPILER_MODE, "revision": 0,
+            })
 
         # Debug: print only a short preview
         print("[API] BOT RESPONSE PREVIEW:\n", bot_response, "\n")
@@ -313,10 +918,13 @@ def handle_chat():
         return jsonify({
             "success": True,
             "response": bot_response,
+            "run_id": run_id if run_inputs else None,
+            "request_id": request_id,
             "timestamp": datetime.now().isoformat(),
             "debug_info": {
                 "blog_type": BLOGTYPE,
                 "temperature": TEMPERATURE,
+                "compiler_mode": COMPILER_MODE,
                 "examples_fetched": {
                     "full_blogs": len(BLOGFOREXAMPLE_IDS),
                     "intro_parts": len(BLOGPART_INTRO_IDS),
@@ -324,7 +932,9 @@ def handle_chat():
                     "faqs_parts": len(BLOGPART_FAQS_IDS),
                     "businessdesc_parts": len(BLOGPART_BUSINESSDESC_IDS),
                     "shortcta_parts": len(BLOGPART_SHORTCTA_IDS)
-                }
+                },
+                "auto_examples": auto_examples,
+                "prompt_budget": budgeter.report(),
             }
         }), 200
 
@@ -338,5 +948,90 @@ def handle_chat():
         return json_error("CHAT_FAILED", "Failed to process chat message", 500, details=str(e))
 
 
+@app.route("/api/chat/<run_id>/regenerate", methods=["POST"])
+@admission_controlled
+def regenerate_chat_sections(run_id: str):
+    """
+    Re-runs only the requested sections of a previous /api/chat run and recompiles.
+    Body: {"sections": ["faqs", ...], "TEMPERATURE"?: float, "COMPILER_MODE"?: str}
+    """
+    if _draining.is_set():
+        err, status = json_error("DRAINING", "Server is restarting, retry shortly.", 503)
+        err.headers["Retry-After"] = "5"
+        return err, status
+
+    data = request.get_json(silent=True) or {}
+    sections = data.get("sections")
+    if isinstance(sections, str):
+        sections = [sections]
+    if not sections or not isinstance(sections, list) or any(s not in SECTION_NAMES for s in sections):
+        return json_error("BAD_SECTIONS", f"sections must be a non-empty list of: {', '.join(SECTION_NAMES)}", 400)
+
+    try:
+        run = get_draft_store().get(run_id)
+        if run is None:
+            return json_error("RUN_NOT_FOUND", "No stored drafts for this run (expired or unknown run_id).", 404)
+
+        try:
+            temperature = float(data.get("TEMPERATURE", run["temperature"]))
+        except (TypeError, ValueError):
+            temperature = float(run["temperature"])
+        try:
+            compiler_mode = resolve_compiler_mode(data.get("COMPILER_MODE") or run["compiler_mode"])
+        except ValueError as e:
+            return json_error("BAD_COMPILER_MODE", str(e), 400)
+
+        global _inflight_chats
+        with _inflight_lock:
+            _inflight_chats += 1
+        request_id = _request_id()
+        try:
+            with get_cancel_registry().request(request_id, _disconnect_probe(), tenant=g.tenant), retry_budget():
+                bot_response, drafts = regenerate_sections(
+                    run["variables"], run["prompts"], run["drafts"], sections, temperature,
+                    on_section_done=record_section_done, compiler_mode=compiler_mode,
+                    tenant=g.tenant, priority=g.priority,
+                )
+        except Cancelled as e:
+            return _cancelled_response(request_id, e)
+        finally:
+            with _inflight_lock:
+                _inflight_chats -= 1
+
+        revision = int(run.get("revision") or 0) + 1
+        saved = get_draft_store().save({
+            **run, "drafts": drafts, "final": bot_response,
+            "temperature": temperature, "compiler_mode": compiler_mode, "revision": revision,
+        })
+        if not saved:
+            # Another request revised the same base first; never overwrite its edit
+            return json_error(
+                "RUN_CONFLICT", f"Revision {revision} of this run was already saved by another request; retry.", 409,
+                revision=revision,
+            )
+        record_generation(run["variables"].get("USER_MESSAGE", ""), bot_response)
+
+        return jsonify({
+            "success": True,
+            "response": bot_response,
+            "run_id": run_id,
+            "revision": revision,
+            "request_id": request_id,
+            "regenerated": list(dict.fromkeys(sections)),
+            "timestamp": datetime.now().isoformat(),
+        }), 200
+
+    except PoolError as e:
+        return json_error("POOL_EXHAUSTED", "Database connection pool exhausted", 500, details=str(e))
+    except psycopg2.Error as e:
+        app.logger.error(f"Database error in regenerate endpoint: {e}")
+        return json_error("DB_ERROR", "Database operation failed", 500, details=str(e))
+    except Exception as e:
+        app.logger.error(f"Regenerate endpoint error: {e}")
+        return json_error("REGENERATE_FAILED", "Failed to regenerate sections", 500, details=str(e))
+
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=10000, debug=False)
+    # Development server only; production runs `gunicorn -c gunicorn.conf.py wsgi:application`
+    start_background_warmup()
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "10000")), debug=False, threaded=True)
@@ -0,0 +1,292 @@
+'''
+microbench.py
+Micro-benchmarks for the CPU-side work of a /api/chat request: prompt
+substitution, the orchestrator -> compiler handoff, compiler input assembly,
+output cleaning and validation. LLM calls are not involved.
+
+Inputs are generated deterministically at realistic sizes (multi-KB examples
+and drafts), so numbers are comparable between runs on the same machine.
+
+    python -m benchmarks.microbench                     # run + compare with benchmarks/baseline.json
+    python -m benchmarks.microbench --save-baseline     # run + overwrite the baseline
+    python -m benchmarks.microbench -k compiler --json  # subset, machine-readable output
+
+Exit status is 1 when any benchmark is slower than baseline x --threshold,
+so the command can gate CI. Baselines are per machine: re-save after
+moving to other hardware or another Python version.
+'''
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from chatbots.orchestrater import _build_compiler_input as _compiler_handoff, _build_compiler_prompt
+from chatbots.FullAgents import (
+    CompilerInput,
+    _build_compiler_input,
+    _compiler_issues,
+    _local_repair as compiler_local_repair,
+    _parse_tagged_prompt,
+    _strip_code_fences_and_meta,
+)
+from chatbots.SingularAgents import _clean_output, _local_repair as section_local_repair, _section_issues
+from chatbots.prompt_budget import EXAMPLE_PLACEHOLDERS, format_examples, replace_vars
+from chatbots.repair import common_issues
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 1.5    # min time above baseline x this -> regression (shared runners jitter ~25%)
+REPEAT = 7                 # timing rounds per benchmark; the fastest is compared (least scheduler noise)
+MIN_ROUND_S = 0.05         # each round runs the function this long at least
+SEED = 1234
+
+_WORDS = """
+accident claim insurance medical records evidence injury settlement lawyer client
+policy coverage deadline witness report treatment hospital negotiation liability
+damages compensation consultation document statement timeline appeal adjuster
+""".split()
+
+
+# -----------------------------
+# INPUTS
+# -----------------------------
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 18))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random, sentences: int = 5) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def _article(rng: random.Random, sections: int) -> str:
+    parts = ["# " + _sentence(rng)[:-1]]
+    for _ in range(sections):
+        parts.append("## " + _sentence(rng)[:-1])
+        parts.extend(_paragraph(rng) for _ in range(3))
+    return "\n\n".join(parts)
+
+
+def _faqs(rng: random.Random, n: int) -> str:
+    return "\n\n".join(f"### {_sentence(rng)[:-1]}?\n{_paragraph(rng, 3)}" for _ in range(n))
+
+
+def make_inputs(seed: int = SEED) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    drafts = {
+        "intro": "\n\n".join(_paragraph(rng) for _ in range(3)),
+        "faqs": _faqs(rng, 8),
+        "business_description": "## About Acme Law\n\n" + "\n\n".join(_paragraph(rng) for _ in range(3)),
+        "short_cta": _paragraph(rng, 2),
+        "final_cta": "## Take the Next Step\n\n" + _paragraph(rng, 4),
+        "integrate_references": "## References\n" + "\n".join(f"- {_sentence(rng)}" for _ in range(8)),
+    }
+    variables = {
+        "USER_MESSAGE": _paragraph(rng, 4),
+        "COMPANY_NAME": "Acme Law",
+        "CALL_NUMBER": "+1 555 0100",
+        "ADDRESS": "1 Main St, Springfield",
+        "STATE_NAME": "Illinois",
+        "LINK": "https://example.com",
+        "COMPANY_EMPLOYEE": "Jordan Lee",
+    }
+    requirements = "\n".join(f"- {_sentence(rng)}" for _ in range(60))
+    template = "\n\n".join([
+        "Write the blog titled {TITLE} using the keywords {KEYWORDS}.",
+        requirements,
+        "Answer {INSERT_INTRO_QUESTION} and cover {INSERT_FAQ_QUESTIONS}. Cite {SOURCE}.",
+        *[f"Examples for {p}:\n{p}" for p in EXAMPLE_PLACEHOLDERS],
+    ])
+    replacements = {
+        "{TITLE}": _sentence(rng)[:-1],
+        "{KEYWORDS}": ", ".join(rng.sample(_WORDS, 6)),
+        "{INSERT_INTRO_QUESTION}": _sentence(rng)[:-1] + "?",
+        "{INSERT_FAQ_QUESTIONS}": " ".join(_sentence(rng)[:-1] + "?" for _ in range(5)),
+        "{SOURCE}": "https://example.gov/guidance",
+        **{p: format_examples([_article(rng, 4) for _ in range(3)]) for p in EXAMPLE_PLACEHOLDERS},
+    }
+    blog = _article(rng, 8) + "\n\n" + drafts["faqs"] + "\n\n" + drafts["final_cta"]
+    # What a misbehaving model returns: a label, fences, assignment lines and an echoed tag block
+    messy = "\n".join([
+        "Assistant: Here is the blog.",
+        "```markdown",
+        blog,
+        "```",
+        "COMPANY_NAME = Acme Law",
+        "<<DRAFT_INTRO>>",
+        drafts["intro"],
+        "",
+        "SECTION CONTENTS:",
+        blog.replace("# ", "", 1),
+    ])
+    messy_faqs = "\n\n".join(f"{_sentence(rng)[:-1]}?\n{_paragraph(rng, 3)}" for _ in range(8))
+    tagged_prompt = _build_compiler_prompt(requirements, variables, drafts)
+    return {
+        "template": template,
+        "replacements": replacements,
+        "requirements": requirements,
+        "variables": variables,
+        "drafts": drafts,
+        "tagged_prompt": tagged_prompt,
+        "compiler_input": CompilerInput.from_tagged(tagged_prompt),
+        "blog": blog,
+        "messy": messy,
+        "messy_faqs": messy_faqs,
+    }
+
+
+# -----------------------------
+# BENCHMARKS
+# -----------------------------
+def _typed_roundtrip(x: CompilerInput) -> CompilerInput:
+    """CompilerInput -> tagged string -> CompilerInput; must give back the same input."""
+    y = CompilerInput.from_tagged(x.to_tagged())
+    if y != x:
+        diff = [f for f in CompilerInput._fields if getattr(x, f) != getattr(y, f)]
+        raise AssertionError(f"tagged round trip changed {', '.join(diff)}")
+    return y
+
+
+def check_roundtrip(inp: Dict[str, Any]) -> None:
+    """Round-trips the benchmark input plus variants with empty drafts (empty last block included)."""
+    x = inp["compiler_input"]
+    drafts = ("intro", "faqs", "business_description", "short_cta", "final_cta", "references")
+    variants = [x, CompilerInput(), x._replace(references=""), x._replace(**{f: "" for f in drafts})]
+    variants += [x._replace(**{f: ""}) for f in drafts]
+    for v in variants:
+        _typed_roundtrip(v)
+
+
+def benchmarks(inp: Dict[str, Any]) -> Dict[str, Callable[[], Any]]:
+    """name -> zero-argument callable; names are the baseline keys, so keep them stable."""
+    return {
+        "replace_vars": lambda: replace_vars(inp["template"], inp["replacements"]),
+        "compiler_prompt.build": lambda: _build_compiler_prompt(inp["requirements"], inp["variables"], inp["drafts"]),
+        "compiler_prompt.parse": lambda: _parse_tagged_prompt(inp["tagged_prompt"]),
+        "compiler_prompt.roundtrip": lambda: _parse_tagged_prompt(
+            _build_compiler_prompt(inp["requirements"], inp["variables"], inp["drafts"])
+        ),
+        "compiler_input.roundtrip": lambda: _typed_roundtrip(inp["compiler_input"]),
+        "compiler_handoff.typed": lambda: _compiler_handoff(inp["requirements"], inp["variables"], inp["drafts"]),
+        "compiler_input.build": lambda: _build_compiler_input(inp["compiler_input"]),
+        "sanitize.section_clean": lambda: _clean_output(inp["messy"]),
+        "sanitize.compiler_strip": lambda: _strip_code_fences_and_meta(inp["messy"]),
+        "validate.common_issues": lambda: common_issues(inp["blog"]),
+        "validate.section_faqs": lambda: _section_issues("faqs", inp["drafts"]["faqs"]),
+        "validate.compiler": lambda: _compiler_issues(inp["blog"]),
+        "repair.section_faqs_local": lambda: section_local_repair("faqs", inp["messy_faqs"]),
+        "repair.compiler_local": lambda: compiler_local_repair(inp["messy"]),
+    }
+
+
+def measure(fn: Callable[[], Any], repeat: int = REPEAT) -> Dict[str, float]:
+    """Per-call microseconds over `repeat` rounds, each at least MIN_ROUND_S long."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        if timer.timeit(number) >= MIN_ROUND_S:
+            break
+        number *= 2
+    rounds = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_us": round(statistics.median(rounds), 2),
+        "min_us": round(min(rounds), 2),
+        "stdev_us": round(statistics.stdev(rounds), 2) if len(rounds) > 1 else 0.0,
+        "loops": number,
+    }
+
+
+# -----------------------------
+# BASELINE
+# -----------------------------
+def _machine() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]], sizes: Dict[str, int]) -> None:
+    data = {"saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": _machine(), "input_chars": sizes, "results": results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any], threshold: float) -> List[Tuple[str, float, Optional[float], str]]:
+    """(name, median_us, ratio of min_us to the baseline's or None, status) per benchmark."""
+    base = baseline.get("results", {})
+    rows = []
+    for name, r in results.items():
+        b = base.get(name)
+        if not b:
+            rows.append((name, r["median_us"], None, "new"))
+            continue
+        ratio = r["min_us"] / b["min_us"] if b["min_us"] else 1.0
+        status = "REGRESSED" if ratio > threshold else "faster" if ratio < 1 / threshold else "ok"
+        rows.append((name, r["median_us"], ratio, status))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.microbench", description=__doc__.strip().splitlines()[1])
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    inp = make_inputs()
+    check_roundtrip(inp)
+    sizes = {k: len(v) for k, v in inp.items() if isinstance(v, str)}
+    results = {
+        name: measure(fn, args.repeat)
+        for name, fn in benchmarks(inp).items()
+        if args.filter in name
+    }
+
+    baseline = load_baseline(args.baseline)
+    if args.save_baseline:
+        if args.filter and baseline:
+            results = {**baseline.get("results", {}), **results}
+        save_baseline(args.baseline, results, sizes)
+
+    rows = compare(results, baseline, args.threshold)
+    if args.json:
+        print(json.dumps({"machine": _machine(), "results": results, "baseline_machine": baseline.get("machine")}, indent=2))
+    else:
+        if baseline.get("machine") and baseline["machine"] != _machine():
+            print(f"note: baseline was recorded on {baseline['machine']}")
+        print(f"{'benchmark':<30} {'median':>12} {'min vs base':>12}  status")
+        for name, median_us, ratio, status in rows:
+            vs = f"{ratio:.2f}x" if ratio is not None else "-"
+            print(f"{name:<30} {median_us:>10.1f}us {vs:>12}  {status}")
+        if args.save_baseline:
+            print(f"baseline saved -> {args.baseline}")
+    regressed = [name for name, _, _, status in rows if status == "REGRESSED"]
+    return 1 if regressed and not args.save_baseline else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,26 +2,35 @@
 from __future__ import annotations
 print("[FullAgents] LOADED FROM:", __file__)
 
-import os
 import time
-import random
 import re
-from typing import Tuple, Optional, Any, List, Dict
-
-from langchain_together import Together
-from langchain_core.messages import SystemMessage, HumanMessage
-
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    pass
+from typing import TYPE_CHECKING, Tuple, Any, List, Dict, NamedTuple
+
+from chatbots.llm_runtime import load_env, together_cls, chat_messages, together_api_key, warm_llm_clients
+from chatbots.llm_usage import record_llm_call, usage_from_output, estimate_tokens
+from chatbots.retry_policy import RetryError, RetryPolicy, run_with_retries
+from chatbots.llm_cassette import with_cassette
+from chatbots.live_status import llm_call
+from chatbots.message_assembly import (
+    AssembledMessages, Segment, assemble, observe_prefix, STATIC, REQUEST, CALL,
+)
+from chatbots.repair import (
+    apply_fixers, common_issues, legacy_repair_tokens, promote_title, record_checked, record_repair,
+    repair_instruction, strip_label_lines, unwrap_fences, unwrap_json,
+)
+
+if TYPE_CHECKING:
+    from langchain_together import Together
+
+load_env()
 
 DEBUGGING_MODE = True
 
 # Compiler model
 COMPILER_MODEL = "deepseek-ai/DeepSeek-V3"
 FULL_TEXT_MAX_TOKENS = 3584
+# The compiler's output is long, so it gets a larger budget than a section
+COMPILER_RETRY = RetryPolicy("compiler", max_attempts=4, base_s=0.5, cap_s=10.0, budget_s=60.0)
 
 
 # ----------------------------
@@ -50,11 +59,9 @@ Merge the section drafts into one cohesive blog with clean headings and transiti
 # ----------------------------
 # LLM + UTILS
 # ----------------------------
-def _make_llm(temperature: float, max_tokens: int) -> Together:
-    api_key = os.getenv("TOGETHER_API_KEY") or os.getenv("TOGETHERAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing TOGETHER_API_KEY in environment.")
-    return Together(
+def _build_llm(temperature: float, max_tokens: int) -> Together:
+    api_key = together_api_key()
+    return together_cls()(
         model=COMPILER_MODEL,
         temperature=temperature,
         max_tokens=max_tokens,
@@ -62,25 +69,111 @@ def _make_llm(temperature: float, max_tokens: int) -> Together:
     )
 
 
-def _invoke_with_retries(llm: Together, messages: List[Any], attempts: int = 4) -> str:
-    last_err: Optional[Exception] = None
-    for i in range(attempts):
-        try:
+def _make_llm(temperature: float, max_tokens: int) -> Together:
+    return with_cassette(COMPILER_MODEL, max_tokens, lambda: _build_llm(temperature, max_tokens))
+
+
+def warm_up() -> Dict[str, Any]:
+    """Loads the LLM stack off the request path (startup warm-up hook)."""
+    return warm_llm_clients(lambda: _make_llm(temperature=0.0, max_tokens=1))
+
+
+def _messages_text(messages: List[Any]) -> str:
+    return "\n".join(str(getattr(m, "content", m) or "") for m in messages)
+
+
+def _invoke_with_retries(llm: Together, msgs: AssembledMessages, attempts: int = 4, kind: str = "compiler") -> str:
+    messages = chat_messages(msgs.system_text, msgs.user_text)
+    observe_prefix(COMPILER_MODEL, msgs)
+    t_start = time.time()
+
+    def _call() -> Tuple[Any, str]:
+        with llm_call(COMPILER_MODEL):
             out = llm.invoke(messages)
-            if isinstance(out, str):
-                return out
-            if hasattr(out, "content"):
-                return out.content or ""
-            return str(out)
-        except Exception as e:
-            last_err = e
-            time.sleep(0.5 + random.random() * 0.9)
-            if DEBUGGING_MODE:
-                print(f"[FullAgents] invoke attempt {i+1}/{attempts} failed: {e}")
-    raise RuntimeError(f"Compiler invocation failed after {attempts} attempts: {last_err}")
+        if isinstance(out, str):
+            return out, out
+        if hasattr(out, "content"):
+            return out, out.content or ""
+        return out, str(out)
+
+    try:
+        (out, raw), used = run_with_retries(_call, COMPILER_RETRY._replace(max_attempts=attempts), label=f"compiler/{kind}")
+    except RetryError as e:
+        record_llm_call(
+            "compiler", kind, COMPILER_MODEL, _messages_text(messages), "",
+            latency_ms=(time.time() - t_start) * 1000, attempts=e.attempts, success=False,
+        )
+        raise RuntimeError(f"Compiler invocation failed: {e}") from e.last
+    record_llm_call(
+        "compiler", kind, COMPILER_MODEL, _messages_text(messages), raw,
+        latency_ms=(time.time() - t_start) * 1000, attempts=used,
+        usage=usage_from_output(out),
+    )
+    return raw
 
 
-_TAG_RE = re.compile(r"<<([A-Z0-9_]+)>>\n(.*?)(?=\n<<[A-Z0-9_]+>>\n|\Z)", re.S)
+# ----------------------------
+# COMPILER INPUT
+# ----------------------------
+class CompilerInput(NamedTuple):
+    """
+    Everything the compiler needs, handed over in-process. Drafts are passed
+    as-is: no tag serialization, so a draft line that looks like `<<TAG>>`
+    can't split or swallow another block.
+    """
+    blog_requirements: str = ""
+    user_message: str = ""
+    business_context: str = ""
+    intro: str = ""
+    faqs: str = ""
+    business_description: str = ""
+    short_cta: str = ""
+    final_cta: str = ""
+    references: str = ""
+
+    @classmethod
+    def from_drafts(cls, blog_requirements: str, user_message: str, business_context: str,
+                    drafts: Dict[str, str]) -> "CompilerInput":
+        """drafts is keyed by section name (intro, faqs, ..., integrate_references)."""
+        return cls(
+            blog_requirements=(blog_requirements or "").strip(),
+            user_message=(user_message or "").strip(),
+            business_context=(business_context or "").strip(),
+            intro=(drafts.get("intro") or "").strip(),
+            faqs=(drafts.get("faqs") or "").strip(),
+            business_description=(drafts.get("business_description") or "").strip(),
+            short_cta=(drafts.get("short_cta") or "").strip(),
+            final_cta=(drafts.get("final_cta") or "").strip(),
+            references=(drafts.get("integrate_references") or "").strip(),
+        )
+
+    @classmethod
+    def from_tagged(cls, text: str) -> "CompilerInput":
+        tagged = _parse_tagged_prompt(text)
+        return cls(**{field: tagged.get(tag, "") for tag, field in COMPILER_TAGS.items()})
+
+    def to_tagged(self) -> str:
+        """The legacy `<<TAG>>` string (for callers of Full_Blog_Writer)."""
+        return "".join(f"<<{tag}>>\n{getattr(self, field)}\n" for tag, field in COMPILER_TAGS.items()).strip()
+
+
+# Tagged-string format: tag -> CompilerInput field, in block order
+COMPILER_TAGS: Dict[str, str] = {
+    "BLOG_REQUIREMENTS": "blog_requirements",
+    "USER_MESSAGE": "user_message",
+    "BUSINESS_CONTEXT": "business_context",
+    "DRAFT_INTRO": "intro",
+    "DRAFT_BODY_FAQS": "faqs",
+    "DRAFT_BUSINESS_DESCRIPTION": "business_description",
+    "DRAFT_SHORT_CTA": "short_cta",
+    "DRAFT_FINAL_CTA": "final_cta",
+    "DRAFT_REFERENCES": "references",
+}
+
+# A block ends only at a known tag, so `<<OTHER>>` lines inside a draft stay in the draft.
+# The last tag may end the string (to_tagged strips), so an empty last block still ends the one before it.
+_KNOWN_TAG = "|".join(COMPILER_TAGS)
+_TAG_RE = re.compile(rf"<<([A-Z0-9_]+)>>(?:\n|\Z)(.*?)(?=\n<<(?:{_KNOWN_TAG})>>(?:\n|\Z)|\Z)", re.S)
 
 
 def _parse_tagged_prompt(text: str) -> Dict[str, str]:
@@ -137,96 +230,133 @@ def _strip_code_fences_and_meta(text: str) -> str:
 
     return t.strip()
 
-def _looks_invalid(text: str) -> bool:
+# HARD REJECT: prompt/draft bundle formats
+_BAD_MARKERS = (
+    "SECTION CONTENTS:",
+    "INTRODUCTION DRAFT:",
+    "FAQ DRAFT:",
+    "FINAL CTA DRAFT:",
+    "BUSINESS DESCRIPTION DRAFT:",
+    "LEGAL_FIELD:",
+)
+
+
+def _compiler_issues(text: str) -> List[str]:
     t = (text or "").strip()
+    issues = common_issues(t)
     if not t:
-        return True
-    if "```" in t:
-        return True
-    if t.startswith("{") or t.startswith("["):
-        return True
-    if t.lower().startswith(("assistant:", "ai:", "response:", "output:")):
-        return True
-
-    # HARD REJECT: prompt/draft bundle formats
-    bad_markers = [
-        "SECTION CONTENTS:",
-        "INTRODUCTION DRAFT:",
-        "FAQ DRAFT:",
-        "FINAL CTA DRAFT:",
-        "BUSINESS DESCRIPTION DRAFT:",
-        "LEGAL_FIELD:",
-    ]
-    if any(m in t for m in bad_markers):
-        return True
-
+        return issues
+    found = [m for m in _BAD_MARKERS if m in t]
+    if found:
+        issues.append("Remove the draft/scaffolding labels: " + ", ".join(found))
     # Require real blog structure: must have a title heading
     if not (t.startswith("# ") or "\n# " in t):
-        return True
+        issues.append("Add a single '# ' title line at the top.")
+    return issues
+
+
+def _looks_invalid(text: str) -> bool:
+    return bool(_compiler_issues(text))
+
 
-    return False
+def _local_repair(raw: str) -> Tuple[str, List[str]]:
+    """Deterministic fixes: JSON/fence unwrapping, cleaning, label stripping, title promotion."""
+    t, applied = apply_fixers(raw or "", (("json", unwrap_json), ("fences", unwrap_fences)),
+                              lambda x: common_issues(x.strip()))
+    t = _strip_code_fences_and_meta(t)
+    t, more = apply_fixers(t, (
+        ("labels", lambda x: strip_label_lines(x, _BAD_MARKERS)),
+        ("title", promote_title),
+    ), _compiler_issues)
+    return t, applied + more
 
 
-def _build_compiler_input(tagged: Dict[str, str]) -> str:
+def _compiler_segments(inp: CompilerInput) -> Tuple[Segment, ...]:
     """
-    Deterministic compiler input.
+    Deterministic compiler input, most stable blocks first (requirements and
+    context before the drafts) so repair calls share the first call's prefix.
     IMPORTANT: include BLOG_REQUIREMENTS as constraints without asking to echo it.
     """
-    blog_req = tagged.get("BLOG_REQUIREMENTS", "")
-    user_msg = tagged.get("USER_MESSAGE", "")
-    ctx = tagged.get("BUSINESS_CONTEXT", "")
-
-    parts = [
-        "BLOG REQUIREMENTS (CONSTRAINTS ONLY — DO NOT ECHO VERBATIM):",
-        blog_req,
-        "",
-        "BLOG CONTEXT:",
-        ctx,
-        "",
-        "USER MESSAGE:",
-        user_msg,
-        "",
+    drafts = [
         "SECTION DRAFTS (use these; do not invent facts):",
         "",
         "--- INTRO ---",
-        tagged.get("DRAFT_INTRO", ""),
+        inp.intro,
         "",
         "--- BODY / FAQs ---",
-        tagged.get("DRAFT_BODY_FAQS", ""),
+        inp.faqs,
         "",
         "--- BUSINESS DESCRIPTION ---",
-        tagged.get("DRAFT_BUSINESS_DESCRIPTION", ""),
+        inp.business_description,
         "",
         "--- SHORT CTA ---",
-        tagged.get("DRAFT_SHORT_CTA", ""),
+        inp.short_cta,
         "",
         "--- FINAL CTA ---",
-        tagged.get("DRAFT_FINAL_CTA", ""),
+        inp.final_cta,
         "",
         "--- REFERENCES ---",
-        tagged.get("DRAFT_REFERENCES", ""),
+        inp.references,
     ]
-    return "\n".join(parts).strip()
+    return (
+        Segment("requirements", "BLOG REQUIREMENTS (CONSTRAINTS ONLY — DO NOT ECHO VERBATIM):\n"
+                + inp.blog_requirements, REQUEST),
+        Segment("context", "BLOG CONTEXT:\n" + inp.business_context, REQUEST),
+        Segment("user_message", "USER MESSAGE:\n" + inp.user_message, REQUEST),
+        Segment("drafts", "\n".join(drafts).strip(), CALL),
+    )
+
+
+def _build_compiler_input(inp: CompilerInput) -> str:
+    return assemble(system=(), user=_compiler_segments(inp)).user_text.strip()
 
 
-def _repair_output(llm: Together, compiler_in: str, bad_output: str) -> str:
-    repair_sys = SYSTEM_DIRECTIVE_COMPILER + "\n\nReturn ONLY the blog in Markdown. No meta. Do not echo requirements."
-    repair_user = (
-        "Rewrite the full blog output correctly.\n\n"
-        "COMPILER INPUT:\n"
-        f"{compiler_in}\n\n"
-        "BAD OUTPUT (do not keep bad formatting/meta/requirements echo):\n"
-        f"{bad_output}"
+def _compiler_messages(compiler_segs: Tuple[Segment, ...], tail: Tuple[Segment, ...] = ()) -> AssembledMessages:
+    return assemble(
+        system=[Segment("directive", SYSTEM_DIRECTIVE_COMPILER, STATIC)],
+        user=[*compiler_segs, *tail],
     )
-    raw = _invoke_with_retries(llm, [SystemMessage(content=repair_sys), HumanMessage(content=repair_user)], attempts=2)
-    return _strip_code_fences_and_meta(raw)
 
 
-def _validate_and_repair(llm: Together, raw: str, compiler_in: str) -> str:
+def _repair_output(llm: Together, compiler_segs: Tuple[Segment, ...], draft: str) -> Tuple[str, int]:
+    """
+    Edit-list repair: the compiler directive plus only the draft and what to fix.
+    The full compiler input is re-sent (unchanged, so prefix-cached) only when
+    there is no draft to edit.
+    """
+    if draft:
+        tail = (
+            Segment("draft", f"DRAFT:\n{draft}", CALL),
+            Segment("repair", repair_instruction(_compiler_issues(draft)), CALL),
+        )
+        msgs = _compiler_messages((), tail)
+    else:
+        msgs = _compiler_messages(compiler_segs)
+    raw = _invoke_with_retries(llm, msgs, attempts=2, kind="repair")
+    out, _ = _local_repair(raw)
+    return out, estimate_tokens(msgs.system_text) + estimate_tokens(msgs.user_text)
+
+
+def _validate_and_repair(llm: Together, raw: str, compiler_segs: Tuple[Segment, ...]) -> str:
     out = _strip_code_fences_and_meta(raw)
 
-    if _looks_invalid(out):
-        out = _repair_output(llm, compiler_in, out)
+    invalid = _looks_invalid(out)
+    record_checked("compiler", invalid)
+    if invalid:
+        compiler_in = assemble(system=(), user=compiler_segs).user_text
+        legacy = legacy_repair_tokens(SYSTEM_DIRECTIVE_COMPILER, compiler_in, out)
+        fixed, applied = _local_repair(raw)
+        if not _looks_invalid(fixed):
+            record_repair("compiler", "local", True, legacy + estimate_tokens(fixed))
+            if DEBUGGING_MODE:
+                print(f"[FullAgents] fixed locally | {','.join(applied) or 'clean'}")
+            out = fixed
+        else:
+            draft = fixed or out
+            repaired, sent = _repair_output(llm, compiler_segs, draft)
+            ok = not _looks_invalid(repaired)
+            record_repair("compiler", "compact" if draft else "regenerated", ok, legacy - sent)
+            out = repaired or draft
 
     # Final hard guard
     out = _strip_code_fences_and_meta(out)
@@ -248,39 +378,37 @@ def _validate_and_repair(llm: Together, raw: str, compiler_in: str) -> str:
 
 
 # ----------------------------
-# PUBLIC FUNCTION
+# PUBLIC FUNCTIONS
 # ----------------------------
+def Compile_Blog(compiler_input: CompilerInput, temperature: float) -> str:
+    """
+    Final compiler agent, typed entry point (used by the orchestrator).
+    Returns: compiled_markdown
+    """
+    print("[FullAgents] Compile_Blog CALLED")
+
+    llm = _make_llm(temperature=temperature, max_tokens=FULL_TEXT_MAX_TOKENS)
+    compiler_segs = _compiler_segments(compiler_input)
+
+    if DEBUGGING_MODE:
+        print(f"[FullAgents] compiler_in chars={sum(len(seg.text) for seg in compiler_segs)}")
+        # Do not print full compiler input (too large); print block sizes
+        print("[FullAgents] blocks:", {k: len(v) for k, v in compiler_input._asdict().items()})
+
+    raw = _invoke_with_retries(llm, _compiler_messages(compiler_segs), attempts=4)
+    return _validate_and_repair(llm, raw, compiler_segs)
+
+
 def Full_Blog_Writer(prompt: str, temperature: float) -> Tuple[str, str]:
     """
-    Final compiler agent.
-    Expects orchestrator to send a tagged prompt with:
+    Final compiler agent, string entry point (kept for compatibility).
+    Expects a tagged prompt with:
       <<BLOG_REQUIREMENTS>>
       <<USER_MESSAGE>>
       <<BUSINESS_CONTEXT>>
       <<DRAFT_*>> blocks
+    Prefer Compile_Blog(CompilerInput(...)), which skips the tag round trip.
     Returns: (used_prompt, compiled_markdown)
     """
     print("[FullAgents] Full_Blog_Writer CALLED")
-
-    llm = _make_llm(temperature=temperature, max_tokens=FULL_TEXT_MAX_TOKENS)
-
-    tagged = _parse_tagged_prompt(prompt)
-    compiler_in = _build_compiler_input(tagged)
-
-    if DEBUGGING_MODE:
-        print(f"[FullAgents] compiler_in chars={len(compiler_in)}")
-        # Do not print full compiler input (too large); print tag presence
-        print("[FullAgents] tags present:",
-              {k: (len(v) if isinstance(v, str) else 0) for k, v in tagged.items() if k in {
-                  "BLOG_REQUIREMENTS","USER_MESSAGE","BUSINESS_CONTEXT",
-                  "DRAFT_INTRO","DRAFT_BODY_FAQS","DRAFT_BUSINESS_DESCRIPTION",
-                  "DRAFT_SHORT_CTA","DRAFT_FINAL_CTA","DRAFT_REFERENCES"
-              }})
-
-    messages = [
-        SystemMessage(content=SYSTEM_DIRECTIVE_COMPILER),
-        HumanMessage(content=compiler_in),
-    ]
-    raw = _invoke_with_retries(llm, messages, attempts=4)
-    final = _validate_and_repair(llm, raw, compiler_in)
-    return prompt, final
+    return prompt, Compile_Blog(CompilerInput.from_tagged(prompt), temperature)
@@ -1,21 +1,28 @@
 # chatbots/SingularAgents.py
 from __future__ import annotations
 
-import os
 import re
 import time
-import random
-import threading
-from typing import Tuple, Optional, Dict, Any, List
+from typing import TYPE_CHECKING, Tuple, Optional, Dict, Any, List
 
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_together import Together
+from chatbots.llm_runtime import load_env, together_cls, chat_messages, together_api_key
+from chatbots.llm_usage import record_llm_call, usage_from_output, estimate_tokens
+from chatbots.retry_policy import RetryError, RetryPolicy, run_with_retries
+from chatbots.shared_state import NS_ROUTER, get_shared_state
+from chatbots.llm_cassette import with_cassette
+from chatbots.live_status import llm_call, mark_section
+from chatbots.message_assembly import (
+    AssembledMessages, Segment, assemble, observe_prefix, STATIC, SHARED, SECTION, REQUEST, CALL,
+)
+from chatbots.repair import (
+    Fixer, apply_fixers, common_issues, ensure_heading, legacy_repair_tokens, question_headings,
+    record_checked, record_repair, repair_instruction, unwrap_fences, unwrap_json,
+)
 
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except Exception:
-    pass
+if TYPE_CHECKING:
+    from langchain_together import Together
+
+load_env()
 
 
 # ============================================================
@@ -30,8 +37,8 @@ BUSINESS_DESC_MAX_TOKENS = 768
 SHORT_CTA_MAX_TOKENS = 256
 REFERENCES_MAX_TOKENS = 512
 
-MAX_ATTEMPTS = 4
-BASE_BACKOFF_S = 0.6
+# Retries: error classification, Retry-After and jittered backoff live in chatbots/retry_policy.py
+SECTION_RETRY = RetryPolicy("section", max_attempts=4, base_s=0.6, cap_s=8.0, budget_s=30.0)
 
 
 # ============================================================
@@ -51,9 +58,11 @@ _COMMON_GUARDRAILS = """GLOBAL RULES (MANDATORY):
 - If you are unsure, stay general and practical; do NOT hallucinate.
 """
 
-_SECTION_SYSTEM: Dict[str, str] = {
-    "intro": f"""You write blog introductions for legal/health businesses.
-{_COMMON_GUARDRAILS}
+# Guardrails go first (identical for every section and request), then the
+# request's reference examples (identical for its six section calls), then the
+# section's own role and rules, so calls share the longest possible prefix.
+_SECTION_RULES: Dict[str, str] = {
+    "intro": """You write blog introductions for legal/health businesses.
 
 SECTION RULES:
 - 1–2 short paragraphs.
@@ -62,8 +71,7 @@ SECTION RULES:
 - Keep it concrete. No drifting to unrelated topics.
 """,
 
-    "final_cta": f"""You write the FINAL Call-To-Action for a legal/health blog.
-{_COMMON_GUARDRAILS}
+    "final_cta": """You write the FINAL Call-To-Action for a legal/health blog.
 
 SECTION RULES:
 - Start with a heading (## or ###).
@@ -72,8 +80,7 @@ SECTION RULES:
 - No exaggerated claims ("guarantee", "best", "win every case") unless provided.
 """,
 
-    "faqs": f"""You write an FAQ section for a legal/health blog.
-{_COMMON_GUARDRAILS}
+    "faqs": """You write an FAQ section for a legal/health blog.
 
 SECTION RULES:
 - 4–7 Q/A pairs.
@@ -82,18 +89,16 @@ SECTION RULES:
 - If the prompt contains explicit FAQ questions, answer those. Otherwise, generate relevant FAQs from the user message.
 """,
 
-    "business_description": f"""You write a business description block for the company.
-{_COMMON_GUARDRAILS}
+    "business_description": """You write a business description block for the company.
 
 SECTION RULES:
-- Heading: "## About {{COMPANY_NAME}}" OR "## About the Firm" (use placeholders if provided).
+- Heading: "## About {COMPANY_NAME}" OR "## About the Firm" (use placeholders if provided).
 - 1–2 paragraphs only.
 - Mention location/state and what the company helps with, based on prompt.
 - Keep it credible, specific, and aligned to the blog topic.
 """,
 
-    "short_cta": f"""You write a SHORT CTA snippet that fits mid-article.
-{_COMMON_GUARDRAILS}
+    "short_cta": """You write a SHORT CTA snippet that fits mid-article.
 
 SECTION RULES:
 - 1–2 very short sentences (or 2 short lines).
@@ -101,41 +106,54 @@ SECTION RULES:
 - Do NOT include phone/address unless the prompt explicitly requires it.
 """,
 
-    "integrate_references": f"""You write a references/resources block.
-{_COMMON_GUARDRAILS}
+    "integrate_references": """You write a references/resources block.
 
 SECTION RULES:
 - Output a section:
   "## References" then 3–6 bullet points.
-- If prompt provides a {{SOURCE}} or reference hints, use them.
+- If prompt provides a {SOURCE} or reference hints, use them.
 - If no sources are provided, output generic credible source CATEGORIES (no fabricated URLs):
   e.g., "State health department guidance", "CDC / NIH topic page", "Insurance policy documents".
 - Do NOT invent URLs, statute numbers, case citations, or journal articles.
 """,
 }
 
+_SECTION_SYSTEM: Dict[str, str] = {
+    section_id: f"{_COMMON_GUARDRAILS}\n{rules}" for section_id, rules in _SECTION_RULES.items()
+}
+
+
+# Heads the shared example block; the prompts point back to it instead of repeating it
+SHARED_EXAMPLES_HEADER = "REFERENCE BLOG EXAMPLES (match their tone, structure and depth; never copy them):"
+
+
+def _section_messages(section_id: str, user_prompt: str, tail: Tuple[Segment, ...] = (),
+                      shared: str = "") -> AssembledMessages:
+    return assemble(
+        system=[
+            Segment("guardrails", _COMMON_GUARDRAILS, STATIC),
+            Segment("examples", f"{SHARED_EXAMPLES_HEADER}\n{shared}" if shared else "", SHARED),
+            Segment(f"rules:{section_id}", _SECTION_RULES[section_id], SECTION),
+        ],
+        user=[Segment("prompt", user_prompt, REQUEST), *tail],
+    )
+
 
 # ============================================================
 # ROUND-ROBIN MODEL CHOICE (A/B)
 # ============================================================
-_model_toggle_lock = threading.Lock()
-_model_toggle_state: Dict[str, int] = {}
-
-
 def _choose_model(section_id: str, model_a: str, model_b: str) -> str:
-    with _model_toggle_lock:
-        cur = _model_toggle_state.get(section_id, 0)
-        _model_toggle_state[section_id] = 1 - cur
-        return model_a if cur == 0 else model_b
+    # One counter per section in the shared state, so the A/B split holds across nodes
+    n = get_shared_state().incr(NS_ROUTER, section_id)
+    return model_a if n % 2 == 1 else model_b
 
 
 # ============================================================
 # LLM WRAPPER
 # ============================================================
-def _make_llm(model: str, temperature: float, max_tokens: int) -> Together:
-    api_key = os.getenv("TOGETHER_API_KEY") or os.getenv("TOGETHERAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing TOGETHER_API_KEY in environment.")
+def _build_llm(model: str, temperature: float, max_tokens: int) -> Together:
+    api_key = together_api_key()
+    Together = together_cls()
 
     # Handle different param names across versions
     try:
@@ -144,45 +162,52 @@ def _make_llm(model: str, temperature: float, max_tokens: int) -> Together:
         return Together(model=model, temperature=temperature, max_tokens=max_tokens, together_api_key=api_key)
 
 
-def _is_transient_error(e: Exception) -> bool:
-    msg = str(e).lower()
-    transient = [
-        "timeout", "timed out", "temporarily", "rate limit", "429",
-        "connection", "disconnect", "overloaded", "try again",
-        "bad gateway", "502", "503", "504",
-        "server closed the connection unexpectedly",
-    ]
-    return any(x in msg for x in transient)
-
-
-def _invoke_with_retries(llm: Together, system_text: str, user_text: str, section_id: str) -> str:
-    last: Optional[Exception] = None
-    for attempt in range(1, MAX_ATTEMPTS + 1):
-        try:
-            t0 = time.time()
-            out = llm.invoke([SystemMessage(content=system_text), HumanMessage(content=user_text)])
-
-            if isinstance(out, str):
-                raw = out
-            elif hasattr(out, "content"):
-                raw = out.content or ""
-            else:
-                raw = str(out)
-
-            dt = (time.time() - t0) * 1000
-            if DEBUGGING_MODE:
-                print(f"[SingularAgents] {section_id} ok | attempt={attempt} | {dt:.0f}ms | chars={len(raw)}")
-            return raw
+def _make_llm(model: str, temperature: float, max_tokens: int) -> Together:
+    # LLM_CASSETTE_MODE=record|replay wraps / replaces the client (chatbots.llm_cassette)
+    return with_cassette(model, max_tokens, lambda: _build_llm(model, temperature, max_tokens))
+
+
+def _invoke_with_retries(llm: Together, msgs: AssembledMessages, section_id: str, kind: str = "section") -> str:
+    model = getattr(llm, "model", "") or ""
+    system_text, user_text = msgs.system_text, msgs.user_text
+    observe_prefix(model, msgs)
+    t_start = time.time()
+    tries = [0]
+
+    def _call() -> Tuple[Any, str]:
+        tries[0] += 1
+        if tries[0] > 1:
+            mark_section(section_id, "retrying")
+        t0 = time.time()
+        with llm_call(model):
+            out = llm.invoke(chat_messages(system_text, user_text))
+        if tries[0] > 1:
+            mark_section(section_id, "running")
+        if isinstance(out, str):
+            raw = out
+        elif hasattr(out, "content"):
+            raw = out.content or ""
+        else:
+            raw = str(out)
+        if DEBUGGING_MODE:
+            print(f"[SingularAgents] {section_id} ok | {(time.time() - t0) * 1000:.0f}ms | chars={len(raw)}")
+        return out, raw
 
-        except Exception as e:
-            last = e
-            if DEBUGGING_MODE:
-                print(f"[SingularAgents] {section_id} fail | attempt={attempt}/{MAX_ATTEMPTS} | err={e}")
-            if attempt == MAX_ATTEMPTS or not _is_transient_error(e):
-                break
-            time.sleep(BASE_BACKOFF_S * attempt + random.random() * 0.6)
+    try:
+        (out, raw), attempts = run_with_retries(_call, SECTION_RETRY, label=f"{section_id}/{kind}")
+    except RetryError as e:
+        record_llm_call(
+            section_id, kind, model, system_text + user_text, "",
+            latency_ms=(time.time() - t_start) * 1000, attempts=e.attempts, success=False,
+        )
+        raise RuntimeError(f"{section_id} failed: {e}") from e.last
 
-    raise RuntimeError(f"{section_id} failed after {MAX_ATTEMPTS} attempts: {last}")
+    record_llm_call(
+        section_id, kind, model, system_text + user_text, raw,
+        latency_ms=(time.time() - t_start) * 1000, attempts=attempts,
+        usage=usage_from_output(out),
+    )
+    return raw
 
 
 # ============================================================
@@ -212,40 +237,75 @@ def _clean_output(text: str) -> str:
     return t.strip()
 
 
-def _looks_invalid(section_id: str, text: str) -> bool:
+def _section_issues(section_id: str, text: str) -> List[str]:
     t = (text or "").strip()
+    issues = common_issues(t)
     if not t:
-        return True
-    if "```" in t:
-        return True
-    if t.startswith("{") or t.startswith("["):
-        return True
-    if t.lower().startswith(("assistant:", "response:", "output:")):
-        return True
-
+        return issues
     if section_id == "faqs" and t.count("###") < 2:
-        return True
+        issues.append('Format each question as its own "### Question?" subheading, with the answer below it.')
     if section_id == "final_cta" and not (t.startswith("##") or t.startswith("###")):
-        return True
+        issues.append("Start with a ## heading.")
+    return issues
 
-    return False
+
+def _looks_invalid(section_id: str, text: str) -> bool:
+    return bool(_section_issues(section_id, text))
+
+
+# Applied after _clean_output, in order, until the section passes
+_SECTION_FIXERS: Dict[str, Tuple[Fixer, ...]] = {
+    "faqs": (("question_headings", question_headings),),
+    "final_cta": (("cta_heading", lambda t: ensure_heading(t, "## Take the Next Step")),),
+}
 
 
-def _repair_prompt(user_prompt: str, bad_output: str) -> str:
+def _local_repair(section_id: str, raw: str) -> Tuple[str, List[str]]:
+    """Deterministic fixes on the raw output: JSON/fence unwrapping, cleaning, section headings."""
+    t, applied = apply_fixers(raw or "", (("json", unwrap_json), ("fences", unwrap_fences)),
+                              lambda x: common_issues(x.strip()))
+    t = _clean_output(t)
+    t, more = apply_fixers(t, _SECTION_FIXERS.get(section_id, ()), lambda x: _section_issues(section_id, x))
+    return t, applied + more
+
+
+def _repair_prompt(draft: str, issues: List[str]) -> Tuple[Segment, ...]:
+    """Compact repair: only the draft and an edit list (the original prompt is not re-sent)."""
     return (
-        "Your previous output was empty or violated the rules.\n"
-        "Rewrite it STRICTLY following the section rules.\n"
-        "- Output Markdown only\n"
-        "- No meta commentary\n"
-        "- No JSON\n"
-        "- Do not echo the prompt\n\n"
-        "ORIGINAL PROMPT:\n"
-        f"{user_prompt}\n\n"
-        "BAD OUTPUT:\n"
-        f"{bad_output}\n"
+        Segment("draft", f"DRAFT:\n{draft}", CALL),
+        Segment("repair", repair_instruction(issues), CALL),
     )
 
 
+def _repair(llm: Together, section_id: str, prompt: str, msgs: AssembledMessages, raw: str, cleaned: str) -> str:
+    """
+    Cheapest fix first: local rules, then an edit-list repair call, and only a
+    plain regeneration (same messages, fully prefix-cached) when there is no draft.
+    Returns "" if the output is still invalid.
+    """
+    legacy = legacy_repair_tokens(msgs.system_text, prompt, cleaned)
+    fixed, applied = _local_repair(section_id, raw)
+    if not _looks_invalid(section_id, fixed):
+        record_repair(section_id, "local", True, legacy + estimate_tokens(fixed))
+        if DEBUGGING_MODE:
+            print(f"[SingularAgents] {section_id} fixed locally | {','.join(applied) or 'clean'}")
+        return fixed
+
+    draft = fixed or cleaned
+    if draft:
+        repair_msgs = _section_messages(section_id, "", _repair_prompt(draft, _section_issues(section_id, draft)))
+        outcome = "compact"
+    else:
+        repair_msgs = msgs
+        outcome = "regenerated"
+    raw2 = _invoke_with_retries(llm, repair_msgs, section_id, kind="repair")
+    cleaned2, _ = _local_repair(section_id, raw2)
+    ok = not _looks_invalid(section_id, cleaned2)
+    sent = estimate_tokens(repair_msgs.system_text) + estimate_tokens(repair_msgs.user_text)
+    record_repair(section_id, outcome, ok, legacy - sent)
+    return cleaned2 if ok else ""
+
+
 def _fallback(section_id: str) -> str:
     if section_id == "intro":
         return (
@@ -299,22 +359,24 @@ def _run_section_agent(
     model: str,
     max_tokens: int,
     fallback_model: Optional[str] = None,
+    shared: str = "",
 ) -> Tuple[str, str]:
-    sys = _SECTION_SYSTEM[section_id]
+    msgs = _section_messages(section_id, prompt, shared=shared)
 
-    def _run_once(m: str) -> str:
+    def _run_once(m: str, kind: str) -> str:
         llm = _make_llm(model=m, temperature=temperature, max_tokens=max_tokens)
-        raw = _invoke_with_retries(llm, sys, prompt, section_id)
+        raw = _invoke_with_retries(llm, msgs, section_id, kind=kind)
         cleaned = _clean_output(raw)
 
-        if _looks_invalid(section_id, cleaned):
+        invalid = _looks_invalid(section_id, cleaned)
+        record_checked(section_id, invalid)
+        if invalid:
             if DEBUGGING_MODE:
                 print(f"[SingularAgents] {section_id} invalid -> repair pass | model={m} | chars={len(cleaned)}")
-            repair_user = _repair_prompt(prompt, cleaned)
-            raw2 = _invoke_with_retries(llm, sys, repair_user, section_id)
-            cleaned2 = _clean_output(raw2)
-            if not _looks_invalid(section_id, cleaned2):
-                cleaned = cleaned2
+            repaired = _repair(llm, section_id, prompt, msgs, raw, cleaned)
+            if repaired:
+                mark_section(section_id, "repaired")
+            cleaned = repaired or cleaned
 
         return cleaned.strip()
 
@@ -322,9 +384,10 @@ def _run_section_agent(
     out = ""
     primary_err: Optional[Exception] = None
     t0 = time.time()
+    mark_section(section_id, "running", model)
 
     try:
-        out = _run_once(model)
+        out = _run_once(model, "section")
     except Exception as e:
         primary_err = e
         out = ""
@@ -333,14 +396,16 @@ def _run_section_agent(
     if (not out) and fallback_model:
         if DEBUGGING_MODE:
             print(f"[SingularAgents] {section_id} switching fallback model -> {fallback_model} | primary_err={primary_err}")
+        mark_section(section_id, "fallback", fallback_model)
         try:
-            out = _run_once(fallback_model)
+            out = _run_once(fallback_model, "fallback")
         except Exception as e2:
             if DEBUGGING_MODE:
                 print(f"[SingularAgents] {section_id} fallback also failed: {e2}")
             out = ""
 
     if not out:
+        mark_section(section_id, "fallback", "static")
         out = _fallback(section_id)
 
     dt = (time.time() - t0) * 1000
@@ -353,52 +418,64 @@ def _run_section_agent(
 # ============================================================
 # PUBLIC AGENTS (YOUR MODEL A/B LISTS)
 # ============================================================
-def Intro_Writing_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    model_a = "Qwen/Qwen3-Next-80B-A3B-Instruct"
-    model_b = "deepseek-ai/DeepSeek-R1-0528-tput"
-    model = _choose_model("intro", model_a=model_a, model_b=model_b)
-    fallback = model_b if model == model_a else model_a
-    return _run_section_agent("intro", prompt, temperature, model=model, max_tokens=INTRO_MAX_TOKENS, fallback_model=fallback)
+# section_id -> (model_a, model_b); model_b=None means no A/B and no fallback
+SECTION_MODELS: Dict[str, Tuple[str, Optional[str]]] = {
+    "intro": ("Qwen/Qwen3-Next-80B-A3B-Instruct", "deepseek-ai/DeepSeek-R1-0528-tput"),
+    "final_cta": ("openai/gpt-oss-120b", "meta-llama/Meta-Llama-3-8B-Instruct-Lite"),
+    "faqs": ("deepseek-ai/DeepSeek-V3.1", "Qwen/Qwen2.5-72B-Instruct-Turbo"),
+    "business_description": ("Qwen/Qwen3-Next-80B-A3B-Instruct", "Qwen/Qwen2.5-7B-Instruct-Turbo"),
+    "short_cta": ("google/gemma-3n-E4B-it", None),
+    "integrate_references": ("openai/gpt-oss-20B", "openai/gpt-oss-120b"),
+}
+
+SECTION_MAX_TOKENS: Dict[str, int] = {
+    "intro": INTRO_MAX_TOKENS,
+    "final_cta": FINAL_CTA_MAX_TOKENS,
+    "faqs": FAQ_MAX_TOKENS,
+    "business_description": BUSINESS_DESC_MAX_TOKENS,
+    "short_cta": SHORT_CTA_MAX_TOKENS,
+    "integrate_references": REFERENCES_MAX_TOKENS,
+}
 
 
-def Final_CTA_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    model_a = "openai/gpt-oss-120b"
-    model_b = "meta-llama/Meta-Llama-3-8B-Instruct-Lite"
-    model = _choose_model("final_cta", model_a=model_a, model_b=model_b)
-    fallback = model_b if model == model_a else model_a
-    return _run_section_agent("final_cta", prompt, temperature, model=model, max_tokens=FINAL_CTA_MAX_TOKENS, fallback_model=fallback)
+def section_system_prompt(section_id: str) -> str:
+    return _SECTION_SYSTEM[section_id]
 
 
-def FAQs_Writing_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    model_a = "deepseek-ai/DeepSeek-V3.1"
-    model_b = "Qwen/Qwen2.5-72B-Instruct-Turbo"
-    model = _choose_model("faqs", model_a=model_a, model_b=model_b)
-    fallback = model_b if model == model_a else model_a
-    return _run_section_agent("faqs", prompt, temperature, model=model, max_tokens=FAQ_MAX_TOKENS, fallback_model=fallback)
+def _run_public_agent(section_id: str, prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    model_a, model_b = SECTION_MODELS[section_id]
+    if model_b is None:
+        model, fallback = model_a, None
+    else:
+        model = _choose_model(section_id, model_a=model_a, model_b=model_b)
+        fallback = model_b if model == model_a else model_a
+    return _run_section_agent(
+        section_id, prompt, temperature,
+        model=model, max_tokens=SECTION_MAX_TOKENS[section_id], fallback_model=fallback, shared=shared,
+    )
 
 
-def Business_Description_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    model_a = "Qwen/Qwen3-Next-80B-A3B-Instruct"
-    model_b = "Qwen/Qwen2.5-7B-Instruct-Turbo"
-    model = _choose_model("business_description", model_a=model_a, model_b=model_b)
-    fallback = model_b if model == model_a else model_a
-    return _run_section_agent("business_description", prompt, temperature, model=model, max_tokens=BUSINESS_DESC_MAX_TOKENS, fallback_model=fallback)
+# `shared` is the request's reference example block (same for all six agents);
+# it goes right after the guardrails so the section calls share that prefix.
+def Intro_Writing_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("intro", prompt, temperature, shared)
 
 
-def Short_CTA_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    return _run_section_agent(
-        "short_cta",
-        prompt,
-        temperature,
-        model="google/gemma-3n-E4B-it",
-        max_tokens=SHORT_CTA_MAX_TOKENS,
-        fallback_model=None
-    )
+def Final_CTA_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("final_cta", prompt, temperature, shared)
+
+
+def FAQs_Writing_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("faqs", prompt, temperature, shared)
+
+
+def Business_Description_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("business_description", prompt, temperature, shared)
+
+
+def Short_CTA_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("short_cta", prompt, temperature, shared)
 
 
-def References_Writing_Agent(prompt: str, temperature: float) -> Tuple[str, str]:
-    model_a = "openai/gpt-oss-20B"
-    model_b = "openai/gpt-oss-120b"
-    model = _choose_model("integrate_references", model_a=model_a, model_b=model_b)
-    fallback = model_b if model == model_a else model_a
-    return _run_section_agent("integrate_references", prompt, temperature, model=model, max_tokens=REFERENCES_MAX_TOKENS, fallback_model=fallback)
+def References_Writing_Agent(prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
+    return _run_public_agent("integrate_references", prompt, temperature, shared)
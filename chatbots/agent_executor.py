@@ -0,0 +1,445 @@
+# chatbots/agent_executor.py
+from __future__ import annotations
+
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from chatbots.shared_state import NS_TENANT_TOKENS, get_shared_state
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# Process-wide cap on concurrent agent calls (each one is an outbound LLM request)
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "24"))
+# Admission control: new pipelines are refused once this many agent calls are
+# waiting for a worker, or this many pipelines are already admitted
+AGENT_QUEUE_MAX = int(os.getenv("AGENT_QUEUE_MAX", "48"))
+AGENT_MAX_PIPELINES = int(os.getenv("AGENT_MAX_PIPELINES", "16"))
+
+# ---- Per-tenant fairness (tenant = API key or COMPANY_NAME) ----
+# Max agent calls one tenant may have running at once
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "12"))
+# Max pipelines one tenant may have admitted at once
+TENANT_MAX_PIPELINES = int(os.getenv("TENANT_MAX_PIPELINES", "6"))
+# Estimated (prompt + max output) tokens per minute per tenant; 0 = unlimited
+TENANT_TOKENS_PER_MIN = int(os.getenv("TENANT_TOKENS_PER_MIN", "0"))
+# WFQ weights, e.g. "acme law=3,beta clinic=1" (unlisted tenants weigh 1)
+TENANT_WEIGHTS_RAW = os.getenv("TENANT_WEIGHTS", "")
+DEFAULT_TENANT = "anonymous"
+MAX_TRACKED_TENANTS = 1000
+
+PRIORITIES = ("interactive", "bulk")
+# Bulk calls waiting longer than this are served like interactive ones (no starvation)
+BULK_MAX_WAIT_S = float(os.getenv("BULK_MAX_WAIT_S", "30"))
+# Worker re-check interval while work is queued but every tenant is at quota
+SCHEDULER_POLL_S = 0.25
+
+RETRY_AFTER_MIN_S = 1
+RETRY_AFTER_MAX_S = 60
+# Used for the Retry-After estimate until real call durations are known
+DEFAULT_CALL_S = 8.0
+SAMPLE_WINDOW = 512
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[AgentExecutor] {msg}")
+
+
+class Overloaded(Exception):
+    """
+    Raised by admission() instead of waiting:
+      503 OVERLOADED   - the shared executor is saturated
+      429 TENANT_QUOTA - this tenant is at its pipeline or token-rate quota
+    """
+    def __init__(self, reason: str, retry_after_s: int, code: str = "OVERLOADED", status: int = 503):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+        self.code = code
+        self.status = status
+
+
+def _parse_weights(raw: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (raw or "").split(","):
+        name, _, weight = part.partition("=")
+        try:
+            if name.strip():
+                out[normalize_tenant(name)] = max(0.01, float(weight))
+        except ValueError:
+            _log(f"ignoring bad TENANT_WEIGHTS entry: {part!r}")
+    return out
+
+
+def normalize_tenant(name: Optional[str]) -> str:
+    return " ".join((name or "").lower().split()) or DEFAULT_TENANT
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(math.ceil(pct / 100.0 * len(ordered))) - 1))
+    return round(ordered[idx], 1)
+
+
+class _Task:
+    __slots__ = ("fn", "args", "kwargs", "future", "enqueued_at", "tenant", "priority", "cost", "tag", "ctx")
+
+    def __init__(self, fn: Callable[..., Any], args: tuple, kwargs: dict, tenant: "_Tenant", priority: str, cost: int):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.enqueued_at = time.time()
+        self.tenant = tenant
+        self.priority = priority
+        self.cost = cost
+        self.tag = 0.0
+        # Submitter's context (carries the request's cancel token into the worker)
+        self.ctx = contextvars.copy_context()
+
+
+class _Tenant:
+    """Queues, quotas and counters of one tenant (all fields guarded by the executor's lock)."""
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.queues: Dict[str, Deque[_Task]] = {p: deque() for p in PRIORITIES}
+        self.active = 0
+        self.pipelines = 0
+        self.last_finish = 0.0
+        self.bucket = float(TENANT_TOKENS_PER_MIN)
+        self.bucket_ts = time.time()
+        self.dispatched = 0
+        self.tokens = 0
+        self.rejected = 0
+        self.wait_ms: Deque[float] = deque(maxlen=128)
+
+    def queued(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def refill(self, now: float) -> None:
+        if TENANT_TOKENS_PER_MIN <= 0:
+            return
+        rate = TENANT_TOKENS_PER_MIN / 60.0
+        self.bucket = min(float(TENANT_TOKENS_PER_MIN), self.bucket + (now - self.bucket_ts) * rate)
+        self.bucket_ts = now
+
+    def over_rate(self) -> bool:
+        return TENANT_TOKENS_PER_MIN > 0 and self.bucket <= 0
+
+    def adopt(self, level: float, now: float) -> None:
+        """Takes the cluster-wide bucket balance from the shared state."""
+        self.bucket = level
+        self.bucket_ts = now
+
+    def refill_wait_s(self) -> float:
+        if TENANT_TOKENS_PER_MIN <= 0 or self.bucket > 0:
+            return 0.0
+        return (1 - self.bucket) / (TENANT_TOKENS_PER_MIN / 60.0)
+
+    def idle(self) -> bool:
+        return not self.active and not self.pipelines and not self.queued() and not self.over_rate()
+
+
+class AgentExecutor:
+    """
+    One fixed pool of agent threads shared by every request in the process
+    (instead of a 6-thread executor per pipeline), plus admission control so
+    bursts get a fast refusal instead of queueing until the HTTP timeout.
+    Returns standard concurrent.futures.Future objects (as_completed works).
+
+    Scheduling: interactive calls go before bulk ones (bulk calls older than
+    BULK_MAX_WAIT_S count as interactive). Within a class, tenants share the
+    workers by start-time fair queuing on estimated tokens, scaled by their
+    TENANT_WEIGHTS. A tenant at its concurrency or token-rate quota is skipped
+    until it has room again.
+    """
+    def __init__(
+        self,
+        workers: int = AGENT_MAX_WORKERS,
+        queue_max: int = AGENT_QUEUE_MAX,
+        max_pipelines: int = AGENT_MAX_PIPELINES,
+    ):
+        self.workers = max(1, workers)
+        self.queue_max = max(1, queue_max)
+        self.max_pipelines = max(1, max_pipelines)
+        self.weights = _parse_weights(TENANT_WEIGHTS_RAW)
+        self._init_state()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self) -> None:
+        # Worker threads don't survive fork(); each process starts its own lazily
+        self._cond = threading.Condition()
+        self._tenants: Dict[str, _Tenant] = {}
+        self._queued = 0
+        self._vtime = 0.0
+        self._threads: List[threading.Thread] = []
+        self._active = 0
+        self._pipelines = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._wait_ms: Deque[float] = deque(maxlen=SAMPLE_WINDOW)
+        self._run_ms: Deque[float] = deque(maxlen=SAMPLE_WINDOW)
+
+    def _ensure_started(self) -> None:
+        # caller holds self._cond
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"agent-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        _log(f"started | workers={self.workers} | queue_max={self.queue_max} | max_pipelines={self.max_pipelines}")
+
+    # ----------------------------
+    # SUBMIT / RUN
+    # ----------------------------
+    def _tenant(self, name: Optional[str]) -> _Tenant:
+        # caller holds self._cond
+        key = normalize_tenant(name)
+        t = self._tenants.get(key)
+        if t is None:
+            if len(self._tenants) >= MAX_TRACKED_TENANTS:
+                for k in [k for k, v in self._tenants.items() if v.idle()]:
+                    del self._tenants[k]
+            t = _Tenant(key, self.weights.get(key, 1.0))
+            self._tenants[key] = t
+        return t
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        return self.schedule(fn, args, kwargs)
+
+    def schedule(
+        self,
+        fn: Callable[..., Any],
+        args: tuple = (),
+        kwargs: Optional[dict] = None,
+        tenant: Optional[str] = None,
+        priority: str = "interactive",
+        cost_tokens: int = 0,
+    ) -> Future:
+        """Queues one agent call; cost_tokens (estimated prompt + output) drives fairness and quotas."""
+        with self._cond:
+            self._ensure_started()
+            t = self._tenant(tenant)
+            task = _Task(fn, args, kwargs or {}, t, priority if priority in PRIORITIES else "interactive", max(1, cost_tokens))
+            start = max(self._vtime, t.last_finish)
+            task.tag = start
+            t.last_finish = start + task.cost / 1000.0 / t.weight
+            t.queues[task.priority].append(task)
+            self._queued += 1
+            self._submitted += 1
+            self._cond.notify()
+        return task.future
+
+    def _pick_locked(self, now: float) -> Optional[_Task]:
+        best: Optional[_Task] = None
+        best_key = None
+        for t in self._tenants.values():
+            if not t.queued() or t.active >= TENANT_MAX_CONCURRENCY:
+                continue
+            t.refill(now)
+            if t.over_rate():
+                continue
+            for q in t.queues.values():
+                # Cancelled before dispatch: dropped without using the tenant's quota
+                while q and q[0].future.cancelled():
+                    q.popleft()
+                    self._queued -= 1
+                    self._cancelled += 1
+                if not q:
+                    continue
+                head = q[0]
+                urgent = head.priority == "interactive" or now - head.enqueued_at > BULK_MAX_WAIT_S
+                key = (0 if urgent else 1, head.tag, head.enqueued_at)
+                if best_key is None or key < best_key:
+                    best, best_key = head, key
+        if best is None:
+            return None
+        t = best.tenant
+        t.queues[best.priority].popleft()
+        self._queued -= 1
+        self._vtime = max(self._vtime, best.tag)
+        t.active += 1
+        t.dispatched += 1
+        t.tokens += best.cost
+        if TENANT_TOKENS_PER_MIN > 0:
+            t.bucket -= best.cost
+        wait = (now - best.enqueued_at) * 1000
+        t.wait_ms.append(wait)
+        self._wait_ms.append(wait)
+        self._active += 1
+        return best
+
+    def _next_task(self) -> _Task:
+        with self._cond:
+            while True:
+                task = self._pick_locked(time.time())
+                if task is not None:
+                    return task
+                # Work may be queued behind a quota: re-check as buckets refill
+                self._cond.wait(SCHEDULER_POLL_S if self._queued else None)
+
+    def _shared_bucket(self, tenant: str, amount: float) -> Optional[float]:
+        """
+        Debits/reads the tenant's bucket in the shared state (outside the lock:
+        it may be a DB round trip) so the token-rate quota holds across nodes.
+        """
+        if TENANT_TOKENS_PER_MIN <= 0:
+            return None
+        return get_shared_state().take_tokens(
+            NS_TENANT_TOKENS, tenant, amount, TENANT_TOKENS_PER_MIN, TENANT_TOKENS_PER_MIN / 60.0,
+        )
+
+    def _worker(self) -> None:
+        while True:
+            task = self._next_task()
+            level = self._shared_bucket(task.tenant.name, task.cost)
+            if level is not None:
+                with self._cond:
+                    task.tenant.adopt(level, time.time())
+            t0 = time.time()
+            ok = True
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.ctx.run(task.fn, *task.args, **task.kwargs))
+                    except BaseException as e:
+                        ok = False
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    task.tenant.active -= 1
+                    self._cond.notify()
+                    self._completed += 1
+                    self._failed += 0 if ok else 1
+                    self._run_ms.append((time.time() - t0) * 1000)
+
+    # ----------------------------
+    # ADMISSION CONTROL
+    # ----------------------------
+    def retry_after_s(self) -> int:
+        with self._cond:
+            return self._retry_after_locked()
+
+    def _retry_after_locked(self, extra_s: float = 0.0) -> int:
+        avg_s = (sum(self._run_ms) / len(self._run_ms) / 1000) if self._run_ms else DEFAULT_CALL_S
+        backlog = self._queued + self._active
+        est = max(math.ceil(backlog * avg_s / self.workers), math.ceil(extra_s))
+        return int(min(RETRY_AFTER_MAX_S, max(RETRY_AFTER_MIN_S, est)))
+
+    @contextmanager
+    def admission(self, tenant: Optional[str] = None) -> Iterator[None]:
+        """Reserves a pipeline slot for `tenant` or raises Overloaded (never waits)."""
+        level = self._shared_bucket(normalize_tenant(tenant), 0)
+        with self._cond:
+            t = self._tenant(tenant)
+            if level is not None:
+                t.adopt(level, time.time())
+            else:
+                t.refill(time.time())
+            reason, code, status, extra_s = None, "OVERLOADED", 503, 0.0
+            if self._queued >= self.queue_max:
+                reason = f"agent queue is full ({self._queued} waiting)"
+            elif self._pipelines >= self.max_pipelines:
+                reason = f"too many pipelines in flight ({self._pipelines})"
+            elif t.pipelines >= TENANT_MAX_PIPELINES:
+                reason, code, status = f"tenant has {t.pipelines} pipelines in flight", "TENANT_QUOTA", 429
+            elif t.over_rate():
+                reason, code, status = "tenant token-rate quota exhausted", "TENANT_QUOTA", 429
+                extra_s = t.refill_wait_s()
+            if reason:
+                self._rejected += 1
+                t.rejected += 1
+                raise Overloaded(reason, self._retry_after_locked(extra_s), code=code, status=status)
+            self._pipelines += 1
+            t.pipelines += 1
+            self._admitted += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._pipelines -= 1
+                t.pipelines -= 1
+
+    # ----------------------------
+    # STATS
+    # ----------------------------
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            waits = list(self._wait_ms)
+            runs = list(self._run_ms)
+            now = time.time()
+            heads = [q[0].enqueued_at for t in self._tenants.values() for q in t.queues.values() if q]
+            oldest = (now - min(heads)) * 1000 if heads else 0.0
+            tenants = {}
+            for t in self._tenants.values():
+                t.refill(now)
+                tenants[t.name] = {
+                    "weight": t.weight,
+                    "queued": {p: len(q) for p, q in t.queues.items()},
+                    "active": t.active,
+                    "pipelines": t.pipelines,
+                    "dispatched": t.dispatched,
+                    "tokens": t.tokens,
+                    "token_bucket": round(t.bucket) if TENANT_TOKENS_PER_MIN > 0 else None,
+                    "rejected": t.rejected,
+                    "wait_ms_p95": _percentile(list(t.wait_ms), 95),
+                }
+            out = {
+                "workers": self.workers,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "queue_max": self.queue_max,
+                "oldest_wait_ms": round(oldest, 1),
+                "pipelines_in_flight": self._pipelines,
+                "max_pipelines": self.max_pipelines,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "retry_after_s": self._retry_after_locked(),
+                "quotas": {
+                    "tenant_max_concurrency": TENANT_MAX_CONCURRENCY,
+                    "tenant_max_pipelines": TENANT_MAX_PIPELINES,
+                    "tenant_tokens_per_min": TENANT_TOKENS_PER_MIN,
+                    "bulk_max_wait_s": BULK_MAX_WAIT_S,
+                },
+                "tenants": tenants,
+            }
+        out["wait_ms"] = {"p50": _percentile(waits, 50), "p95": _percentile(waits, 95), "max": round(max(waits, default=0.0), 1)}
+        out["run_ms"] = {"p50": _percentile(runs, 50), "p95": _percentile(runs, 95)}
+        return out
+
+
+_executor: Optional[AgentExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_agent_executor() -> AgentExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = AgentExecutor()
+    return _executor
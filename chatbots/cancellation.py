@@ -0,0 +1,290 @@
+# chatbots/cancellation.py
+from __future__ import annotations
+
+import contextvars
+import hashlib
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from chatbots.shared_state import NS_CANCEL, NS_JOBS, get_shared_state
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# How often the watcher thread checks whether HTTP clients are still connected
+DISCONNECT_POLL_S = 0.5
+# Upper bound on a pipeline's lifetime; job/cancel entries in the shared state expire after it
+JOB_TTL_S = 3600
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[Cancellation] {msg}")
+
+
+class Cancelled(BaseException):
+    """
+    Raised inside a cancelled pipeline. A BaseException (like
+    asyncio.CancelledError) so the agents' `except Exception` fallbacks
+    don't turn it into another model, repair pass or retry.
+    """
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# ============================================================
+# TOKEN
+# ============================================================
+class CancelToken:
+    """One per request; cancel() is idempotent and safe from any thread."""
+    def __init__(self, request_id: str = "", key: str = ""):
+        self.request_id = request_id
+        # Registry / shared-state key: the request ID scoped to its tenant
+        self.key = key or request_id
+        # Unique per registration: remote cancel flags target this run, not a later resubmit
+        self.job_id = uuid.uuid4().hex
+        self.reason = ""
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        _log(f"{self.request_id or '-'} cancelled | {reason}")
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception as e:
+                _log(f"cancel callback failed: {e}")
+        return True
+
+    def on_cancel(self, cb: Callable[[], None]) -> None:
+        """Runs cb once on cancel (immediately if already cancelled)."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(cb)
+                return
+        cb()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def sleep(self, seconds: float) -> None:
+        """Retry backoff that wakes up (and raises) as soon as the token is cancelled."""
+        if self._event.wait(max(0.0, seconds)):
+            raise Cancelled(self.reason)
+
+    def as_future(self) -> Future:
+        """A Future that completes on cancel; lets as_completed/wait stop waiting on other work."""
+        fut: Future = Future()
+        self.on_cancel(lambda: fut.done() or fut.set_result(self.reason))
+        return fut
+
+
+# Agent threads inherit it because the executor runs tasks in the submitter's context
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("cancel_token", default=None)
+
+
+def current_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def using_token(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def check_cancelled() -> None:
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def cancellable_sleep(seconds: float) -> None:
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+# ============================================================
+# REQUEST REGISTRY (cancel endpoint + disconnect watcher)
+# ============================================================
+def _node_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _shared() -> bool:
+    return get_shared_state().name != "memory"
+
+
+def scoped_key(request_id: str, tenant: Optional[str] = None) -> str:
+    """
+    Request IDs are chosen by clients, so they are only unique per tenant: one
+    tenant can neither supersede nor cancel another's run by reusing its ID.
+    """
+    scope = hashlib.sha256(tenant.encode("utf-8")).hexdigest()[:16] if tenant else "-"
+    return f"{scope}:{request_id}"
+
+
+class CancelRegistry:
+    """
+    (tenant, request_id) -> token of the in-flight request. Registering an ID
+    that is still running for the same tenant cancels the older request (resubmit).
+    With a shared state backend, running requests are also published under
+    NS_JOBS, so a cancel (or resubmit) that reaches another node sets a flag
+    in NS_CANCEL which this node's watcher picks up.
+    """
+    def __init__(self, poll_s: float = DISCONNECT_POLL_S):
+        self.poll_s = poll_s
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._watched: Dict[int, Tuple[CancelToken, Callable[[], bool]]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._counts = {
+            "registered": 0, "cancelled_endpoint": 0, "superseded": 0, "disconnected": 0,
+            "remote_cancel_sent": 0, "remote_cancel_received": 0,
+        }
+
+    def register(self, request_id: str, tenant: Optional[str] = None) -> CancelToken:
+        key = scoped_key(request_id, tenant)
+        token = CancelToken(request_id, key)
+        with self._lock:
+            previous = self._tokens.get(key)
+            self._tokens[key] = token
+            self._counts["registered"] += 1
+            if previous is not None:
+                self._counts["superseded"] += 1
+        if previous is not None:
+            previous.cancel("superseded by a newer request")
+        if _shared():
+            state = get_shared_state()
+            if previous is None and self._flag_remote(key, "superseded by a newer request"):
+                with self._lock:
+                    self._counts["superseded"] += 1
+            state.set(NS_JOBS, key, {"job": token.job_id, "node": _node_id(), "started": time.time()}, JOB_TTL_S)
+            self._ensure_watcher()
+        return token
+
+    def unregister(self, token: CancelToken) -> None:
+        with self._lock:
+            if self._tokens.get(token.key) is token:
+                del self._tokens[token.key]
+            self._watched.pop(id(token), None)
+        if _shared():
+            state = get_shared_state()
+            job = state.get(NS_JOBS, token.key)
+            # A resubmit on another node may own the ID by now
+            if isinstance(job, dict) and job.get("job") == token.job_id:
+                state.delete(NS_JOBS, token.key)
+
+    def _flag_remote(self, key: str, reason: str) -> bool:
+        state = get_shared_state()
+        job = state.get(NS_JOBS, key)
+        if not isinstance(job, dict) or not job.get("job"):
+            return False
+        state.set(NS_CANCEL, job["job"], reason, JOB_TTL_S)
+        with self._lock:
+            self._counts["remote_cancel_sent"] += 1
+        return True
+
+    def cancel(self, request_id: str, reason: str = "cancelled by client", tenant: Optional[str] = None) -> bool:
+        """
+        False when the tenant has no request with this ID running (on this node,
+        or anywhere with a shared backend). Other tenants' runs are never matched.
+        """
+        key = scoped_key(request_id, tenant)
+        with self._lock:
+            token = self._tokens.get(key)
+            if token is not None:
+                self._counts["cancelled_endpoint"] += 1
+        if token is not None:
+            return token.cancel(reason)
+        if _shared() and self._flag_remote(key, reason):
+            with self._lock:
+                self._counts["cancelled_endpoint"] += 1
+            return True
+        return False
+
+    def watch(self, token: CancelToken, is_disconnected: Callable[[], bool]) -> None:
+        """Cancels token once is_disconnected() returns True (polled by one shared thread)."""
+        with self._lock:
+            self._watched[id(token)] = (token, is_disconnected)
+        self._ensure_watcher()
+
+    def _ensure_watcher(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watch_loop, name="cancel-watcher", daemon=True)
+                self._thread.start()
+
+    def _watch_loop(self) -> None:
+        while True:
+            time.sleep(self.poll_s)
+            with self._lock:
+                items = list(self._watched.items())
+                running = list(self._tokens.values())
+            for key, (token, is_disconnected) in items:
+                try:
+                    gone = not token.cancelled and is_disconnected()
+                except Exception:
+                    gone = False
+                if gone:
+                    with self._lock:
+                        self._watched.pop(key, None)
+                        self._counts["disconnected"] += 1
+                    token.cancel("client disconnected")
+            if running and _shared():
+                flags = get_shared_state().get_many(NS_CANCEL, [t.job_id for t in running if not t.cancelled])
+                for token in running:
+                    if token.job_id in flags and token.cancel(str(flags[token.job_id])):
+                        with self._lock:
+                            self._counts["remote_cancel_received"] += 1
+
+    @contextmanager
+    def request(self, request_id: str, is_disconnected: Optional[Callable[[], bool]] = None,
+                tenant: Optional[str] = None) -> Iterator[CancelToken]:
+        """Registers, watches and installs a token for the duration of one request."""
+        token = self.register(request_id, tenant)
+        if is_disconnected is not None:
+            self.watch(token, is_disconnected)
+        try:
+            with using_token(token):
+                yield token
+        finally:
+            self.unregister(token)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._tokens), "watched": len(self._watched), **self._counts}
+
+
+_registry = CancelRegistry()
+
+
+def get_cancel_registry() -> CancelRegistry:
+    return _registry
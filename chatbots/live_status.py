@@ -0,0 +1,291 @@
+# chatbots/live_status.py
+from __future__ import annotations
+
+import contextvars
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Sequence, Tuple
+
+from chatbots.cancellation import Cancelled
+
+# ============================================================
+# CONFIG
+# ============================================================
+# Samples kept per latency series (pipeline, each section, each model)
+LIVE_RING_SIZE = int(os.getenv("LIVE_RING_SIZE", "512"))
+# Percentiles only use samples newer than this
+LIVE_WINDOW_S = float(os.getenv("LIVE_WINDOW_S", "300"))
+# Finished pipelines kept for the dashboard's "recent" list
+LIVE_RECENT_PIPELINES = int(os.getenv("LIVE_RECENT_PIPELINES", "20"))
+
+# Section states, in the order a section usually moves through them
+SECTION_STATES = ("pending", "running", "retrying", "repaired", "fallback", "done", "failed")
+
+
+# ============================================================
+# RING BUFFERS
+# ============================================================
+class LatencyRing:
+    """
+    Last LIVE_RING_SIZE (timestamp, ms) samples. deque.append with maxlen is
+    atomic under the GIL, so recording takes no lock; sorting happens on read.
+    """
+    def __init__(self, size: int = LIVE_RING_SIZE):
+        self._samples: Deque[Tuple[float, float]] = deque(maxlen=size)
+
+    def add(self, ms: float) -> None:
+        self._samples.append((time.time(), ms))
+
+    def summary(self, window_s: float = LIVE_WINDOW_S) -> Dict[str, Any]:
+        cutoff = time.time() - window_s
+        values = sorted(ms for ts, ms in list(self._samples) if ts >= cutoff)
+        if not values:
+            return {"n": 0, "p50_ms": None, "p95_ms": None, "max_ms": None}
+
+        def pct(p: float) -> float:
+            return round(values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))], 1)
+        return {"n": len(values), "p50_ms": pct(50), "p95_ms": pct(95), "max_ms": round(values[-1], 1)}
+
+
+class _Rings:
+    """name -> LatencyRing, created on first use."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rings: Dict[str, LatencyRing] = {}
+
+    def add(self, name: str, ms: float) -> None:
+        ring = self._rings.get(name)
+        if ring is None:
+            with self._lock:
+                ring = self._rings.setdefault(name, LatencyRing())
+        ring.add(ms)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            rings = dict(self._rings)
+        return {name: ring.summary() for name, ring in sorted(rings.items())}
+
+
+# ============================================================
+# PIPELINES
+# ============================================================
+class PipelineStatus:
+    """
+    One in-flight pipeline. Each section is only written by the agent thread
+    running it, so section updates are plain dict assignments.
+    """
+    __slots__ = ("pipeline_id", "kind", "tenant", "compiler_mode", "started", "stage", "outcome",
+                 "finished", "sections", "section_started", "section_ms", "models", "before_retry")
+
+    def __init__(self, pipeline_id: str, kind: str, sections: Sequence[str], tenant: Optional[str], compiler_mode: str):
+        self.pipeline_id = pipeline_id
+        self.kind = kind
+        self.tenant = tenant or ""
+        self.compiler_mode = compiler_mode
+        self.started = time.time()
+        self.stage = "sections"
+        self.outcome = ""
+        self.finished = 0.0
+        self.sections: Dict[str, str] = {name: "pending" for name in sections}
+        self.section_started: Dict[str, float] = {}
+        self.section_ms: Dict[str, float] = {}
+        self.models: Dict[str, str] = {}
+        self.before_retry: Dict[str, str] = {}
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        end = self.finished or now
+        return {
+            "id": self.pipeline_id,
+            "kind": self.kind,
+            "tenant": self.tenant,
+            "compiler_mode": self.compiler_mode,
+            "stage": self.stage,
+            "outcome": self.outcome,
+            "age_ms": round((end - self.started) * 1000, 1),
+            "sections": {
+                name: {
+                    "state": state,
+                    "model": self.models.get(name, ""),
+                    "ms": self.section_ms.get(name) or (
+                        round((now - self.section_started[name]) * 1000, 1) if name in self.section_started else None
+                    ),
+                }
+                for name, state in self.sections.items()
+            },
+        }
+
+
+class LiveStatus:
+    """In-flight pipelines, recent ones, LLM calls in flight per model and latency rings."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[int, PipelineStatus] = {}
+        self._recent: Deque[PipelineStatus] = deque(maxlen=LIVE_RECENT_PIPELINES)
+        self._llm_inflight: Dict[str, int] = {}
+        self._llm_peak: Dict[str, int] = {}
+        self._llm_calls: Dict[str, int] = {}
+        self._outcomes: Dict[str, int] = {}
+        self.pipeline_ms = _Rings()
+        self.section_ms = _Rings()
+        self.llm_ms = _Rings()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    # ----------------------------
+    # PIPELINES
+    # ----------------------------
+    def start(self, status: PipelineStatus) -> None:
+        with self._lock:
+            self._inflight[id(status)] = status
+
+    def finish(self, status: PipelineStatus, outcome: str) -> None:
+        status.finished = time.time()
+        status.outcome = outcome
+        status.stage = outcome
+        with self._lock:
+            self._inflight.pop(id(status), None)
+            self._recent.appendleft(status)
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+        if outcome == "done":
+            self.pipeline_ms.add(status.kind, (status.finished - status.started) * 1000)
+
+    # ----------------------------
+    # LLM CALLS
+    # ----------------------------
+    def llm_started(self, model: str) -> None:
+        with self._lock:
+            n = self._llm_inflight.get(model, 0) + 1
+            self._llm_inflight[model] = n
+            self._llm_calls[model] = self._llm_calls.get(model, 0) + 1
+            if n > self._llm_peak.get(model, 0):
+                self._llm_peak[model] = n
+
+    def llm_finished(self, model: str, ms: float) -> None:
+        with self._lock:
+            self._llm_inflight[model] = max(0, self._llm_inflight.get(model, 0) - 1)
+        self.llm_ms.add(model, ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            inflight = sorted(self._inflight.values(), key=lambda p: p.started)
+            recent = list(self._recent)
+            llm_inflight = dict(self._llm_inflight)
+            llm_peak = dict(self._llm_peak)
+            llm_calls = dict(self._llm_calls)
+            outcomes = dict(self._outcomes)
+        llm_latency = self.llm_ms.summary()
+        models = sorted(set(llm_calls) | set(llm_latency))
+        return {
+            "ts": now,
+            "window_s": LIVE_WINDOW_S,
+            "section_states": SECTION_STATES,
+            "pipelines": {
+                "in_flight": [p.to_dict(now) for p in inflight],
+                "recent": [p.to_dict(now) for p in recent],
+                "outcomes": outcomes,
+                "latency": self.pipeline_ms.summary(),
+            },
+            "sections": self.section_ms.summary(),
+            "llm": {
+                m: {
+                    "in_flight": llm_inflight.get(m, 0),
+                    "peak": llm_peak.get(m, 0),
+                    "calls": llm_calls.get(m, 0),
+                    **llm_latency.get(m, LatencyRing().summary()),
+                }
+                for m in models
+            },
+        }
+
+
+_live = LiveStatus()
+# The pipeline the current thread works for (agent threads inherit it via the executor's context copy)
+_current: contextvars.ContextVar[Optional[PipelineStatus]] = contextvars.ContextVar("live_pipeline", default=None)
+
+
+def get_live_status() -> LiveStatus:
+    return _live
+
+
+def live_snapshot() -> Dict[str, Any]:
+    return _live.snapshot()
+
+
+# ============================================================
+# HOOKS (called from the orchestrator and the agents; never raise)
+# ============================================================
+@contextmanager
+def track_pipeline(kind: str, sections: Sequence[str], tenant: Optional[str] = None,
+                   compiler_mode: str = "", pipeline_id: str = "") -> Iterator[PipelineStatus]:
+    """Registers a pipeline for the dashboard; the outcome is done / failed / cancelled."""
+    status = PipelineStatus(pipeline_id or uuid.uuid4().hex[:12], kind, sections, tenant, compiler_mode)
+    _live.start(status)
+    reset = _current.set(status)
+    outcome = "failed"
+    try:
+        yield status
+        outcome = "done"
+    except BaseException as e:
+        outcome = "cancelled" if isinstance(e, Cancelled) else "failed"
+        raise
+    finally:
+        _current.reset(reset)
+        _live.finish(status, outcome)
+
+
+def mark_stage(stage: str) -> None:
+    status = _current.get()
+    if status is not None:
+        status.stage = stage
+
+
+def mark_section(section: str, state: str, model: str = "") -> None:
+    """
+    running / retrying / repaired / fallback while the agent works; done / failed end it.
+    "running" after "retrying" restores the state the retry interrupted, and
+    neither "running" nor "done" hides an earlier repaired / fallback state.
+    """
+    status = _current.get()
+    if status is None or section not in status.sections:
+        return
+    now = time.time()
+    current = status.sections[section]
+    if model:
+        status.models[section] = model
+    if state == "running":
+        status.section_started.setdefault(section, now)
+        if current == "retrying":
+            state = status.before_retry.pop(section, "running")
+        elif current in ("repaired", "fallback"):
+            return
+    elif state == "retrying" and current != "retrying":
+        status.before_retry[section] = current
+    elif state in ("done", "failed"):
+        ms = round((now - status.section_started.get(section, now)) * 1000, 1)
+        status.section_ms[section] = ms
+        if state == "done":
+            _live.section_ms.add(section, ms)
+            if current in ("repaired", "fallback"):
+                return
+    status.sections[section] = state
+
+
+@contextmanager
+def llm_call(model: str) -> Iterator[None]:
+    """Counts one in-flight LLM request against `model` and records its latency."""
+    model = model or "unknown"
+    t0 = time.time()
+    _live.llm_started(model)
+    try:
+        yield
+    finally:
+        _live.llm_finished(model, (time.time() - t0) * 1000)
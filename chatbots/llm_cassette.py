@@ -0,0 +1,393 @@
+# chatbots/llm_cassette.py
+from __future__ import annotations
+
+import argparse
+import difflib
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# off | record | replay
+CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").strip().lower()
+# *.jsonl -> one JSON object per line | *.sqlite / *.db -> SQLite
+CASSETTE_PATH = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl")
+# Replay delay: "original" (recorded latency), a scale factor ("0.1"), or "0" for none
+CASSETTE_LATENCY = os.getenv("LLM_CASSETTE_LATENCY", "original")
+
+PREVIEW_CHARS = 160
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[LLMCassette] {msg}")
+
+
+def _latency_scale(raw: str) -> float:
+    raw = (raw or "original").strip().lower()
+    return 1.0 if raw == "original" else max(0.0, float(raw))
+
+
+def _messages_text(messages: Any) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(f"{type(m).__name__}:{getattr(m, 'content', m)}" for m in messages)
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def call_keys(model: str, max_tokens: int, messages: Any) -> Tuple[str, str]:
+    """(exact key: model + max_tokens + messages, loose key: messages only)."""
+    prompt_sha = _sha(_messages_text(messages))
+    return _sha(f"{model}|{max_tokens}|{prompt_sha}"), prompt_sha
+
+
+# ============================================================
+# STORAGE
+# ============================================================
+class Cassette(ABC):
+    """
+    Append-only list of entries:
+      {"type": "call", "key", "prompt_sha", "model", "max_tokens", "prompt_chars",
+       "prompt_preview", "response" | "error" + "status", "latency_ms", "ts"}
+      {"type": "pipeline", "variables", "prompts", "temperature", "compiler_mode", "ts"}
+    Calls keep only hashes of the prompt (plus a short preview), so a cassette
+    stays roughly the size of the responses.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def append(self, entry: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+
+class JsonlCassette(Cassette):
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class SqliteCassette(Cassette):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, body TEXT NOT NULL)")
+        self._conn.commit()
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        body = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._conn.execute("INSERT INTO entries (body) VALUES (?)", (body,))
+            self._conn.commit()
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT body FROM entries ORDER BY id").fetchall()
+        for (body,) in rows:
+            yield json.loads(body)
+
+
+def open_cassette(path: str) -> Cassette:
+    if path.endswith((".sqlite", ".sqlite3", ".db")):
+        return SqliteCassette(path)
+    return JsonlCassette(path)
+
+
+# ============================================================
+# RECORD
+# ============================================================
+class RecordingLLM:
+    """Wraps a real client; every invoke (each retry attempt too) is appended to the cassette."""
+    def __init__(self, inner: Any, model: str, max_tokens: int, cassette: Cassette):
+        self._inner = inner
+        self.model = model
+        self.max_tokens = max_tokens
+        self._cassette = cassette
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._inner, name)
+
+    def invoke(self, messages: Any, *args: Any, **kwargs: Any) -> Any:
+        key, prompt_sha = call_keys(self.model, self.max_tokens, messages)
+        text = _messages_text(messages)
+        entry = {
+            "type": "call", "key": key, "prompt_sha": prompt_sha, "model": self.model,
+            "max_tokens": self.max_tokens, "prompt_chars": len(text),
+            "prompt_preview": text[-PREVIEW_CHARS:], "ts": time.time(),
+        }
+        t0 = time.time()
+        try:
+            out = self._inner.invoke(messages, *args, **kwargs)
+        except Exception as e:
+            response = getattr(e, "response", None)
+            status = getattr(e, "status_code", None) or getattr(response, "status_code", None)
+            entry.update(error=f"{type(e).__name__}: {e}", status=status, latency_ms=round((time.time() - t0) * 1000, 1))
+            self._cassette.append(entry)
+            raise
+        entry.update(
+            response=out if isinstance(out, str) else str(getattr(out, "content", out) or ""),
+            latency_ms=round((time.time() - t0) * 1000, 1),
+        )
+        self._cassette.append(entry)
+        return out
+
+
+# ============================================================
+# REPLAY
+# ============================================================
+class CassetteMiss(LookupError):
+    """No recorded call for this prompt. status_code 404 makes the retry policy treat it as permanent."""
+    status_code = 404
+
+
+class ReplayedError(Exception):
+    """A recorded failure, raised again with its HTTP status so retries classify it the same way."""
+    def __init__(self, message: str, status_code: Optional[int]):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ReplayIndex:
+    """Recorded calls by exact key, falling back to the prompt alone (e.g. the A/B router picked the other model)."""
+    def __init__(self, entries: List[Dict[str, Any]], latency_scale: float):
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._exact: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._loose: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.pipelines: List[Dict[str, Any]] = []
+        self.hits = 0
+        self.loose_hits = 0
+        self.misses = 0
+        for e in entries:
+            if e.get("type") == "pipeline":
+                self.pipelines.append(e)
+            elif e.get("type") == "call":
+                self._exact[e["key"]].append(e)
+                self._loose[e["prompt_sha"]].append(e)
+
+    def next(self, key: str, prompt_sha: str) -> Optional[Dict[str, Any]]:
+        """Recorded entries for a prompt are served in recording order, cycling when exhausted."""
+        with self._lock:
+            for kind, table, k in (("exact", self._exact, key), ("loose", self._loose, prompt_sha)):
+                rows = table.get(k)
+                if rows:
+                    i = self._cursor[(kind, k)]
+                    self._cursor[(kind, k)] = i + 1
+                    self.hits += 1
+                    self.loose_hits += 1 if kind == "loose" else 0
+                    return rows[i % len(rows)]
+            self.misses += 1
+            return None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._cursor.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": sum(len(v) for v in self._exact.values()), "pipelines": len(self.pipelines),
+                    "hits": self.hits, "loose_hits": self.loose_hits, "misses": self.misses}
+
+
+class ReplayLLM:
+    """Stands in for the Together client: no network, no API key."""
+    def __init__(self, model: str, max_tokens: int, index: ReplayIndex):
+        self.model = model
+        self.max_tokens = max_tokens
+        self._index = index
+
+    def invoke(self, messages: Any, *args: Any, **kwargs: Any) -> str:
+        from chatbots.cancellation import cancellable_sleep
+
+        key, prompt_sha = call_keys(self.model, self.max_tokens, messages)
+        entry = self._index.next(key, prompt_sha)
+        if entry is None:
+            raise CassetteMiss(f"no recorded call for {self.model} prompt {prompt_sha[:10]}")
+        delay = float(entry.get("latency_ms") or 0) / 1000.0 * self._index.latency_scale
+        if delay > 0:
+            cancellable_sleep(delay)
+        if "error" in entry:
+            raise ReplayedError(entry["error"], entry.get("status"))
+        return entry.get("response") or ""
+
+
+# ============================================================
+# PLUG-IN POINT (agents' _make_llm)
+# ============================================================
+_state_lock = threading.Lock()
+_cassette: Optional[Cassette] = None
+_index: Optional[ReplayIndex] = None
+
+
+def configure(mode: str, path: str = CASSETTE_PATH, latency: str = CASSETTE_LATENCY) -> None:
+    """Switches the process to off/record/replay (the env vars set the default at import)."""
+    global CASSETTE_MODE, _cassette, _index
+    mode = (mode or "off").strip().lower()
+    if mode not in ("off", "record", "replay"):
+        raise ValueError("LLM cassette mode must be off, record or replay")
+    with _state_lock:
+        CASSETTE_MODE = mode
+        _cassette = open_cassette(path) if mode != "off" else None
+        _index = ReplayIndex(list(_cassette.entries()), _latency_scale(latency)) if mode == "replay" else None
+    if mode != "off":
+        _log(f"mode={mode} | path={path}" + (f" | {_index.stats()}" if _index else ""))
+
+
+def with_cassette(model: str, max_tokens: int, build: Callable[[], Any]) -> Any:
+    """
+    Returns the LLM client to use: build() when off, build() wrapped for
+    recording, or a ReplayLLM (build() is never called, so no API key is needed).
+    """
+    if CASSETTE_MODE == "replay" and _index is not None:
+        return ReplayLLM(model, max_tokens, _index)
+    llm = build()
+    if CASSETTE_MODE == "record" and _cassette is not None:
+        return RecordingLLM(llm, model, max_tokens, _cassette)
+    return llm
+
+
+def record_pipeline(variables: Dict[str, str], prompts: Dict[str, str], temperature: float, compiler_mode: str) -> None:
+    """Stores a pipeline's inputs (record mode only) so `bench` can replay it later."""
+    if CASSETTE_MODE != "record" or _cassette is None:
+        return
+    _cassette.append({
+        "type": "pipeline", "variables": dict(variables), "prompts": dict(prompts),
+        "temperature": temperature, "compiler_mode": compiler_mode, "ts": time.time(),
+    })
+
+
+if CASSETTE_MODE != "off":
+    configure(CASSETTE_MODE)
+
+
+# ============================================================
+# BENCHMARK CLI
+#   python -m chatbots.llm_cassette bench --cassette calls.jsonl --latency 0.1 --out run_b.jsonl [--baseline run_a.jsonl]
+#   python -m chatbots.llm_cassette compare run_a.jsonl run_b.jsonl
+# ============================================================
+def _pct(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))], 1)
+
+
+def _load_results(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def bench(cassette_path: str, latency: str, out_path: str, repeat: int = 1, limit: int = 0) -> List[Dict[str, Any]]:
+    from chatbots.orchestrater import generate_blog_pipeline
+
+    configure("replay", cassette_path, latency)
+    assert _index is not None
+    pipelines = _index.pipelines[:limit] if limit else _index.pipelines
+    if not pipelines:
+        raise SystemExit(f"no recorded pipelines in {cassette_path} (record with LLM_CASSETTE_MODE=record)")
+    results: List[Dict[str, Any]] = []
+    for rep in range(repeat):
+        _index.reset()
+        for i, p in enumerate(pipelines):
+            t0 = time.time()
+            final = generate_blog_pipeline(
+                p["variables"], p["prompts"], float(p.get("temperature") or 0.7),
+                compiler_mode=p.get("compiler_mode"),
+            )
+            results.append({
+                "pipeline": i, "repeat": rep, "latency_ms": round((time.time() - t0) * 1000, 1),
+                "chars": len(final), "sha": _sha(final), "final": final,
+            })
+    with open(out_path, "w", encoding="utf-8") as f:
+        for r in results:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    lat = [r["latency_ms"] for r in results]
+    print(f"pipelines={len(pipelines)} runs={len(results)} p50={_pct(lat, 50)}ms p95={_pct(lat, 95)}ms | replay {_index.stats()}")
+    return results
+
+
+def compare(a: List[Dict[str, Any]], b: List[Dict[str, Any]], show: int = 3) -> Dict[str, Any]:
+    first_a = {r["pipeline"]: r for r in a if r.get("repeat", 0) == 0}
+    first_b = {r["pipeline"]: r for r in b if r.get("repeat", 0) == 0}
+    common = sorted(set(first_a) & set(first_b))
+    changed = [i for i in common if first_a[i]["sha"] != first_b[i]["sha"]]
+    lat_a = [r["latency_ms"] for r in a]
+    lat_b = [r["latency_ms"] for r in b]
+    summary = {
+        "pipelines": len(common),
+        "outputs_changed": len(changed),
+        "latency_ms": {
+            "a": {"p50": _pct(lat_a, 50), "p95": _pct(lat_a, 95)},
+            "b": {"p50": _pct(lat_b, 50), "p95": _pct(lat_b, 95)},
+        },
+    }
+    print(json.dumps(summary, indent=2))
+    for i in changed[:show]:
+        diff = difflib.unified_diff(
+            first_a[i]["final"].splitlines(), first_b[i]["final"].splitlines(),
+            fromfile=f"a/pipeline-{i}", tofile=f"b/pipeline-{i}", lineterm="", n=1,
+        )
+        print("\n".join(diff))
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m chatbots.llm_cassette", description="Replay recorded LLM traffic through the pipeline.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench", help="replay every recorded pipeline and write per-run results")
+    b.add_argument("--cassette", default=CASSETTE_PATH)
+    b.add_argument("--latency", default="original", help='"original", a scale factor like 0.1, or 0')
+    b.add_argument("--out", required=True)
+    b.add_argument("--repeat", type=int, default=1)
+    b.add_argument("--limit", type=int, default=0)
+    b.add_argument("--baseline", help="results file of an earlier run to compare against")
+    c = sub.add_parser("compare", help="latency and output diff between two bench results")
+    c.add_argument("a")
+    c.add_argument("b")
+    c.add_argument("--show", type=int, default=3, help="diffs to print")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "bench":
+        results = bench(args.cassette, args.latency, args.out, args.repeat, args.limit)
+        if args.baseline:
+            compare(_load_results(args.baseline), results)
+        return 0
+    summary = compare(_load_results(args.a), _load_results(args.b), args.show)
+    return 1 if summary["outputs_changed"] else 0
+
+
+if __name__ == "__main__":
+    # Run through the imported module so configure() affects the copy the agents use
+    from chatbots.llm_cassette import main as _main
+    sys.exit(_main())
@@ -0,0 +1,87 @@
+# chatbots/llm_runtime.py
+from __future__ import annotations
+
+import functools
+import os
+import time
+from typing import Any, Callable, Dict, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+
+# ============================================================
+# ENV
+# ============================================================
+@functools.lru_cache(maxsize=None)
+def load_env() -> bool:
+    """
+    Loads .env once per process (every module used to call load_dotenv() on import).
+    Returns False when python-dotenv is not installed.
+    """
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        return False
+    load_dotenv()
+    return True
+
+
+# ============================================================
+# LAZY LANGCHAIN IMPORTS
+# ============================================================
+# langchain_together pulls in openai/aiohttp/transformers-style deps and is ~90%
+# of the app's import time. Nothing needs it until the first agent call.
+@functools.lru_cache(maxsize=None)
+def together_cls() -> Any:
+    t0 = time.time()
+    from langchain_together import Together
+    if DEBUGGING_MODE:
+        print(f"[LLMRuntime] langchain_together loaded in {(time.time() - t0) * 1000:.0f}ms")
+    return Together
+
+
+@functools.lru_cache(maxsize=None)
+def message_classes() -> Tuple[Any, Any]:
+    """(SystemMessage, HumanMessage)"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+    return SystemMessage, HumanMessage
+
+
+def chat_messages(system_text: str, user_text: str) -> list:
+    SystemMessage, HumanMessage = message_classes()
+    return [SystemMessage(content=system_text), HumanMessage(content=user_text)]
+
+
+def together_api_key() -> str:
+    load_env()
+    api_key = os.getenv("TOGETHER_API_KEY") or os.getenv("TOGETHERAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Missing TOGETHER_API_KEY in environment.")
+    return api_key
+
+
+# ============================================================
+# WARM-UP
+# ============================================================
+def warm_llm_clients(make_llm: Callable[[], Any]) -> Dict[str, Any]:
+    """
+    Imports the LLM stack and builds one client through `make_llm` so the first
+    real request doesn't pay for imports + pydantic model/validator setup.
+    The Together completion client posts each call on a fresh HTTPS connection,
+    so there is no connection pool to pre-open beyond this.
+    """
+    t0 = time.time()
+    out: Dict[str, Any] = {}
+    try:
+        together_cls()
+        message_classes()
+        make_llm()
+        out["ok"] = True
+    except Exception as e:
+        out["ok"] = False
+        out["error"] = str(e)
+    out["ms"] = round((time.time() - t0) * 1000, 1)
+    return out
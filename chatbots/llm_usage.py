@@ -0,0 +1,84 @@
+# chatbots/llm_usage.py
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Optional
+
+
+# ============================================================
+# USAGE SINK
+# ============================================================
+# app.py plugs the DB ledger in here; agents only ever call record_llm_call().
+_usage_sink: Optional[Callable[[Dict[str, Any]], None]] = None
+
+
+def set_usage_sink(fn: Optional[Callable[[Dict[str, Any]], None]]) -> None:
+    global _usage_sink
+    _usage_sink = fn
+
+
+# ============================================================
+# TOKEN COUNTING
+# ============================================================
+def estimate_tokens(text: str) -> int:
+    """
+    Together's completion wrapper returns a bare string (no usage block),
+    so token counts are estimated at ~4 chars/token.
+    """
+    t = text or ""
+    if not t:
+        return 0
+    return max(1, (len(t) + 3) // 4)
+
+
+def usage_from_output(out: Any) -> Optional[Dict[str, int]]:
+    """
+    Provider-reported usage when the LLM returns a message with usage_metadata.
+    """
+    meta = getattr(out, "usage_metadata", None)
+    if not isinstance(meta, dict):
+        return None
+    try:
+        return {
+            "prompt_tokens": int(meta.get("input_tokens") or 0),
+            "completion_tokens": int(meta.get("output_tokens") or 0),
+        }
+    except Exception:
+        return None
+
+
+def record_llm_call(
+    agent: str,
+    kind: str,
+    model: str,
+    prompt_text: str,
+    completion_text: str,
+    latency_ms: float,
+    attempts: int,
+    success: bool = True,
+    usage: Optional[Dict[str, int]] = None,
+) -> None:
+    """
+    kind: "section" | "repair" | "fallback" | "compiler"
+    Never raises into the agent.
+    """
+    sink = _usage_sink
+    if sink is None:
+        return
+    try:
+        if usage is None:
+            usage = {
+                "prompt_tokens": estimate_tokens(prompt_text),
+                "completion_tokens": estimate_tokens(completion_text),
+            }
+        sink({
+            "agent": agent,
+            "kind": kind,
+            "model": model or "",
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "latency_ms": int(latency_ms),
+            "attempts": int(attempts),
+            "success": bool(success),
+        })
+    except Exception:
+        pass
@@ -0,0 +1,191 @@
+# chatbots/local_compiler.py
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from chatbots.repair import common_issues
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+COMPILER_MODES = ("llm", "local", "hybrid")
+# llm: LLM compiler (Compile_Blog) only | local: rule-based assembly only |
+# hybrid: local first, the LLM compiler only when the quality checks fail
+DEFAULT_COMPILER_MODE = os.getenv("COMPILER_MODE", "llm").strip().lower()
+
+LOCAL_MIN_WORDS = int(os.getenv("LOCAL_COMPILER_MIN_WORDS", "250"))
+# Drafts that must be present for the local blog to pass (others are optional)
+LOCAL_REQUIRED_SECTIONS = ("intro", "faqs")
+LOCAL_MIN_SECTIONS = 4
+
+# Reading order of the assembled blog
+SECTION_ORDER: Tuple[str, ...] = (
+    "intro",
+    "short_cta",
+    "faqs",
+    "business_description",
+    "final_cta",
+    "integrate_references",
+)
+
+# Heading added when a draft arrives without one
+DEFAULT_HEADINGS: Dict[str, str] = {
+    "faqs": "## Frequently Asked Questions",
+    "business_description": "## About {COMPANY_NAME}",
+    "final_cta": "## Take the Next Step",
+    "integrate_references": "## References",
+}
+
+# One line placed before the section; picked deterministically per title
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "faqs": (
+        "Below are answers to the questions people ask most often.",
+        "Here are quick answers to common questions on this topic.",
+        "These are the questions we hear most, with short answers.",
+    ),
+    "business_description": (
+        "If you want guidance that fits your situation, here is who we are.",
+        "Here is a little about the team behind this guide.",
+    ),
+}
+
+PLACEHOLDERS = ("COMPANY_NAME", "CALL_NUMBER", "ADDRESS", "STATE_NAME", "LINK", "COMPANY_EMPLOYEE")
+
+_HEADING_LINE_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$", re.M)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[LocalCompiler] {msg}")
+
+
+def resolve_mode(mode: Optional[str]) -> str:
+    """'' / None -> COMPILER_MODE env default; raises ValueError on an unknown mode."""
+    m = (mode or DEFAULT_COMPILER_MODE or "llm").strip().lower()
+    if m not in COMPILER_MODES:
+        raise ValueError(f"compiler_mode must be one of {', '.join(COMPILER_MODES)}")
+    return m
+
+
+# ============================================================
+# ASSEMBLY STEPS
+# ============================================================
+def _norm_heading(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def _title_for(variables: Dict[str, str]) -> str:
+    title = (variables.get("TITLE") or "").strip()
+    if title:
+        return title.lstrip("#").strip()
+    msg = (variables.get("USER_MESSAGE") or "").strip()
+    if not msg:
+        return "Blog"
+    first = _SENTENCE_RE.split(msg, maxsplit=1)[0].strip().rstrip(".!?")
+    words = first.split()
+    first = " ".join(words[:14])
+    return first[:1].upper() + first[1:]
+
+
+def _demote_titles(text: str) -> str:
+    # One '# ' title per blog: section drafts never keep their own
+    return _HEADING_LINE_RE.sub(lambda m: f"## {m.group(2)}" if m.group(1) == "#" else m.group(0), text)
+
+
+def _with_heading(section: str, text: str) -> str:
+    heading = DEFAULT_HEADINGS.get(section)
+    if not heading or text.lstrip().startswith("## "):
+        return text
+    return f"{heading}\n\n{text}"
+
+
+def _transition(section: str, title: str) -> str:
+    options = TRANSITIONS.get(section)
+    if not options:
+        return ""
+    idx = int(hashlib.md5(f"{title}|{section}".encode("utf-8")).hexdigest(), 16) % len(options)
+    return options[idx]
+
+
+def _dedupe_headings(text: str) -> Tuple[str, int]:
+    """Drops a heading line whose text already appeared (the content under it stays)."""
+    seen = set()
+    out: List[str] = []
+    dropped = 0
+    for line in text.split("\n"):
+        m = _HEADING_LINE_RE.match(line)
+        if m:
+            key = _norm_heading(m.group(2))
+            if key in seen:
+                dropped += 1
+                continue
+            seen.add(key)
+        out.append(line)
+    return "\n".join(out), dropped
+
+
+def substitute_placeholders(text: str, variables: Dict[str, str]) -> str:
+    """{COMPANY_NAME} etc. -> value; placeholders without a value stay as-is."""
+    for key in PLACEHOLDERS:
+        value = (variables.get(key) or "").strip()
+        if value:
+            text = text.replace("{" + key + "}", value)
+    return text
+
+
+# ============================================================
+# PUBLIC
+# ============================================================
+def quality_checks(text: str, drafts: Dict[str, str]) -> Dict[str, Any]:
+    present = [s for s in SECTION_ORDER if (drafts.get(s) or "").strip()]
+    words = len(re.findall(r"\w+", text))
+    issues = common_issues(text)
+    if "<<" in text and ">>" in text:
+        issues.append("tag scaffolding left in output")
+    checks = {
+        "words": words,
+        "min_words": LOCAL_MIN_WORDS,
+        "sections_present": present,
+        "missing_required": [s for s in LOCAL_REQUIRED_SECTIONS if s not in present],
+        "issues": issues,
+    }
+    checks["passed"] = (
+        words >= LOCAL_MIN_WORDS
+        and len(present) >= LOCAL_MIN_SECTIONS
+        and not checks["missing_required"]
+        and not issues
+        and text.startswith("# ")
+    )
+    return checks
+
+
+def compile_local(drafts: Dict[str, str], variables: Dict[str, str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Rule-based compiler: section order, a single title, default section headings,
+    template transitions, heading de-duplication and placeholder substitution.
+    Returns (markdown, report) where report["checks"]["passed"] is the quality verdict.
+    """
+    title = _title_for(variables)
+    blocks: List[str] = [f"# {title}"]
+    for section in SECTION_ORDER:
+        text = (drafts.get(section) or "").strip()
+        if not text:
+            continue
+        text = _with_heading(section, _demote_titles(text))
+        transition = _transition(section, title)
+        if transition:
+            head, _, body = text.partition("\n")
+            text = f"{head}\n\n{transition}\n\n{body.strip()}" if head.startswith("## ") else f"{transition}\n\n{text}"
+        blocks.append(text)
+
+    out, dropped = _dedupe_headings("\n\n".join(blocks))
+    out = substitute_placeholders(re.sub(r"\n{3,}", "\n\n", out).strip(), variables)
+    checks = quality_checks(out, drafts)
+    _log(f"compiled | chars={len(out)} | words={checks['words']} | passed={checks['passed']}")
+    return out, {"title": title, "headings_deduped": dropped, "checks": checks}
@@ -0,0 +1,144 @@
+# chatbots/message_assembly.py
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Sequence, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# How long a provider typically keeps a prompt prefix warm
+PREFIX_CACHE_TTL_S = float(os.getenv("PREFIX_CACHE_TTL_S", "300"))
+PREFIX_TRACKER_MAX_ENTRIES = 4096
+
+SEGMENT_SEPARATOR = "\n\n"
+
+# Segment scopes, most stable first. Messages are assembled in this order so the
+# parts that repeat across calls form the longest possible common prefix.
+STATIC = 0    # identical for every call (guardrails, compiler directive)
+SHARED = 1    # identical for every section call of one request (reference blog examples)
+SECTION = 2   # identical for every call of one agent (section rules)
+REQUEST = 3   # this agent's filled prompt / the compiler's context (reused by its retries)
+CALL = 4      # unique to this call (drafts, bad output, repair instructions)
+
+
+class Segment(NamedTuple):
+    name: str
+    text: str
+    scope: int
+
+
+class AssembledMessages(NamedTuple):
+    system_text: str
+    user_text: str
+    # Final order (system segments, then user segments); used for prefix accounting
+    segments: Tuple[Segment, ...]
+
+
+def _chars_to_tokens(chars: int) -> int:
+    # Same ~4 chars/token estimate as llm_usage.estimate_tokens
+    return (chars + 3) // 4 if chars > 0 else 0
+
+
+def _ordered(segments: Sequence[Segment]) -> List[Segment]:
+    # Stable: segments of the same scope keep the caller's order
+    return sorted((s for s in segments if s.text), key=lambda s: s.scope)
+
+
+def assemble(system: Sequence[Segment], user: Sequence[Segment]) -> AssembledMessages:
+    sys_segs = _ordered(system)
+    user_segs = _ordered(user)
+    return AssembledMessages(
+        SEGMENT_SEPARATOR.join(s.text for s in sys_segs),
+        SEGMENT_SEPARATOR.join(s.text for s in user_segs),
+        tuple(sys_segs) + tuple(user_segs),
+    )
+
+
+# ============================================================
+# PREFIX REUSE ACCOUNTING
+# ============================================================
+class PrefixTracker:
+    """
+    Estimates how much of each prompt a provider-side prefix cache could reuse:
+    the longest run of leading segments already sent to the same model within
+    PREFIX_CACHE_TTL_S. Segment-granular, so it under-counts partial matches.
+    """
+    def __init__(self, ttl_s: float = PREFIX_CACHE_TTL_S, max_entries: int = PREFIX_TRACKER_MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._seen: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def observe(self, model: str, segments: Sequence[Segment]) -> Dict[str, int]:
+        h = hashlib.sha1()
+        boundaries: List[Tuple[str, int]] = []
+        chars = 0
+        for seg in segments:
+            h.update(seg.text.encode("utf-8"))
+            h.update(b"\x00")
+            chars += len(seg.text) + len(SEGMENT_SEPARATOR)
+            boundaries.append((h.hexdigest(), chars))
+
+        now = time.time()
+        reused_chars = 0
+        with self._lock:
+            for digest, upto in boundaries:
+                ts = self._seen.get((model, digest))
+                if ts is None or now - ts > self.ttl_s:
+                    break
+                reused_chars = upto
+            for digest, _ in boundaries:
+                key = (model, digest)
+                self._seen[key] = now
+                self._seen.move_to_end(key)
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+
+            st = self._stats.setdefault(model, {"calls": 0, "hits": 0, "prompt_tokens": 0, "reused_tokens": 0})
+            prompt_tokens = _chars_to_tokens(chars)
+            reused_tokens = _chars_to_tokens(reused_chars)
+            st["calls"] += 1
+            st["hits"] += 1 if reused_chars else 0
+            st["prompt_tokens"] += prompt_tokens
+            st["reused_tokens"] += reused_tokens
+        return {"prompt_tokens": prompt_tokens, "reused_tokens": reused_tokens}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {m: dict(st) for m, st in self._stats.items()}
+        total_prompt = sum(st["prompt_tokens"] for st in models.values())
+        total_reused = sum(st["reused_tokens"] for st in models.values())
+        for st in models.values():
+            st["reuse_ratio"] = round(st["reused_tokens"] / st["prompt_tokens"], 3) if st["prompt_tokens"] else 0.0
+        return {
+            "ttl_s": self.ttl_s,
+            "prompt_tokens": total_prompt,
+            "reused_tokens": total_reused,
+            "reuse_ratio": round(total_reused / total_prompt, 3) if total_prompt else 0.0,
+            "models": models,
+        }
+
+
+_tracker = PrefixTracker()
+
+
+def observe_prefix(model: str, assembled: AssembledMessages) -> Dict[str, int]:
+    """Never raises (accounting must not break a generation)."""
+    try:
+        return _tracker.observe(model or "unknown", assembled.segments)
+    except Exception as e:
+        if DEBUGGING_MODE:
+            print(f"[MessageAssembly] prefix accounting failed: {e}")
+        return {"prompt_tokens": 0, "reused_tokens": 0}
+
+
+def prefix_stats() -> Dict[str, Any]:
+    return _tracker.stats()
@@ -3,10 +3,11 @@ from __future__ import annotations
 
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Tuple, Any
+from concurrent.futures import as_completed
+from typing import Callable, Dict, Optional, Sequence, Tuple, Any
 
 from chatbots.SingularAgents import (
+    SECTION_MAX_TOKENS,
     Intro_Writing_Agent,
     Final_CTA_Agent,
     FAQs_Writing_Agent,
@@ -15,7 +16,13 @@ from chatbots.SingularAgents import (
     References_Writing_Agent,
 )
 
-from chatbots.FullAgents import Full_Blog_Writer
+from chatbots.FullAgents import CompilerInput, Compile_Blog
+from chatbots.local_compiler import compile_local, resolve_mode
+from chatbots.agent_executor import get_agent_executor
+from chatbots.cancellation import Cancelled, check_cancelled, current_token
+from chatbots.llm_usage import estimate_tokens
+from chatbots.llm_cassette import record_pipeline
+from chatbots.live_status import mark_section, mark_stage, track_pipeline
 
 
 # =========================
@@ -30,13 +37,8 @@ def _log_err(msg: str) -> None:
 
 
 # =========================
-# PROMPT TAGGING
+# COMPILER HANDOFF
 # =========================
-def _tag_block(tag: str, content: str) -> str:
-    content = (content or "").strip()
-    return f"<<{tag}>>\n{content}\n"
-
-
 def _build_business_context(variables: Dict[str, str]) -> str:
     lines = []
     for k in [
@@ -55,143 +57,372 @@ def _build_business_context(variables: Dict[str, str]) -> str:
     return "\n".join(lines).strip()
 
 
+def _build_compiler_input(
+    blog_requirements: str,
+    variables: Dict[str, str],
+    drafts: Dict[str, str],
+) -> CompilerInput:
+    """Drafts go to the compiler as they are (no tagged text to re-parse)."""
+    return CompilerInput.from_drafts(
+        blog_requirements,
+        variables.get("USER_MESSAGE", ""),
+        _build_business_context(variables),
+        drafts,
+    )
+
+
 def _build_compiler_prompt(
     blog_requirements: str,
     variables: Dict[str, str],
     drafts: Dict[str, str],
 ) -> str:
     """
+    The same handoff as a `<<TAG>>` string, for Full_Blog_Writer callers.
     IMPORTANT:
     - Do NOT embed System/Human text here.
     - Only use tagged blocks so FullAgents can parse them.
     """
-    business_context = _build_business_context(variables)
-
-    prompt = ""
-    prompt += _tag_block("BLOG_REQUIREMENTS", blog_requirements)
-    prompt += _tag_block("USER_MESSAGE", variables.get("USER_MESSAGE", ""))
-    prompt += _tag_block("BUSINESS_CONTEXT", business_context)
-
-    prompt += _tag_block("DRAFT_INTRO", drafts.get("intro", ""))
-    prompt += _tag_block("DRAFT_BODY_FAQS", drafts.get("faqs", ""))  # if you only have FAQs as "body", keep here
-    prompt += _tag_block("DRAFT_BUSINESS_DESCRIPTION", drafts.get("business_description", ""))
-    prompt += _tag_block("DRAFT_SHORT_CTA", drafts.get("short_cta", ""))
-    prompt += _tag_block("DRAFT_FINAL_CTA", drafts.get("final_cta", ""))
-    prompt += _tag_block("DRAFT_REFERENCES", drafts.get("integrate_references", ""))
-
-    return prompt.strip()
+    return _build_compiler_input(blog_requirements, variables, drafts).to_tagged()
 
 
 # =========================
 # SAFE AGENT RUNNER
 # =========================
-def _run_agent(agent_name: str, fn, prompt: str, temperature: float) -> Tuple[str, str]:
+def _run_agent(agent_name: str, fn, prompt: str, temperature: float, shared: str = "") -> Tuple[str, str]:
     """
     Returns (agent_name, output_text).
     Never raises to the executor.
     """
     try:
-        _, out = fn(prompt, temperature)
+        _, out = fn(prompt, temperature, shared)
         out = (out or "").strip()
         if not out:
             raise RuntimeError("empty output")
+        mark_section(agent_name, "done")
         return agent_name, out
     except Exception as e:
         _log_err(f"Agent '{agent_name}' failed: {e}")
+        mark_section(agent_name, "failed")
         return agent_name, ""
 
 
 # =========================
 # MAIN PIPELINE
 # =========================
-def generate_blog_pipeline(
-    variables: Dict[str, str],
-    prompts: Dict[str, str],
-    temperature: float,
-) -> str:
-    """
-    variables: company info + USER_MESSAGE etc.
-    prompts: dict containing the already-filled prompt strings:
-        prompts["intro_prompt"], prompts["final_cta_prompt"], prompts["faqs_prompt"],
-        prompts["business_description_prompt"], prompts["short_cta_prompt"], prompts["references_prompt"],
-        prompts["full_blog_prompt"]   (THIS IS YOUR BLOG REQUIREMENTS STRING)
-    returns: final blog markdown only
-    """
-    t0 = time.time()
-    _log("Starting blog generation pipeline...")
+def _pipeline_id() -> str:
+    """The request's cancel ID when there is one, so the dashboard and the cancel endpoint agree."""
+    token = current_token()
+    return token.request_id if token is not None else ""
 
-    _log("Recieved the following variables:")
-    for k, v in variables.items():
-        _log(f"  {k}: {v}")
-
-    # Extract requirements
-    blog_requirements = (prompts.get("full_blog_prompt") or "").strip()
-    if not blog_requirements:
-        blog_requirements = "Write a clear SEO blog using the provided drafts."
 
-    # 1) Run section agents in parallel
-    _log("Launching 6 section agents in parallel...")
+def _notify_section_done(on_section_done: Optional[Callable[[str], None]], name: str) -> None:
+    if on_section_done is None:
+        return
+    try:
+        on_section_done(name)
+    except Exception as e:
+        _log_err(f"on_section_done({name}) failed: {e}")
 
-    agent_calls = [
-        ("intro", Intro_Writing_Agent, prompts.get("intro_prompt", "")),
-        ("final_cta", Final_CTA_Agent, prompts.get("final_cta_prompt", "")),
-        ("faqs", FAQs_Writing_Agent, prompts.get("faqs_prompt", "")),
-        ("business_description", Business_Description_Agent, prompts.get("business_description_prompt", "")),
-        ("short_cta", Short_CTA_Agent, prompts.get("short_cta_prompt", "")),
-        ("integrate_references", References_Writing_Agent, prompts.get("references_prompt", "")),
-    ]
 
-    drafts: Dict[str, str] = {}
+def _stitch_drafts(drafts: Dict[str, str]) -> str:
+    # fallback: stitch drafts, but still don't leak prompt
+    return "\n\n".join([
+        drafts.get("intro", ""),
+        drafts.get("faqs", ""),
+        drafts.get("business_description", ""),
+        drafts.get("short_cta", ""),
+        drafts.get("final_cta", ""),
+        drafts.get("integrate_references", ""),
+    ]).strip()
 
-    with ThreadPoolExecutor(max_workers=6) as ex:
-        futures = []
-        for name, fn, p in agent_calls:
-            futures.append(ex.submit(_run_agent, name, fn, p, temperature))
 
-        for fut in as_completed(futures):
-            name, out = fut.result()
-            drafts[name] = out
-            if out:
-                _log(f"Processing {name} agent result...")
-                _log(f"{name} agent completed successfully | chars={len(out)}")
-                _log(f"{name} agent completed successfully | Output: \n{drafts[name]}")
-            else:
-                _log_err(f"{name} agent returned empty output")
-
-    # 2) Build compiler prompt (TAGGED)
-    _log("Building final compiler prompt...")
-    compiler_prompt = _build_compiler_prompt(
+def _compile_llm(blog_requirements: str, variables: Dict[str, str], drafts: Dict[str, str], temperature: float) -> str:
+    _log("Building final compiler input...")
+    compiler_input = _build_compiler_input(
         blog_requirements=blog_requirements,
         variables=variables,
         drafts=drafts,
     )
 
-    # IMPORTANT: Do NOT print compiler_prompt (it will leak in logs or UI copying)
-    _log(f"Compiler prompt built | chars={len(compiler_prompt)}")
-    _log(f"Compiler prompt: {compiler_prompt}")
+    # IMPORTANT: Do NOT print the compiler input (it will leak in logs or UI copying)
+    _log(f"Compiler input built | chars={sum(len(v) for v in compiler_input)}")
 
-    # 3) Call compiler agent
     _log("Calling final compiler agent...")
     try:
-        _log("About to call Full_Blog_Writer() ...")
-        _, final_blog = Full_Blog_Writer(compiler_prompt, temperature)
+        _log("About to call Compile_Blog() ...")
+        final_blog = Compile_Blog(compiler_input, temperature)
         final_blog = (final_blog or "").strip()
         _log("Final compiler agent completed | Output: \n" + final_blog)
+        return final_blog
     except Exception as e:
         _log_err(f"Compiler failed: {e}")
         _log_err(traceback.format_exc())
-        # fallback: stitch drafts, but still don't leak prompt
-        final_blog = "\n\n".join([
-            drafts.get("intro", ""),
-            drafts.get("faqs", ""),
-            drafts.get("business_description", ""),
-            drafts.get("short_cta", ""),
-            drafts.get("final_cta", ""),
-            drafts.get("integrate_references", ""),
-        ]).strip()
-
-    dt = time.time() - t0
-    _log(f"Pipeline completed in {dt:.2f} seconds.")
-
-    # RETURN ONLY FINAL BLOG (NO DEBUG / NO PROMPT / NO SYSTEM/HUMAN)
-    return final_blog
+        return ""
+
+
+# section name -> prompts key (names match the progress columns)
+SECTION_PROMPT_KEYS: Dict[str, str] = {
+    "intro": "intro_prompt",
+    "final_cta": "final_cta_prompt",
+    "faqs": "faqs_prompt",
+    "business_description": "business_description_prompt",
+    "short_cta": "short_cta_prompt",
+    "integrate_references": "references_prompt",
+}
+SECTION_NAMES: Tuple[str, ...] = tuple(SECTION_PROMPT_KEYS)
+# prompts key of the reference examples shared by every section call (the
+# section prompts point to it instead of embedding {BLOGFOREXAMPLE} themselves)
+SHARED_EXAMPLES_KEY = "shared_examples"
+
+
+def _section_agents() -> Dict[str, Callable[[str, float, str], Tuple[str, str]]]:
+    return {
+        "intro": Intro_Writing_Agent,
+        "final_cta": Final_CTA_Agent,
+        "faqs": FAQs_Writing_Agent,
+        "business_description": Business_Description_Agent,
+        "short_cta": Short_CTA_Agent,
+        "integrate_references": References_Writing_Agent,
+    }
+
+
+def _run_sections(
+    prompts: Dict[str, str],
+    sections: Sequence[str],
+    temperature: float,
+    on_section_done: Optional[Callable[[str], None]] = None,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> Dict[str, str]:
+    agents = _section_agents()
+    drafts: Dict[str, str] = {}
+
+    # Shared process-wide pool: caps outbound LLM concurrency across requests
+    # and queues fairly between tenants (interactive before bulk)
+    ex = get_agent_executor()
+    shared = prompts.get(SHARED_EXAMPLES_KEY, "")
+    futures = []
+    for name in sections:
+        prompt = prompts.get(SECTION_PROMPT_KEYS[name], "")
+        # Cost for fairness/quotas: prompt + shared examples + max completion tokens
+        futures.append(ex.schedule(
+            _run_agent, (name, agents[name], prompt, temperature, shared),
+            tenant=tenant, priority=priority or "interactive",
+            cost_tokens=estimate_tokens(prompt) + estimate_tokens(shared) + SECTION_MAX_TOKENS[name],
+        ))
+
+    # On cancel: queued agents are dropped and running ones are abandoned
+    # (they stop before their next LLM call) instead of being waited for
+    token = current_token()
+    cancel_fut = token.as_future() if token is not None else None
+    for fut in as_completed(futures + ([cancel_fut] if cancel_fut else [])):
+        if fut is cancel_fut:
+            dropped = sum(1 for f in futures if f.cancel())
+            _log(f"Cancelled ({token.reason}) | dropped {dropped} queued agents")
+            raise Cancelled(token.reason)
+        name, out = fut.result()
+        drafts[name] = out
+        if out:
+            _log(f"Processing {name} agent result...")
+            _log(f"{name} agent completed successfully | chars={len(out)}")
+            _log(f"{name} agent completed successfully | Output: \n{drafts[name]}")
+            _notify_section_done(on_section_done, name)
+        else:
+            _log_err(f"{name} agent returned empty output")
+        # The cancel future only completes on cancel; stop once every section is in
+        if len(drafts) == len(futures):
+            break
+    return drafts
+
+
+def _compile(
+    variables: Dict[str, str],
+    prompts: Dict[str, str],
+    drafts: Dict[str, str],
+    temperature: float,
+    compiler_mode: str,
+    on_section_done: Optional[Callable[[str], None]] = None,
+) -> str:
+    # Extract requirements
+    blog_requirements = (prompts.get("full_blog_prompt") or "").strip()
+    if not blog_requirements:
+        blog_requirements = "Write a clear SEO blog using the provided drafts."
+
+    check_cancelled()
+    mark_stage("compiling")
+    final_blog = ""
+    local_blog = ""
+    if compiler_mode in ("local", "hybrid"):
+        local_blog, report = compile_local(drafts, variables)
+        _log(f"Local compiler | mode={compiler_mode} | passed={report['checks']['passed']} | words={report['checks']['words']}")
+        if compiler_mode == "local" or report["checks"]["passed"]:
+            final_blog = local_blog
+        else:
+            _log(f"Local compile failed checks -> LLM compiler | {report['checks']}")
+
+    if not final_blog and compiler_mode != "local":
+        final_blog = _compile_llm(blog_requirements, variables, drafts, temperature)
+
+    if final_blog:
+        _notify_section_done(on_section_done, "writing")
+        return final_blog
+    # hybrid keeps its local assembly when the LLM compiler fails too
+    return local_blog or _stitch_drafts(drafts)
+
+
+def generate_blog_pipeline(
+    variables: Dict[str, str],
+    prompts: Dict[str, str],
+    temperature: float,
+    on_section_done: Optional[Callable[[str], None]] = None,
+    compiler_mode: Optional[str] = None,
+    on_drafts: Optional[Callable[[Dict[str, str], Dict[str, str], Dict[str, str]], None]] = None,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> str:
+    """
+    variables: company info + USER_MESSAGE etc.
+    prompts: dict containing the already-filled prompt strings:
+        prompts["intro_prompt"], prompts["final_cta_prompt"], prompts["faqs_prompt"],
+        prompts["business_description_prompt"], prompts["short_cta_prompt"], prompts["references_prompt"],
+        prompts["full_blog_prompt"]   (THIS IS YOUR BLOG REQUIREMENTS STRING)
+        prompts["shared_examples"]    (optional: reference examples sent once, ahead of every section's rules)
+    on_section_done: optional callback, called with the section name ("intro", "faqs", ...)
+        for every non-empty draft and with "writing" once the compiler succeeds
+    compiler_mode: "llm" | "local" | "hybrid" (None -> COMPILER_MODE env, default "llm")
+        local  - rule-based assembly, no compiler LLM call
+        hybrid - local first; the LLM compiler only if the local quality checks fail
+    on_drafts: optional callback, called once as on_drafts(variables, prompts, drafts)
+        before compiling (used to persist the run for partial regeneration)
+    tenant / priority: scheduling identity of the section agent calls
+        (tenant defaults to COMPANY_NAME; priority "interactive" | "bulk")
+    Raises Cancelled once the caller's cancel token (chatbots.cancellation) is cancelled.
+    returns: final blog markdown only
+    """
+    compiler_mode = resolve_mode(compiler_mode)
+    with track_pipeline("blog", SECTION_NAMES, tenant or variables.get("COMPANY_NAME"), compiler_mode, _pipeline_id()):
+        t0 = time.time()
+        _log("Starting blog generation pipeline...")
+        record_pipeline(variables, prompts, temperature, compiler_mode)
+
+        _log("Recieved the following variables:")
+        for k, v in variables.items():
+            _log(f"  {k}: {v}")
+
+        # 1) Run section agents in parallel
+        _log("Launching 6 section agents in parallel...")
+        drafts = _run_sections(
+            prompts, SECTION_NAMES, temperature, on_section_done,
+            tenant=tenant or variables.get("COMPANY_NAME"), priority=priority,
+        )
+        if on_drafts is not None:
+            try:
+                on_drafts(dict(variables), dict(prompts), dict(drafts))
+            except Exception as e:
+                _log_err(f"on_drafts failed: {e}")
+
+        # 2) Compile: rule-based first (local/hybrid), LLM compiler otherwise
+        final_blog = _compile(variables, prompts, drafts, temperature, compiler_mode, on_section_done)
+
+        dt = time.time() - t0
+        _log(f"Pipeline completed in {dt:.2f} seconds.")
+
+        # RETURN ONLY FINAL BLOG (NO DEBUG / NO PROMPT / NO SYSTEM/HUMAN)
+        return final_blog
+
+
+def regenerate_sections(
+    variables: Dict[str, str],
+    prompts: Dict[str, str],
+    drafts: Dict[str, str],
+    sections: Sequence[str],
+    temperature: float,
+    on_section_done: Optional[Callable[[str], None]] = None,
+    compiler_mode: Optional[str] = None,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None,
+) -> Tuple[str, Dict[str, str]]:
+    """
+    Re-runs only `sections` (e.g. ["faqs"]) against a previous run's prompts,
+    keeps the other drafts as they were and recompiles.
+    A section that comes back empty keeps its previous draft.
+    returns: (final blog markdown, updated drafts)
+    """
+    compiler_mode = resolve_mode(compiler_mode)
+    unknown = [s for s in sections if s not in SECTION_PROMPT_KEYS]
+    if unknown:
+        raise ValueError(f"unknown sections: {', '.join(unknown)}")
+    sections = list(dict.fromkeys(sections))
+
+    with track_pipeline("regenerate", sections, tenant or variables.get("COMPANY_NAME"), compiler_mode, _pipeline_id()):
+        t0 = time.time()
+        _log(f"Regenerating sections {sections} | compiler_mode={compiler_mode}")
+        fresh = _run_sections(
+            prompts, sections, temperature, on_section_done,
+            tenant=tenant or variables.get("COMPANY_NAME"), priority=priority,
+        )
+        updated = dict(drafts)
+        for name, out in fresh.items():
+            if out:
+                updated[name] = out
+
+        final_blog = _compile(variables, prompts, updated, temperature, compiler_mode, on_section_done)
+        _log(f"Regeneration completed in {time.time() - t0:.2f} seconds.")
+        return final_blog, updated
+
+
+# =========================
+# FLASK ENTRY POINT
+# =========================
+def callAgents(
+    user_message: str,
+    company_name: str,
+    call_number: str,
+    address: str,
+    state_name: str,
+    link: str,
+    company_employee: str,
+    prompt_fullblog: str,
+    prompt_intro: str,
+    prompt_finalcta: str,
+    prompt_fullfaqs: str,
+    prompt_businessdesc: str,
+    prompt_references: str,
+    prompt_shortcta: str,
+    temperature: float,
+    on_section_done: Optional[Callable[[str], None]] = None,
+    compiler_mode: Optional[str] = None,
+    title: str = "",
+    on_drafts: Optional[Callable[[Dict[str, str], Dict[str, str], Dict[str, str]], None]] = None,
+    tenant: Optional[str] = None,
+    priority: Optional[str] = None,
+    shared_examples: str = "",
+) -> str:
+    """
+    Positional adapter used by app.py -> generate_blog_pipeline().
+    """
+    variables = {
+        "USER_MESSAGE": user_message,
+        "COMPANY_NAME": company_name,
+        "CALL_NUMBER": call_number,
+        "ADDRESS": address,
+        "STATE_NAME": state_name,
+        "LINK": link,
+        "COMPANY_EMPLOYEE": company_employee,
+        "TITLE": title,
+    }
+    prompts = {
+        "full_blog_prompt": prompt_fullblog,
+        "intro_prompt": prompt_intro,
+        "final_cta_prompt": prompt_finalcta,
+        "faqs_prompt": prompt_fullfaqs,
+        "business_description_prompt": prompt_businessdesc,
+        "references_prompt": prompt_references,
+        "short_cta_prompt": prompt_shortcta,
+        SHARED_EXAMPLES_KEY: shared_examples,
+    }
+    return generate_blog_pipeline(
+        variables, prompts, temperature,
+        on_section_done=on_section_done, compiler_mode=compiler_mode, on_drafts=on_drafts,
+        tenant=tenant, priority=priority,
+    )
@@ -0,0 +1,347 @@
+# chatbots/prompt_budget.py
+from __future__ import annotations
+
+import functools
+import os
+import re
+from typing import Any, Dict, List, Sequence, Tuple
+
+from chatbots.llm_usage import estimate_tokens
+from chatbots.SingularAgents import SECTION_MODELS, SECTION_MAX_TOKENS, section_system_prompt
+from chatbots.FullAgents import COMPILER_MODEL, FULL_TEXT_MAX_TOKENS, SYSTEM_DIRECTIVE_COMPILER
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# Prompt input budget = PROMPT_BUDGET_MULTIPLIER x the section's max output tokens,
+# never more than what fits in the smallest context window of its candidate models.
+PROMPT_BUDGET_MULTIPLIER = float(os.getenv("PROMPT_BUDGET_MULTIPLIER", "6"))
+# Examples keep at least this many tokens when the context window allows it,
+# even if the fixed part of the prompt already uses the multiplier budget.
+MIN_EXAMPLE_TOKENS = int(os.getenv("PROMPT_MIN_EXAMPLE_TOKENS", "256"))
+CONTEXT_SAFETY_TOKENS = 512
+
+DEFAULT_CONTEXT_TOKENS = 8192
+MODEL_CONTEXT_TOKENS: Dict[str, int] = {
+    "Qwen/Qwen3-Next-80B-A3B-Instruct": 262144,
+    "deepseek-ai/DeepSeek-R1-0528-tput": 163840,
+    "openai/gpt-oss-120b": 131072,
+    "openai/gpt-oss-20B": 131072,
+    "meta-llama/Meta-Llama-3-8B-Instruct-Lite": 8192,
+    "deepseek-ai/DeepSeek-V3.1": 131072,
+    "deepseek-ai/DeepSeek-V3": 131072,
+    "Qwen/Qwen2.5-72B-Instruct-Turbo": 32768,
+    "Qwen/Qwen2.5-7B-Instruct-Turbo": 32768,
+    "google/gemma-3n-E4B-it": 32768,
+}
+
+# Prompt template -> agent section (the compiler consumes PROMPT_FULLBLOG)
+PROMPT_SECTIONS: Dict[str, str] = {
+    "fullblog": "compiler",
+    "intro": "intro",
+    "finalcta": "final_cta",
+    "faqs": "faqs",
+    "businessdesc": "business_description",
+    "references": "integrate_references",
+    "shortcta": "short_cta",
+}
+
+EXAMPLE_PLACEHOLDERS: Tuple[str, ...] = (
+    "{BLOGFOREXAMPLE}",
+    "{BLOGPART_INTRO}",
+    "{BLOGPART_FINALCTA}",
+    "{BLOGPART_FAQS}",
+    "{BLOGPART_BUSINESSDESC}",
+    "{BLOGPART_SHORTCTA}",
+)
+
+# Sent once per section call as a shared system segment (SingularAgents), not
+# inside each section prompt; the placeholder is replaced with a pointer to it
+SHARED_EXAMPLE_PLACEHOLDERS: Tuple[str, ...] = ("{BLOGFOREXAMPLE}",)
+SHARED_EXAMPLES_POINTER = "(see REFERENCE BLOG EXAMPLES in the system message)"
+
+_WORD_RE = re.compile(r"[a-z0-9']{3,}")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+_STOPWORDS = frozenset("""
+the and for are but not you your with this that from have has had was were will can our they them their
+what when where which who how why about into than then there these those been being also just more most
+any all each other some such only own same very its it's out use using over under after before while
+""".split())
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[PromptBudget] {msg}")
+
+
+# ============================================================
+# EXAMPLE FORMATTING
+# ============================================================
+def format_examples(texts: Sequence[str]) -> str:
+    """Same layout the example fetchers always produced."""
+    return "\n\n".join(f"Example {i}:\n{t}" for i, t in enumerate(texts, 1))
+
+
+def replace_vars(prompt_text: str, replacements: Dict[str, str]) -> str:
+    """Fills `{PLACEHOLDER}`s in a prompt template (None values become "")."""
+    result = prompt_text or ""
+    for placeholder, value in replacements.items():
+        result = result.replace(placeholder, value or "")
+    return result
+
+
+def _example_overhead_tokens(n: int) -> int:
+    return estimate_tokens(format_examples([""] * n)) if n else 0
+
+
+# ============================================================
+# SEGMENTATION + RELEVANCE (cached per example text)
+# ============================================================
+def query_terms(*parts: str) -> frozenset:
+    words = _WORD_RE.findall(" ".join(p or "" for p in parts).lower())
+    return frozenset(w for w in words if w not in _STOPWORDS)
+
+
+@functools.lru_cache(maxsize=512)
+def _segments_of(text: str) -> Tuple[Tuple[str, int, frozenset], ...]:
+    """(paragraph, tokens, terms) per paragraph; cached since the same examples feed several prompts."""
+    out = []
+    for para in re.split(r"\n\s*\n", text or ""):
+        para = para.strip()
+        if para:
+            out.append((para, estimate_tokens(para), query_terms(para)))
+    return tuple(out)
+
+
+def _segment_score(idx: int, seg_text: str, seg_terms: frozenset, terms: frozenset) -> float:
+    overlap = len(seg_terms & terms) / (len(terms) or 1)
+    heading = 0.15 if seg_text.lstrip().startswith("#") else 0.0
+    # Earlier paragraphs carry the structure/voice of an example
+    position = 0.3 / (1 + idx)
+    return overlap + heading + position
+
+
+def _trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Cuts at a sentence (else word) boundary."""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * 4
+    cut = text[:max_chars]
+    sentences = _SENTENCE_END_RE.split(cut)
+    if len(sentences) > 1:
+        return " ".join(sentences[:-1]).strip()
+    return cut.rsplit(" ", 1)[0].strip()
+
+
+def fit_examples(texts: Sequence[str], budget_tokens: int, terms: frozenset) -> Tuple[str, Dict[str, Any]]:
+    """
+    Fits a list of example texts into `budget_tokens`:
+      kept     - everything fits
+      selected - most relevant paragraphs per example (original order kept)
+      trimmed  - a single paragraph had to be cut at a sentence boundary
+      dropped  - nothing fits
+    """
+    full = format_examples(texts)
+    tokens_in = estimate_tokens(full)
+    decision: Dict[str, Any] = {
+        "examples_in": len(texts),
+        "tokens_in": tokens_in,
+        "budget_tokens": max(0, budget_tokens),
+    }
+    if tokens_in <= budget_tokens:
+        decision.update(action="kept", examples_kept=len(texts), tokens_out=tokens_in)
+        return full, decision
+
+    avail = budget_tokens - _example_overhead_tokens(len(texts))
+    segs = [_segments_of(t) for t in texts]
+    candidates = []
+    for ex_i, ex_segs in enumerate(segs):
+        for seg_i, (seg_text, seg_tokens, seg_terms) in enumerate(ex_segs):
+            # Small bonus for the first paragraph of each example so every example stays represented
+            lead = 0.5 if seg_i == 0 else 0.0
+            candidates.append((_segment_score(seg_i, seg_text, seg_terms, terms) + lead, ex_i, seg_i, seg_tokens))
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+
+    chosen: Dict[int, Dict[int, str]] = {}
+    trimmed = False
+    used = 0
+    for _, ex_i, seg_i, seg_tokens in candidates:
+        if avail - used <= 0:
+            break
+        seg_text = segs[ex_i][seg_i][0]
+        if seg_tokens > avail - used:
+            if chosen:
+                continue
+            # Nothing selected yet: keep a trimmed head of the most relevant paragraph
+            seg_text = _trim_to_tokens(seg_text, avail - used)
+            if not seg_text:
+                continue
+            seg_tokens = estimate_tokens(seg_text)
+            trimmed = True
+        chosen.setdefault(ex_i, {})[seg_i] = seg_text
+        used += seg_tokens + 1
+
+    kept_texts = [
+        "\n\n".join(chosen[ex_i][seg_i] for seg_i in sorted(chosen[ex_i]))
+        for ex_i in sorted(chosen)
+    ]
+    out = format_examples(kept_texts)
+    decision.update(
+        action="dropped" if not kept_texts else ("trimmed" if trimmed else "selected"),
+        examples_kept=len(kept_texts),
+        segments_total=sum(len(s) for s in segs),
+        segments_kept=sum(len(v) for v in chosen.values()),
+        tokens_out=estimate_tokens(out),
+    )
+    return out, decision
+
+
+# ============================================================
+# PER-PROMPT BUDGETS
+# ============================================================
+def section_limits(section: str) -> Dict[str, int]:
+    """max output tokens, smallest candidate-model context and system-prompt size."""
+    if section == "compiler":
+        models = [COMPILER_MODEL]
+        max_out = FULL_TEXT_MAX_TOKENS
+        system = SYSTEM_DIRECTIVE_COMPILER
+    else:
+        models = [m for m in SECTION_MODELS[section] if m]
+        max_out = SECTION_MAX_TOKENS[section]
+        system = section_system_prompt(section)
+    context = min(MODEL_CONTEXT_TOKENS.get(m, DEFAULT_CONTEXT_TOKENS) for m in models)
+    return {
+        "max_output_tokens": max_out,
+        "model_context": context,
+        "system_tokens": estimate_tokens(system),
+    }
+
+
+def _allocate(budget: int, demands: Dict[str, int]) -> Dict[str, int]:
+    """Water-filling: small demands are met in full, the rest share what is left equally."""
+    alloc: Dict[str, int] = {}
+    remaining = max(0, budget)
+    pending = sorted(demands.items(), key=lambda kv: kv[1])
+    while pending:
+        share = remaining // len(pending)
+        key, need = pending[0]
+        if need <= share:
+            alloc[key] = need
+            remaining -= need
+            pending.pop(0)
+            continue
+        for key, _ in pending:
+            alloc[key] = share
+        break
+    return alloc
+
+
+class PromptBudgeter:
+    """
+    Sits between example fetch and replace_vars: for each prompt template it
+    decides how many tokens each example placeholder may use, fits the examples
+    into that, and records what it did.
+    """
+    def __init__(self, examples: Dict[str, List[str]], query: str = ""):
+        # placeholder -> list of raw example texts
+        self.examples = {k: [t for t in (v or []) if t] for k, v in examples.items()}
+        self.terms = query_terms(query)
+        self.decisions: Dict[str, Any] = {}
+        # placeholder -> the one budgeted copy sent as a shared segment (set by fit_shared)
+        self.shared: Dict[str, str] = {}
+        self.shared_decisions: Dict[str, Any] = {}
+
+    def _plan(self, prompt_key: str, template: str, fixed: Dict[str, str]) -> Tuple[Dict[str, Any], List[str], int, int, int, Dict[str, int]]:
+        """(limits, placeholders present, fixed tokens, input budget, example budget, allocation)."""
+        section = PROMPT_SECTIONS[prompt_key]
+        limits = section_limits(section)
+        present = [p for p in EXAMPLE_PLACEHOLDERS if p in (template or "")]
+        shared = [p for p in present if p in self.shared and section != "compiler"]
+        present = [p for p in present if p not in shared]
+
+        base = replace_vars(template, {**fixed, **{p: "" for p in present}, **{p: SHARED_EXAMPLES_POINTER for p in shared}})
+        # The shared copy is still sent with this call, so it counts as fixed
+        fixed_tokens = estimate_tokens(base) + sum(estimate_tokens(self.shared[p]) for p in shared)
+
+        context_room = limits["model_context"] - limits["max_output_tokens"] - limits["system_tokens"] - CONTEXT_SAFETY_TOKENS
+        input_budget = min(context_room, int(PROMPT_BUDGET_MULTIPLIER * limits["max_output_tokens"]))
+        example_budget = max(input_budget - fixed_tokens, min(MIN_EXAMPLE_TOKENS, context_room - fixed_tokens), 0)
+
+        demands: Dict[str, int] = {}
+        for p in present:
+            occurrences = template.count(p)
+            demands[p] = estimate_tokens(format_examples(self.examples.get(p, []))) * occurrences
+        return limits, present, fixed_tokens, input_budget, example_budget, _allocate(example_budget, demands)
+
+    def fit_shared(self, templates: Dict[str, str], fixed: Dict[str, str]) -> str:
+        """
+        Fits SHARED_EXAMPLE_PLACEHOLDERS once for all section templates (prompt_key ->
+        template): each gets the smallest allocation any section that uses it would
+        give it. Later fit() calls replace the placeholder with a pointer and charge
+        the shared copy to the section. Returns the shared block ("" if unused).
+        """
+        blocks: List[str] = []
+        for p in SHARED_EXAMPLE_PLACEHOLDERS:
+            users = [(k, t) for k, t in templates.items() if p in (t or "") and PROMPT_SECTIONS[k] != "compiler"]
+            if not users or not self.examples.get(p):
+                continue
+            budget = min(
+                self._plan(k, t, fixed)[5].get(p, 0) // max(1, t.count(p))
+                for k, t in users
+            )
+            text, decision = fit_examples(self.examples[p], budget, self.terms)
+            if not text:
+                continue
+            self.shared[p] = text
+            self.shared_decisions[p.strip("{}")] = {**decision, "budget": budget, "prompts": [k for k, _ in users]}
+            blocks.append(text)
+        return "\n\n".join(blocks)
+
+    def fit(self, prompt_key: str, template: str, fixed: Dict[str, str]) -> Dict[str, str]:
+        """
+        Returns placeholder -> budgeted example text for one template.
+        `fixed` holds the non-example replacements (they count against the budget).
+        """
+        section = PROMPT_SECTIONS[prompt_key]
+        limits, present, fixed_tokens, input_budget, example_budget, alloc = self._plan(prompt_key, template, fixed)
+
+        out: Dict[str, str] = {
+            p: SHARED_EXAMPLES_POINTER for p in self.shared
+            if p in (template or "") and section != "compiler"
+        }
+        placeholders: Dict[str, Any] = {}
+        tokens_out = fixed_tokens
+        for p in present:
+            texts = self.examples.get(p, [])
+            occurrences = template.count(p)
+            text, decision = fit_examples(texts, alloc.get(p, 0) // max(1, occurrences), self.terms)
+            out[p] = text
+            placeholders[p.strip("{}")] = decision
+            tokens_out += decision["tokens_out"] * occurrences
+
+        self.decisions[prompt_key] = {
+            "section": section,
+            **limits,
+            "input_budget": input_budget,
+            "fixed_tokens": fixed_tokens,
+            "example_budget": example_budget,
+            "prompt_tokens": tokens_out,
+            "examples": placeholders,
+        }
+        if DEBUGGING_MODE and any(d["action"] != "kept" for d in placeholders.values()):
+            _log(f"{prompt_key} | budget={input_budget} | fixed={fixed_tokens} | " + ", ".join(
+                f"{k}:{d['action']} {d['tokens_in']}->{d['tokens_out']}" for k, d in placeholders.items()
+            ))
+        return out
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "multiplier": PROMPT_BUDGET_MULTIPLIER,
+            "prompts": self.decisions,
+            "shared": self.shared_decisions,
+        }
@@ -0,0 +1,222 @@
+# chatbots/repair.py
+from __future__ import annotations
+
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from chatbots.llm_usage import estimate_tokens
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# Rough size of the instruction block the old full-context repair prompts carried
+LEGACY_REPAIR_INSTRUCTION_TOKENS = 40
+
+Fixer = Tuple[str, Callable[[str], str]]
+
+_FENCE_RE = re.compile(r"```[A-Za-z0-9_+-]*[ \t]*\n?([\s\S]*?)```")
+_OPEN_FENCE_RE = re.compile(r"^```[A-Za-z0-9_+-]*[ \t]*\n?|\n?```\s*$")
+_META_PREFIX_RE = re.compile(r"^\s*(assistant|ai|response|output|answer)\s*:\s*", re.I)
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$", re.M)
+_QUESTION_LINE_RE = re.compile(
+    r"^\s*(?:\d+[.)]\s*|[-*]\s+)?(?:\*\*|__)?(?:Q(?:uestion)?\s*\d*\s*[:.]\s*)?(.+?\?)\s*(?:\*\*|__)?\s*$",
+    re.M,
+)
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[Repair] {msg}")
+
+
+# ============================================================
+# DETERMINISTIC FIXERS (text -> text, no LLM)
+# ============================================================
+def unwrap_json(t: str) -> str:
+    """A JSON answer ({"content": "..."} or ["...", ...]) -> its longest string / joined strings."""
+    s = (t or "").strip()
+    if not s.startswith(("{", "[")):
+        return t
+    try:
+        data = json.loads(s)
+    except ValueError:
+        return t
+    strings: List[str] = []
+
+    def _walk(v: Any) -> None:
+        if isinstance(v, str):
+            strings.append(v)
+        elif isinstance(v, dict):
+            for x in v.values():
+                _walk(x)
+        elif isinstance(v, list):
+            for x in v:
+                _walk(x)
+
+    _walk(data)
+    if not strings:
+        return t
+    if isinstance(data, list) and all(isinstance(x, str) for x in data):
+        return "\n\n".join(x.strip() for x in data)
+    return max(strings, key=len).strip()
+
+
+def unwrap_fences(t: str) -> str:
+    """Keeps the content of ``` blocks (the cleaners would drop it), and an unclosed fence's body."""
+    s = _FENCE_RE.sub(lambda m: m.group(1).strip(), t or "")
+    return _OPEN_FENCE_RE.sub("", s.strip()).strip()
+
+
+def strip_label_lines(t: str, markers: Sequence[str]) -> str:
+    """Drops draft/scaffolding labels ("FAQ DRAFT:") and keeps any text after them."""
+    out = t or ""
+    for m in markers:
+        out = re.sub(rf"^[ \t]*{re.escape(m)}[ \t]*", "", out, flags=re.M)
+    return re.sub(r"\n{3,}", "\n\n", out).strip()
+
+
+def promote_title(t: str) -> str:
+    """No '# ' title: the first heading of any level becomes it."""
+    s = t or ""
+    m = _HEADING_RE.search(s)
+    if not m or m.group(1) == "#":
+        return s
+    return s[:m.start()] + f"# {m.group(2)}" + s[m.end():]
+
+
+def ensure_heading(t: str, heading: str) -> str:
+    s = (t or "").strip()
+    if not s or s.startswith("#"):
+        return s
+    return f"{heading}\n{s}"
+
+
+def question_headings(t: str) -> str:
+    """'**Q: Why ...?**' / '1. Why ...?' lines -> '### Why ...?'."""
+    return _QUESTION_LINE_RE.sub(lambda m: f"### {m.group(1).strip().lstrip('#').strip()}", t or "")
+
+
+def apply_fixers(text: str, fixers: Sequence[Fixer], issues_of: Callable[[str], List[str]]) -> Tuple[str, List[str]]:
+    """Runs fixers in order until the text has no issues; returns (text, names of fixers that changed it)."""
+    applied: List[str] = []
+    for name, fn in fixers:
+        if not issues_of(text):
+            break
+        new = fn(text)
+        if new != text:
+            applied.append(name)
+            text = new
+    return text, applied
+
+
+# ============================================================
+# COMMON CHECKS + COMPACT INSTRUCTION
+# ============================================================
+def common_issues(t: str) -> List[str]:
+    """Rule violations shared by every agent, phrased as edits."""
+    s = (t or "").strip()
+    if not s:
+        return ["The draft is empty."]
+    issues: List[str] = []
+    if "```" in s:
+        issues.append("Remove the code fences (```); keep the Markdown inside them.")
+    if s.startswith(("{", "[")):
+        issues.append("Convert the JSON into plain Markdown prose.")
+    if _META_PREFIX_RE.match(s):
+        issues.append("Remove the leading speaker/meta label (e.g. 'Assistant:').")
+    return issues
+
+
+def repair_instruction(issues: Sequence[str]) -> str:
+    lines = "\n".join(f"- {i}" for i in issues)
+    return (
+        "The DRAFT above breaks the output rules. Apply ONLY these edits:\n"
+        f"{lines}\n"
+        "Keep every other line unchanged. Return the full corrected text in Markdown, nothing else."
+    )
+
+
+def legacy_repair_tokens(system_text: str, original_input: str, bad_output: str) -> int:
+    """Prompt tokens the old repair pass sent: system + full original input + bad output + instructions."""
+    return (
+        estimate_tokens(system_text) + estimate_tokens(original_input)
+        + estimate_tokens(bad_output) + LEGACY_REPAIR_INSTRUCTION_TOKENS
+    )
+
+
+# ============================================================
+# STATS
+# ============================================================
+class RepairStats:
+    """
+    Per agent: outputs checked, how many broke the rules, and how each was handled:
+      local       - fixed deterministically, no LLM call
+      compact     - LLM repair with only the draft + an edit list
+      regenerated - empty draft, the original messages were re-sent
+    tokens_saved compares against the old full-context repair prompt
+    (and also counts the repair completion for local fixes).
+    """
+    _OUTCOMES = ("local", "compact", "regenerated")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._agents: Dict[str, Dict[str, int]] = {}
+
+    def _row(self, agent: str) -> Dict[str, int]:
+        row = self._agents.get(agent)
+        if row is None:
+            row = {"checked": 0, "invalid": 0, "repaired": 0, "tokens_saved": 0}
+            row.update({o: 0 for o in self._OUTCOMES})
+            self._agents[agent] = row
+        return row
+
+    def checked(self, agent: str, invalid: bool) -> None:
+        with self._lock:
+            row = self._row(agent)
+            row["checked"] += 1
+            row["invalid"] += 1 if invalid else 0
+
+    def repaired(self, agent: str, outcome: str, ok: bool, tokens_saved: int = 0) -> None:
+        with self._lock:
+            row = self._row(agent)
+            row[outcome] += 1
+            row["repaired"] += 1 if ok else 0
+            row["tokens_saved"] += max(0, int(tokens_saved))
+        _log(f"{agent} | {outcome} | ok={ok} | saved~{tokens_saved} tokens")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            agents = {a: dict(r) for a, r in self._agents.items()}
+        for r in agents.values():
+            r["repair_rate"] = round(r["invalid"] / r["checked"], 3) if r["checked"] else 0.0
+            r["local_fix_rate"] = round(r["local"] / r["invalid"], 3) if r["invalid"] else 0.0
+        checked = sum(r["checked"] for r in agents.values())
+        invalid = sum(r["invalid"] for r in agents.values())
+        local = sum(r["local"] for r in agents.values())
+        return {
+            "checked": checked,
+            "invalid": invalid,
+            "repair_rate": round(invalid / checked, 3) if checked else 0.0,
+            "local_fix_rate": round(local / invalid, 3) if invalid else 0.0,
+            "tokens_saved": sum(r["tokens_saved"] for r in agents.values()),
+            "agents": agents,
+        }
+
+
+_stats = RepairStats()
+
+
+def record_checked(agent: str, invalid: bool) -> None:
+    _stats.checked(agent, invalid)
+
+
+def record_repair(agent: str, outcome: str, ok: bool, tokens_saved: int = 0) -> None:
+    _stats.repaired(agent, outcome, ok, tokens_saved)
+
+
+def repair_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
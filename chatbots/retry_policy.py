@@ -0,0 +1,282 @@
+# chatbots/retry_policy.py
+from __future__ import annotations
+
+import contextvars
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+from chatbots.cancellation import cancellable_sleep, check_cancelled
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# Default wall-clock budget for one pipeline request's retry backoffs: no backoff
+# starts that would end after it (calls already running are not cut short)
+REQUEST_RETRY_BUDGET_S = float(os.getenv("REQUEST_RETRY_BUDGET_S", "90"))
+
+# error class -> retried?
+ERROR_CLASSES: Dict[str, bool] = {
+    "rate_limit": True,     # 429
+    "overloaded": True,     # 503 / 529
+    "server": True,         # other 5xx
+    "timeout": True,        # transport timeout / 408
+    "connection": True,     # reset, refused, DNS, remote closed
+    "auth": False,          # 401 / 403
+    "bad_request": False,   # other 4xx (validation, context length, unknown model)
+    "unknown": True,        # no type/status information: at most UNKNOWN_MAX_ATTEMPTS
+}
+UNKNOWN_MAX_ATTEMPTS = 2
+
+_TIMEOUT_TYPES = {"Timeout", "ReadTimeout", "ConnectTimeout", "TimeoutError", "TimeoutException", "APITimeoutError"}
+_CONNECTION_TYPES = {
+    "ConnectionError", "ConnectError", "RemoteDisconnected", "ProtocolError", "ChunkedEncodingError",
+    "APIConnectionError", "ServerDisconnectedError", "ClientConnectionError",
+}
+# Status embedded in a message, e.g. the Together wrapper's "Together Server: Error 503"
+_STATUS_IN_MESSAGE_RE = re.compile(r"\b(?:error|status(?:\s+code)?)\s*:?\s*([1-5]\d\d)\b", re.I)
+# Last resort for wrappers that only keep the body text (Together raises ValueError for every 4xx)
+_MESSAGE_HINTS: Tuple[Tuple[str, str], ...] = (
+    ("rate limit", "rate_limit"),
+    ("rate_limit", "rate_limit"),
+    ("too many requests", "rate_limit"),
+    ("overloaded", "overloaded"),
+    ("timed out", "timeout"),
+    ("invalid payload", "bad_request"),
+)
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[RetryPolicy] {msg}")
+
+
+class RetryPolicy(NamedTuple):
+    name: str
+    max_attempts: int = 4
+    base_s: float = 0.5       # first backoff floor
+    cap_s: float = 8.0        # largest single backoff
+    budget_s: float = 30.0    # wall-clock budget for one call including its retries
+
+
+class ErrorInfo(NamedTuple):
+    error_class: str
+    retryable: bool
+    status: Optional[int]
+    retry_after_s: Optional[float]
+
+
+class RetryError(RuntimeError):
+    """The call failed for good; `reason` is permanent | exhausted | budget."""
+    def __init__(self, last: Exception, info: ErrorInfo, attempts: int, reason: str):
+        super().__init__(f"{info.error_class} ({reason}) after {attempts} attempts: {last}")
+        self.last = last
+        self.info = info
+        self.attempts = attempts
+        self.reason = reason
+
+
+# ============================================================
+# CLASSIFICATION
+# ============================================================
+def _status_class(status: int) -> str:
+    if status == 429:
+        return "rate_limit"
+    if status in (503, 529):
+        return "overloaded"
+    if status == 408:
+        return "timeout"
+    if status in (401, 403):
+        return "auth"
+    if status >= 500:
+        return "server"
+    return "bad_request"
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    if headers is None:
+        return None
+    try:
+        ms = headers.get("retry-after-ms") or headers.get("Retry-After-Ms")
+        if ms:
+            return max(0.0, float(ms) / 1000.0)
+        raw = headers.get("retry-after") or headers.get("Retry-After")
+    except Exception:
+        return None
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(str(raw))
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(e: BaseException) -> ErrorInfo:
+    """Exception type first, then HTTP status (attribute or response), then the message."""
+    names = {cls.__name__ for cls in type(e).__mro__}
+    response = getattr(e, "response", None)
+    status = None
+    for src in (e, response):
+        for attr in ("status_code", "status"):
+            value = getattr(src, attr, None)
+            if isinstance(value, int) and 100 <= value <= 599:
+                status = value
+                break
+        if status is not None:
+            break
+    retry_after = _retry_after(getattr(response, "headers", None) or getattr(e, "headers", None))
+
+    if status is not None:
+        cls = _status_class(status)
+    elif names & _TIMEOUT_TYPES:
+        cls = "timeout"
+    elif names & _CONNECTION_TYPES:
+        cls = "connection"
+    else:
+        msg = str(e)
+        m = _STATUS_IN_MESSAGE_RE.search(msg)
+        if m:
+            status = int(m.group(1))
+            cls = _status_class(status)
+        else:
+            low = msg.lower()
+            cls = next((c for hint, c in _MESSAGE_HINTS if hint in low), "unknown")
+    return ErrorInfo(cls, ERROR_CLASSES[cls], status, retry_after)
+
+
+# ============================================================
+# METRICS
+# ============================================================
+class RetryStats:
+    """
+    Per error class: errors seen and what happened next
+    (retried / permanent / exhausted / budget), Retry-After waits and backoff time.
+    Per policy: calls, first-try successes and successes after a retry.
+    """
+    _OUTCOMES = ("retried", "permanent", "exhausted", "budget")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classes: Dict[str, Dict[str, float]] = {}
+        self._policies: Dict[str, Dict[str, int]] = {}
+
+    def error(self, info: ErrorInfo, outcome: str, backoff_s: float = 0.0) -> None:
+        with self._lock:
+            row = self._classes.get(info.error_class)
+            if row is None:
+                row = {"errors": 0, "retry_after": 0, "backoff_ms": 0.0, **{o: 0 for o in self._OUTCOMES}}
+                self._classes[info.error_class] = row
+            row["errors"] += 1
+            row[outcome] += 1
+            row["retry_after"] += 1 if info.retry_after_s is not None and outcome == "retried" else 0
+            row["backoff_ms"] += backoff_s * 1000
+
+    def call(self, policy: str, attempts: int, ok: bool) -> None:
+        with self._lock:
+            row = self._policies.setdefault(policy, {"calls": 0, "ok_first_try": 0, "ok_after_retry": 0, "failed": 0})
+            row["calls"] += 1
+            if not ok:
+                row["failed"] += 1
+            elif attempts == 1:
+                row["ok_first_try"] += 1
+            else:
+                row["ok_after_retry"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {c: {**r, "backoff_ms": round(r["backoff_ms"], 1)} for c, r in self._classes.items()}
+            policies = {p: dict(r) for p, r in self._policies.items()}
+        return {"error_classes": classes, "policies": policies, "retryable": ERROR_CLASSES}
+
+
+_stats = RetryStats()
+
+
+def retry_stats() -> Dict[str, Any]:
+    return _stats.snapshot()
+
+
+# ============================================================
+# REQUEST BUDGET
+# ============================================================
+# Monotonic deadline shared by every call of one request (agent threads inherit it)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("retry_deadline", default=None)
+
+
+@contextmanager
+def retry_budget(seconds: float = REQUEST_RETRY_BUDGET_S) -> Iterator[float]:
+    """Caps retry backoffs for everything run inside (an enclosing, tighter budget wins)."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    reset = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(reset)
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+T = TypeVar("T")
+
+
+def run_with_retries(fn: Callable[[], T], policy: RetryPolicy, label: str = "") -> Tuple[T, int]:
+    """
+    Calls fn until it succeeds. Returns (result, attempts) or raises RetryError.
+    Permanent errors (auth, bad request) fail at once. Backoff is decorrelated
+    jitter (sleep = uniform(base, 3 * previous sleep), capped), raised to the
+    server's Retry-After when one is given. A retry whose wait would overrun the
+    call or request budget is not attempted.
+    """
+    deadline = time.monotonic() + policy.budget_s
+    request_deadline = _deadline.get()
+    if request_deadline is not None:
+        deadline = min(deadline, request_deadline)
+    sleep_s = policy.base_s
+    attempt = 0
+    while True:
+        attempt += 1
+        check_cancelled()
+        try:
+            result = fn()
+            _stats.call(policy.name, attempt, True)
+            return result, attempt
+        except Exception as e:
+            info = classify(e)
+            limit = UNKNOWN_MAX_ATTEMPTS if info.error_class == "unknown" else policy.max_attempts
+            sleep_s = min(policy.cap_s, random.uniform(policy.base_s, sleep_s * 3))
+            wait = max(sleep_s, info.retry_after_s or 0.0)
+            if not info.retryable:
+                outcome = "permanent"
+            elif attempt >= limit:
+                outcome = "exhausted"
+            elif time.monotonic() + wait > deadline:
+                outcome = "budget"
+            else:
+                outcome = "retried"
+            _stats.error(info, outcome, wait if outcome == "retried" else 0.0)
+            _log(
+                f"{label or policy.name} | attempt={attempt}/{limit} | {info.error_class}"
+                f"{f' {info.status}' if info.status else ''} -> {outcome}"
+                f"{f' in {wait:.2f}s' if outcome == 'retried' else ''} | err={e}"
+            )
+            if outcome != "retried":
+                _stats.call(policy.name, attempt, False)
+                raise RetryError(e, info, attempt, outcome) from e
+            cancellable_sleep(wait)
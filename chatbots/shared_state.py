@@ -0,0 +1,176 @@
+# chatbots/shared_state.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEBUGGING_MODE = True
+
+# Namespaces used across the app (one place, so backends can be inspected by ns)
+NS_ROUTER = "router"            # A/B model toggle counters per section
+NS_TENANT_TOKENS = "tenant_tokens"  # per-tenant token-rate buckets
+NS_JOBS = "jobs"                # request_id -> {"node", "started"} while a pipeline runs
+NS_CANCEL = "cancel"            # request_id -> reason, set by any node's cancel endpoint
+
+# In-process backend: expired keys are swept once the dict grows past this
+MEMORY_SWEEP_KEYS = 10000
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[SharedState] {msg}")
+
+
+# ============================================================
+# INTERFACE
+# ============================================================
+class SharedState(ABC):
+    """
+    Small key/value + counter + token-bucket store that every node of the app
+    can share. Values must be JSON-serialisable. Methods never raise: a backend
+    that loses its store degrades to per-process state and says so in stats().
+    A backend missing any abstract method fails when instantiated.
+    """
+    name = "base"
+
+    @abstractmethod
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_many(self, ns: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """Only the keys that exist (and haven't expired) are returned."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, ns: str, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, ns: str, key: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def incr(self, ns: str, key: str, amount: int = 1, ttl_s: Optional[float] = None) -> int:
+        """Atomically adds `amount` and returns the new value (a missing/expired key starts at 0)."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_tokens(self, ns: str, key: str, amount: float, capacity: float, refill_per_s: float) -> float:
+        """
+        Token bucket: refills at refill_per_s up to capacity, then subtracts `amount`
+        (always; the balance may go negative). Returns the balance after the debit.
+        amount=0 just reads the refilled balance.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+# ============================================================
+# IN-PROCESS BACKEND (default)
+# ============================================================
+class MemoryState(SharedState):
+    """Per-process dicts; the right choice for a single node."""
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kv: Dict[Tuple[str, str], Tuple[Optional[float], Any]] = {}
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        self._ops = 0
+        if hasattr(os, "register_at_fork"):
+            # A lock held by another thread at fork time would never be released in the child
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self) -> None:
+        self._lock = threading.Lock()
+
+    def _live(self, k: Tuple[str, str], now: float) -> Optional[Tuple[Optional[float], Any]]:
+        # caller holds self._lock
+        entry = self._kv.get(k)
+        if entry is not None and entry[0] is not None and entry[0] <= now:
+            del self._kv[k]
+            return None
+        return entry
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        with self._lock:
+            self._ops += 1
+            entry = self._live((ns, key), time.time())
+            return entry[1] if entry is not None else None
+
+    def get_many(self, ns: str, keys: Iterable[str]) -> Dict[str, Any]:
+        now = time.time()
+        out: Dict[str, Any] = {}
+        with self._lock:
+            self._ops += 1
+            for key in keys:
+                entry = self._live((ns, key), now)
+                if entry is not None:
+                    out[key] = entry[1]
+        return out
+
+    def _sweep_locked(self, now: float) -> None:
+        if len(self._kv) > MEMORY_SWEEP_KEYS:
+            for k in [k for k, (exp, _) in self._kv.items() if exp is not None and exp <= now]:
+                del self._kv[k]
+
+    def set(self, ns: str, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            self._ops += 1
+            self._sweep_locked(now)
+            self._kv[(ns, key)] = (now + ttl_s if ttl_s else None, value)
+
+    def delete(self, ns: str, key: str) -> None:
+        with self._lock:
+            self._ops += 1
+            self._kv.pop((ns, key), None)
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl_s: Optional[float] = None) -> int:
+        now = time.time()
+        with self._lock:
+            self._ops += 1
+            entry = self._live((ns, key), now)
+            value = int(entry[1] if entry is not None else 0) + amount
+            self._kv[(ns, key)] = (now + ttl_s if ttl_s else None, value)
+            return value
+
+    def take_tokens(self, ns: str, key: str, amount: float, capacity: float, refill_per_s: float) -> float:
+        now = time.time()
+        with self._lock:
+            self._ops += 1
+            tokens, ts = self._buckets.get((ns, key), (capacity, now))
+            tokens = min(capacity, tokens + (now - ts) * refill_per_s) - amount
+            self._buckets[(ns, key)] = (tokens, now)
+            return tokens
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, "keys": len(self._kv), "buckets": len(self._buckets), "ops": self._ops}
+
+
+# ============================================================
+# PLUG-IN POINT
+# ============================================================
+# app.py swaps in the Postgres backend (SHARED_STATE_BACKEND=postgres);
+# agents and the scheduler only ever call get_shared_state().
+_state: SharedState = MemoryState()
+
+
+def set_shared_state(state: SharedState) -> None:
+    global _state
+    _state = state
+    _log(f"backend -> {state.name}")
+
+
+def get_shared_state() -> SharedState:
+    return _state
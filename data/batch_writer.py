@@ -0,0 +1,213 @@
+'''
+batch_writer.py
+Background, batched writer used to keep DB inserts off the request path.
+Items are buffered in memory and flushed on a size or time trigger by a
+single daemon thread.
+'''
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_FLUSH_INTERVAL_S = 2.0
+DEFAULT_MAX_QUEUE = 10000
+# A failed batch is retried this many times (backoff doubles from flush_interval_s) before it is dropped
+DEFAULT_MAX_RETRIES = int(os.getenv("BATCH_WRITER_MAX_RETRIES", "5"))
+RETRY_BACKOFF_MAX_S = 60.0
+
+_registry: List["BatchWriter"] = []
+
+
+class BatchWriter:
+    """
+    Buffers items and hands them to `flush_fn` in batches.
+
+    Guarantees:
+      - submit() never blocks the caller (items are dropped + counted when the queue is full)
+      - flush_fn runs on one background thread, never concurrently with itself
+      - a batch whose flush raises is retried with backoff (up to max_retries),
+        then dropped + counted; flush_fn must be all-or-nothing per batch
+      - a final flush happens at interpreter exit
+    """
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[List[Any]], None],
+        max_batch: int = DEFAULT_MAX_BATCH,
+        flush_interval_s: float = DEFAULT_FLUSH_INTERVAL_S,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_batch = max(1, int(max_batch))
+        self.flush_interval_s = max(0.05, float(flush_interval_s))
+        self.max_retries = max(0, int(max_retries))
+
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._flush_now = threading.Event()
+        # (due_at, attempts so far, batch) for batches whose flush failed
+        self._retries: List[Tuple[float, int, List[Any]]] = []
+
+        self._submitted = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed_batches = 0
+        self._retried = 0
+        self._lost = 0
+        self._last_flush_ms = 0.0
+
+        _registry.append(self)
+        atexit.register(self.close)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        # The writer thread does not survive fork() and locks may be copied mid-hold;
+        # items queued in the parent stay the parent's to write.
+        self._q = queue.Queue(maxsize=self._q.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._flush_now = threading.Event()
+        self._retries = []
+
+    def _log(self, msg: str) -> None:
+        if DEBUGGING_MODE:
+            print(f"[BatchWriter:{self.name}] {msg}")
+
+    def _ensure_started(self) -> None:
+        # Started lazily so pre-fork servers don't inherit a running thread.
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"batch-writer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def submit(self, item: Any) -> bool:
+        self._ensure_started()
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._submitted += 1
+        if self._q.qsize() >= self.max_batch:
+            self._flush_now.set()
+        return True
+
+    def _drain(self) -> List[Any]:
+        batch: List[Any] = []
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Any], attempt: int = 0) -> None:
+        if not batch:
+            return
+        t0 = time.time()
+        try:
+            self.flush_fn(batch)
+            with self._lock:
+                self._written += len(batch)
+        except Exception as e:
+            self._failed(batch, attempt, e)
+        finally:
+            self._last_flush_ms = (time.time() - t0) * 1000
+
+    def _failed(self, batch: List[Any], attempt: int, err: Exception) -> None:
+        with self._lock:
+            pending = sum(len(b) for _, _, b in self._retries)
+            # Retries share the queue's memory bound
+            if attempt < self.max_retries and pending + len(batch) <= self._q.maxsize:
+                delay = min(RETRY_BACKOFF_MAX_S, self.flush_interval_s * (2 ** attempt))
+                self._retries.append((time.time() + delay, attempt + 1, batch))
+                self._retried += 1
+                self._log(f"flush failed | items={len(batch)} | retry {attempt + 1}/{self.max_retries} in {delay:.1f}s | err={err}")
+                return
+            self._failed_batches += 1
+            self._lost += len(batch)
+        self._log(f"flush failed, batch dropped | items={len(batch)} | attempts={attempt + 1} | err={err}")
+
+    def _retry_due(self, force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            due = [r for r in self._retries if force or r[0] <= now]
+            self._retries = [r for r in self._retries if not (force or r[0] <= now)]
+        for _, attempt, batch in due:
+            self._write(batch, attempt)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._flush_now.wait(self.flush_interval_s)
+            self._flush_now.clear()
+            self._retry_due()
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                self._write(batch)
+                if len(batch) < self.max_batch:
+                    break
+
+    def flush(self) -> None:
+        """Synchronously write everything currently buffered (caller's thread), pending retries included."""
+        self._retry_due(force=True)
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        self._stop.set()
+        self._flush_now.set()
+        t = self._thread
+        if t is not None and t.is_alive() and t is not threading.current_thread():
+            t.join(timeout=timeout_s)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "queued": self._q.qsize(),
+                "submitted": self._submitted,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed_batches": self._failed_batches,
+                "retried_batches": self._retried,
+                "retry_pending": sum(len(b) for _, _, b in self._retries),
+                "lost": self._lost,
+                "last_flush_ms": round(self._last_flush_ms, 1),
+            }
+
+
+def close_all_writers(timeout_s: float = 5.0) -> None:
+    """Flush + stop every writer (graceful worker shutdown)."""
+    for w in list(_registry):
+        try:
+            w.close(timeout_s=timeout_s)
+        except Exception:
+            pass
@@ -7,13 +7,14 @@ from __future__ import annotations
 
 import os
 import atexit
+import threading
 import time
 from contextlib import contextmanager
 from typing import Any, Dict, List, Optional, Tuple
 
 import psycopg2
 import psycopg2.extras
-from psycopg2.pool import SimpleConnectionPool, PoolError
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime, date
 from flask import jsonify
 
@@ -33,17 +34,20 @@ KEEPALIVES_COUNT = int(os.getenv("DB_KEEPALIVES_COUNT", "5"))
 
 # Singleton instance holder
 _db: Optional["DB"] = None
+_db_lock = threading.Lock()
 
 
 class DB:
     """
-    Centralised DB manager for psycopg2 + SimpleConnectionPool.
+    Centralised DB manager for psycopg2 + ThreadedConnectionPool.
 
     Guarantees:
       - No connection leaks (always returns to pool)
       - Clean connection state (rollback) before reuse
       - Validates connection before handing it out
       - Uses TCP keepalives to reduce unexpected disconnects
+      - Safe to share between request threads (threaded workers)
+      - Never touches sockets inherited across fork()
     """
     def __init__(self, dsn: str, minconn: int = POOL_MIN, maxconn: int = POOL_MAX, sslmode: str = "require"):
         if not dsn:
@@ -51,9 +55,15 @@ class DB:
 
         self.dsn = dsn
         self.sslmode = sslmode
-
-        # SimpleConnectionPool forwards kwargs to psycopg2.connect
-        self.pool = SimpleConnectionPool(
+        self.maxconn = maxconn
+        self._pid = os.getpid()
+        # Pool usage for the ops dashboard (plain ints; an occasional lost update is fine)
+        self.borrowed = 0
+        self.exhausted = 0
+        self.reconnects = 0
+
+        # ThreadedConnectionPool forwards kwargs to psycopg2.connect
+        self.pool = ThreadedConnectionPool(
             minconn=minconn,
             maxconn=maxconn,
             dsn=dsn,
@@ -66,6 +76,9 @@ class DB:
         atexit.register(self.close_all)
 
     def close_all(self) -> None:
+        # A forked child must not close the parent's sockets (it would terminate its sessions)
+        if os.getpid() != self._pid:
+            return
         try:
             self.pool.closeall()
         except Exception:
@@ -91,10 +104,16 @@ class DB:
         """
         c = None
         try:
-            c = self.pool.getconn()
+            try:
+                c = self.pool.getconn()
+            except PoolError:
+                self.exhausted += 1
+                raise
+            self.borrowed += 1
 
             # Validate
             if not self._is_conn_healthy(c):
+                self.reconnects += 1
                 try:
                     # Drop broken conn from pool, create a new one manually
                     try:
@@ -127,6 +146,20 @@ class DB:
                 except Exception:
                     pass
 
+    def pool_stats(self) -> Dict[str, Any]:
+        # ThreadedConnectionPool keeps borrowed connections in _used and idle ones in _pool
+        in_use = len(getattr(self.pool, "_used", {}) or {})
+        idle = len(getattr(self.pool, "_pool", []) or [])
+        return {
+            "in_use": in_use,
+            "idle": idle,
+            "max": self.maxconn,
+            "utilization": round(in_use / self.maxconn, 3) if self.maxconn else 0.0,
+            "borrowed": self.borrowed,
+            "exhausted": self.exhausted,
+            "reconnects": self.reconnects,
+        }
+
     def fetchall(self, query: str, params: Optional[tuple] = None) -> List[Dict[str, Any]]:
         with self.conn() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
@@ -148,12 +181,13 @@ class DB:
 
 def init_db() -> DB:
     global _db
-    if _db is not None:
-        return _db
+    with _db_lock:
+        if _db is not None:
+            return _db
 
-    dsn = os.getenv("DATABASE_URL")
-    _db = DB(dsn=dsn, minconn=POOL_MIN, maxconn=POOL_MAX, sslmode=os.getenv("DB_SSLMODE", "require"))
-    return _db
+        dsn = os.getenv("DATABASE_URL")
+        _db = DB(dsn=dsn, minconn=POOL_MIN, maxconn=POOL_MAX, sslmode=os.getenv("DB_SSLMODE", "require"))
+        return _db
 
 
 def get_db() -> DB:
@@ -162,6 +196,22 @@ def get_db() -> DB:
     return _db
 
 
+def db_pool_stats() -> Optional[Dict[str, Any]]:
+    """None until this worker has built its pool (never creates one)."""
+    return _db.pool_stats() if _db is not None else None
+
+
+def _reset_db_after_fork() -> None:
+    # Pre-fork servers: each worker builds its own pool on first use.
+    global _db, _db_lock
+    _db = None
+    _db_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_db_after_fork)
+
+
 # -----------------------------
 # HELPERS
 # -----------------------------
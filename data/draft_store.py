@@ -0,0 +1,260 @@
+'''
+draft_store.py
+Pipeline runs (filled prompts, section drafts and the compiled blog) keyed by a
+run ID, so a revision can regenerate only the sections an editor rejected.
+Runs live in an in-memory TTL cache and are written through to pipeline_runs
+before the response, so any worker can serve the next revision. pipeline_runs
+is the source of truth: a cached run is only used while no newer revision is
+stored there. If the DB write fails, a BatchWriter retries it in the background.
+'''
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2.extras
+
+from data.batch_writer import BatchWriter
+from data.database_postgres import get_db
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+DRAFT_CACHE_TTL_S = float(os.getenv("DRAFT_CACHE_TTL_S", "3600"))
+DRAFT_CACHE_MAX_RUNS = int(os.getenv("DRAFT_CACHE_MAX_RUNS", "256"))
+# Rows older than this are purged from pipeline_runs on flush
+DRAFT_DB_RETENTION_DAYS = int(os.getenv("DRAFT_DB_RETENTION_DAYS", "14"))
+DRAFT_FLUSH_INTERVAL_S = 1.0
+# How often a worker deletes rows past the retention (on a daemon thread, triggered by save)
+DRAFT_PURGE_INTERVAL_S = float(os.getenv("DRAFT_PURGE_INTERVAL_S", "3600"))
+
+RUN_FIELDS = ("variables", "prompts", "drafts", "final", "temperature", "compiler_mode", "revision")
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[DraftStore] {msg}")
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+# -----------------------------
+# POSTGRES WRITE-THROUGH
+# -----------------------------
+# A revision only replaces an older one; an equal revision was computed from
+# the same base by another request and must not overwrite it
+_UPSERT_SQL = """
+    INSERT INTO pipeline_runs
+        (run_id, variables, prompts, drafts, final, temperature, compiler_mode, revision)
+    VALUES %s
+    ON CONFLICT (run_id) DO UPDATE SET
+        drafts = EXCLUDED.drafts,
+        final = EXCLUDED.final,
+        temperature = EXCLUDED.temperature,
+        compiler_mode = EXCLUDED.compiler_mode,
+        revision = EXCLUDED.revision,
+        updated_at = NOW()
+    WHERE pipeline_runs.revision < EXCLUDED.revision
+"""
+
+
+def _row(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        r["run_id"],
+        psycopg2.extras.Json(r["variables"]),
+        psycopg2.extras.Json(r["prompts"]),
+        psycopg2.extras.Json(r["drafts"]),
+        r["final"],
+        r["temperature"],
+        r["compiler_mode"],
+        r["revision"],
+    )
+
+
+def _write_run(run: Dict[str, Any]) -> bool:
+    """Upserts one run now; False when pipeline_runs already holds this revision or a newer one."""
+    with get_db().conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, _UPSERT_SQL, [_row(run)])
+            written = cur.rowcount > 0
+        conn.commit()
+    return written
+
+
+def _flush_runs(items: List[Dict[str, Any]]) -> None:
+    # Retries of failed synchronous writes; last write per run wins inside one batch
+    latest: Dict[str, Dict[str, Any]] = {}
+    for run in items:
+        latest[run["run_id"]] = run
+    rows = [_row(r) for r in latest.values()]
+    with get_db().conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(cur, _UPSERT_SQL, rows)
+        conn.commit()
+
+
+def _purge_expired() -> int:
+    with get_db().conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM pipeline_runs WHERE updated_at < NOW() - make_interval(days => %s);",
+                (DRAFT_DB_RETENTION_DAYS,),
+            )
+            deleted = cur.rowcount
+        conn.commit()
+    return deleted
+
+
+_writer = BatchWriter("drafts", _flush_runs, flush_interval_s=DRAFT_FLUSH_INTERVAL_S)
+
+
+# -----------------------------
+# STORE
+# -----------------------------
+class DraftStore:
+    """
+    run_id -> run dict (RUN_FIELDS). A cached run is used only after checking
+    that pipeline_runs holds no newer revision (another worker may have revised
+    it). Misses and stale entries are loaded from pipeline_runs and re-populate memory.
+    """
+    def __init__(self, ttl_s: float = DRAFT_CACHE_TTL_S, max_runs: int = DRAFT_CACHE_MAX_RUNS):
+        self.ttl_s = ttl_s
+        self.max_runs = max_runs
+        self._lock = threading.Lock()
+        self._runs: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._hits = 0
+        self._db_hits = 0
+        self._stale = 0
+        self._misses = 0
+        self._purged_at = 0.0
+        self._purged = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def _maybe_purge(self) -> None:
+        """Deletes rows older than DRAFT_DB_RETENTION_DAYS at most every DRAFT_PURGE_INTERVAL_S, off the caller's thread."""
+        now = time.time()
+        with self._lock:
+            if now - self._purged_at < DRAFT_PURGE_INTERVAL_S:
+                return
+            self._purged_at = now
+        threading.Thread(target=self._purge, name="draft-purge", daemon=True).start()
+
+    def _purge(self) -> None:
+        try:
+            deleted = _purge_expired()
+        except Exception as e:
+            _log(f"purge failed: {e}")
+            with self._lock:
+                # Try again on a later save
+                self._purged_at = 0.0
+            return
+        with self._lock:
+            self._purged += deleted
+        if deleted:
+            _log(f"purged {deleted} runs older than {DRAFT_DB_RETENTION_DAYS} days")
+
+    def _remember(self, run: Dict[str, Any]) -> None:
+        with self._lock:
+            self._runs[run["run_id"]] = (time.time() + self.ttl_s, run)
+            self._runs.move_to_end(run["run_id"])
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+
+    def _forget(self, run_id: str) -> None:
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def save(self, run: Dict[str, Any]) -> bool:
+        """
+        Writes the run to pipeline_runs before returning. Returns False (and keeps
+        nothing in memory) when that revision already exists, i.e. another request
+        revised the same base concurrently. Never raises: if the DB write fails,
+        the run is cached and queued for the background writer.
+        """
+        run = {"run_id": run["run_id"], **{k: run.get(k) for k in RUN_FIELDS}}
+        run["revision"] = int(run.get("revision") or 0)
+        try:
+            if not _write_run(run):
+                self._forget(run["run_id"])
+                _log(f"{run['run_id']} revision {run['revision']} already stored; not overwritten")
+                return False
+        except Exception as e:
+            _log(f"write failed for {run['run_id']}, queued: {e}")
+            try:
+                _writer.submit(run)
+            except Exception as e:
+                _log(f"queue failed for {run['run_id']}: {e}")
+        self._remember(run)
+        self._maybe_purge()
+        return True
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._runs.get(run_id)
+            if entry is not None and entry[0] <= now:
+                del self._runs[run_id]
+                entry = None
+
+        if entry is not None:
+            try:
+                row = get_db().fetchone("SELECT revision FROM pipeline_runs WHERE run_id = %s;", (run_id,))
+            except Exception as e:
+                # DB unreachable: the cached run is the best copy (its write may be queued for retry)
+                _log(f"revision check failed for {run_id}, using cached run: {e}")
+                row = None
+            # No row yet: its write is still queued after a DB error, memory is newest
+            if row is None or int(row["revision"]) <= int(entry[1]["revision"]):
+                with self._lock:
+                    if run_id in self._runs:
+                        self._runs.move_to_end(run_id)
+                    self._hits += 1
+                return dict(entry[1])
+            with self._lock:
+                self._stale += 1
+
+        row = get_db().fetchone(
+            "SELECT run_id, variables, prompts, drafts, final, temperature, compiler_mode, revision "
+            "FROM pipeline_runs WHERE run_id = %s;",
+            (run_id,),
+        )
+        with self._lock:
+            if row is None:
+                self._misses += 1
+                return None
+            self._db_hits += 1
+        run = dict(row)
+        self._remember(run)
+        return dict(run)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cached_runs": len(self._runs),
+                "ttl_s": self.ttl_s,
+                "memory_hits": self._hits,
+                "db_hits": self._db_hits,
+                "stale_reloads": self._stale,
+                "misses": self._misses,
+                "purged": self._purged,
+                "writer": _writer.stats(),
+            }
+
+
+_store = DraftStore()
+
+
+def get_draft_store() -> DraftStore:
+    return _store
@@ -0,0 +1,563 @@
+'''
+example_index.py
+Local BM25 index over BlogData.blogText and every BlogParts column, used to
+auto-select the most relevant examples for a TITLE/KEYWORDS query.
+
+- Each corpus is stored as NumPy arrays (doc-major term counts + term-major
+  postings) saved as .npy files and opened with mmap_mode="r", so pre-forked
+  workers share one copy through the page cache.
+- Updates are incremental: content hashes (md5 computed in Postgres) are diffed
+  against the index and only new/changed rows are fetched and tokenised. The
+  check runs at most every INDEX_CHECK_INTERVAL_S and is skipped while the
+  table_versions counters (migration 005) are unchanged. Searches never
+  sync inline: they use the current index and hand a due check to a
+  background thread (warm-up does the first build).
+- EXAMPLE_INDEX_BACKEND=pgvector keeps feature-hashed term vectors in an
+  `example_vectors` table (migration 006, opt-in) and searches with the
+  pgvector cosine operator instead.
+'''
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+try:
+    import numpy as np  # optional: auto example selection is disabled without it
+except ImportError:
+    np = None
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+EXAMPLE_INDEX_BACKEND = os.getenv("EXAMPLE_INDEX_BACKEND", "local").strip().lower()
+EXAMPLE_INDEX_DIR = os.getenv(
+    "EXAMPLE_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".example_index"),
+)
+INDEX_CHECK_INTERVAL_S = float(os.getenv("EXAMPLE_INDEX_CHECK_INTERVAL_S", "30"))
+AUTO_EXAMPLES_DEFAULT_K = 2
+AUTO_EXAMPLES_MAX_K = 10
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Feature-hashing width for the pgvector backend (must match migration 006)
+PGVECTOR_DIM = 512
+
+# corpus -> (table, id column, text column)
+CORPORA: Dict[str, Tuple[str, str, str]] = {
+    "blogdata": ("blogdata", "blogid", "blogtext"),
+    "intro": ("blogparts", "blogid", "intro"),
+    "final_cta": ("blogparts", "blogid", "final_cta"),
+    "faqs": ("blogparts", "blogid", "faqs"),
+    "business_description": ("blogparts", "blogid", "business_description"),
+    "integrate_references": ("blogparts", "blogid", "integrate_references"),
+    "short_cta": ("blogparts", "blogid", "short_cta"),
+}
+
+_WORD_RE = re.compile(r"[a-z0-9']{2,}")
+_STOPWORDS = frozenset("""
+the and for are but not you your with this that from have has had was were will can our they them their
+what when where which who how why about into than then there these those been being also just more most
+any all each other some such only own same very its it's out use using over under after before while
+of to in on at by or an as is be it if we us
+""".split())
+
+_ARRAYS = ("doc_ids", "doc_len", "doc_ptr", "doc_terms", "doc_tf", "term_ptr", "post_docs", "post_tf")
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[ExampleIndex] {msg}")
+
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall((text or "").lower()) if w not in _STOPWORDS]
+
+
+def index_available() -> bool:
+    return np is not None
+
+
+# ============================================================
+# LOCAL BM25 INDEX
+# ============================================================
+class BM25Index:
+    """
+    One corpus. Arrays (N docs, V terms, nnz (doc, term) pairs):
+      doc_ids[N], doc_len[N]
+      doc_ptr[N+1], doc_terms[nnz], doc_tf[nnz]     doc-major, used for updates
+      term_ptr[V+1], post_docs[nnz], post_tf[nnz]   term-major postings, used for search
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.generation = 0
+        self.vocab: Dict[str, int] = {}
+        self.doc_md5: List[str] = []
+        self.arrays: Dict[str, Any] = {
+            "doc_ids": np.zeros(0, dtype=np.int64),
+            "doc_len": np.zeros(0, dtype=np.int32),
+            "doc_ptr": np.zeros(1, dtype=np.int64),
+            "doc_terms": np.zeros(0, dtype=np.int32),
+            "doc_tf": np.zeros(0, dtype=np.int32),
+            "term_ptr": np.zeros(1, dtype=np.int64),
+            "post_docs": np.zeros(0, dtype=np.int32),
+            "post_tf": np.zeros(0, dtype=np.int32),
+        }
+        self._idf = np.zeros(0, dtype=np.float32)
+        self._avgdl = 0.0
+        self._pos: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return int(self.arrays["doc_ids"].shape[0])
+
+    # ---------- derived state ----------
+    def _refresh_derived(self) -> None:
+        a = self.arrays
+        n = len(self)
+        df = np.diff(a["term_ptr"]).astype(np.float32)
+        self._idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self._avgdl = float(a["doc_len"].mean()) if n else 0.0
+        self._pos = {int(d): i for i, d in enumerate(a["doc_ids"].tolist())}
+
+    def _build_postings(self, doc_ptr, doc_terms, doc_tf) -> Tuple[Any, Any, Any]:
+        n = doc_ptr.shape[0] - 1
+        rows = np.repeat(np.arange(n, dtype=np.int32), np.diff(doc_ptr))
+        order = np.argsort(doc_terms, kind="stable")
+        counts = np.bincount(doc_terms, minlength=len(self.vocab)) if doc_terms.size else np.zeros(len(self.vocab), dtype=np.int64)
+        term_ptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_ptr[1:])
+        return term_ptr, rows[order], doc_tf[order]
+
+    # ---------- updates ----------
+    def apply(self, upserts: Dict[int, Tuple[str, str]], deletes: Set[int]) -> None:
+        """
+        upserts: doc_id -> (md5, text) for new or changed rows; deletes: removed doc_ids.
+        Unchanged documents are carried over without re-tokenising.
+        """
+        a = self.arrays
+        old_ids = a["doc_ids"]
+        drop = set(deletes) | set(upserts)
+        keep = np.array([int(d) not in drop for d in old_ids.tolist()], dtype=bool)
+
+        entry_doc = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(a["doc_ptr"]))
+        keep_entries = keep[entry_doc] if entry_doc.size else np.zeros(0, dtype=bool)
+
+        kept_ids = old_ids[keep]
+        kept_len = a["doc_len"][keep]
+        kept_counts = np.diff(a["doc_ptr"])[keep]
+        kept_terms = a["doc_terms"][keep_entries]
+        kept_tf = a["doc_tf"][keep_entries]
+        kept_md5 = [m for m, k in zip(self.doc_md5, keep.tolist()) if k]
+
+        new_ids: List[int] = []
+        new_len: List[int] = []
+        new_counts: List[int] = []
+        new_terms: List[int] = []
+        new_tf: List[int] = []
+        new_md5: List[str] = []
+        for doc_id in sorted(upserts):
+            md5, text = upserts[doc_id]
+            toks = tokenize(text)
+            tf = Counter(toks)
+            for term, c in sorted(tf.items()):
+                j = self.vocab.get(term)
+                if j is None:
+                    j = self.vocab[term] = len(self.vocab)
+                new_terms.append(j)
+                new_tf.append(c)
+            new_ids.append(doc_id)
+            new_len.append(len(toks))
+            new_counts.append(len(tf))
+            new_md5.append(md5)
+
+        counts = np.concatenate([kept_counts, np.array(new_counts, dtype=np.int64)])
+        doc_ptr = np.zeros(counts.shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=doc_ptr[1:])
+        doc_terms = np.concatenate([kept_terms, np.array(new_terms, dtype=np.int32)]).astype(np.int32)
+        doc_tf = np.concatenate([kept_tf, np.array(new_tf, dtype=np.int32)]).astype(np.int32)
+        term_ptr, post_docs, post_tf = self._build_postings(doc_ptr, doc_terms, doc_tf)
+
+        self.arrays = {
+            "doc_ids": np.concatenate([kept_ids, np.array(new_ids, dtype=np.int64)]),
+            "doc_len": np.concatenate([kept_len, np.array(new_len, dtype=np.int32)]).astype(np.int32),
+            "doc_ptr": doc_ptr,
+            "doc_terms": doc_terms,
+            "doc_tf": doc_tf,
+            "term_ptr": term_ptr,
+            "post_docs": post_docs.astype(np.int32),
+            "post_tf": post_tf.astype(np.int32),
+        }
+        self.doc_md5 = kept_md5 + new_md5
+        self.generation += 1
+        self._refresh_derived()
+
+    def clone(self) -> "BM25Index":
+        """Copy to update while searches keep reading this one (arrays are replaced, not mutated)."""
+        other = BM25Index.__new__(BM25Index)
+        other.name = self.name
+        other.generation = self.generation
+        other.vocab = dict(self.vocab)
+        other.doc_md5 = list(self.doc_md5)
+        other.arrays = dict(self.arrays)
+        other._idf, other._avgdl, other._pos = self._idf, self._avgdl, self._pos
+        return other
+
+    def md5_by_id(self) -> Dict[int, str]:
+        return dict(zip((int(d) for d in self.arrays["doc_ids"].tolist()), self.doc_md5))
+
+    # ---------- search ----------
+    def search(self, query: str, k: int, exclude: Sequence[int] = ()) -> List[Tuple[int, float]]:
+        n = len(self)
+        if not n or k <= 0:
+            return []
+        a = self.arrays
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            j = self.vocab.get(term)
+            if j is None:
+                continue
+            s, e = int(a["term_ptr"][j]), int(a["term_ptr"][j + 1])
+            if s == e:
+                continue
+            docs = a["post_docs"][s:e]
+            tf = a["post_tf"][s:e].astype(np.float32)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * a["doc_len"][docs] / (self._avgdl or 1.0))
+            scores[docs] += self._idf[j] * tf * (BM25_K1 + 1) / (tf + norm)
+        for doc_id in exclude:
+            i = self._pos.get(int(doc_id))
+            if i is not None:
+                scores[i] = 0.0
+
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(a["doc_ids"][i]), round(float(scores[i]), 4)) for i in top if scores[i] > 0]
+
+    # ---------- persistence ----------
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"{self.name}.{self.generation}")
+        for key in _ARRAYS:
+            np.save(f"{prefix}.{key}.npy", np.ascontiguousarray(self.arrays[key]))
+        meta = {
+            "name": self.name,
+            "generation": self.generation,
+            "vocab": sorted(self.vocab, key=self.vocab.get),
+            "doc_md5": self.doc_md5,
+        }
+        tmp = os.path.join(directory, f"{self.name}.meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        # The meta file is the commit point: readers only see complete generations
+        os.replace(tmp, os.path.join(directory, f"{self.name}.meta.json"))
+        self._remove_old_generations(directory)
+
+    def _remove_old_generations(self, directory: str) -> None:
+        keep = f"{self.name}.{self.generation}."
+        for fn in os.listdir(directory):
+            if fn.startswith(f"{self.name}.") and fn.endswith(".npy") and not fn.startswith(keep):
+                try:
+                    os.remove(os.path.join(directory, fn))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def disk_generation(directory: str, name: str) -> int:
+        try:
+            with open(os.path.join(directory, f"{name}.meta.json"), encoding="utf-8") as f:
+                return int(json.load(f).get("generation", 0))
+        except (OSError, ValueError):
+            return 0
+
+    @classmethod
+    def load(cls, directory: str, name: str) -> Optional["BM25Index"]:
+        try:
+            with open(os.path.join(directory, f"{name}.meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            idx = cls(name)
+            idx.generation = int(meta["generation"])
+            idx.vocab = {t: i for i, t in enumerate(meta["vocab"])}
+            idx.doc_md5 = list(meta["doc_md5"])
+            prefix = os.path.join(directory, f"{name}.{idx.generation}")
+            idx.arrays = {key: np.load(f"{prefix}.{key}.npy", mmap_mode="r") for key in _ARRAYS}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            _log(f"{name}: snapshot unreadable, rebuilding ({e})")
+            return None
+        idx._refresh_derived()
+        return idx
+
+
+# ============================================================
+# SOURCE SYNC (shared by both backends and data/example_store.py)
+# ============================================================
+def source_hashes(conn, corpus: str) -> Dict[int, str]:
+    table, id_col, text_col = CORPORA[corpus]
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT {id_col}, md5(coalesce({text_col}, '')) FROM {table} WHERE {text_col} IS NOT NULL;"
+        )
+        return {int(r[0]): r[1] for r in cur.fetchall()}
+
+
+def source_texts(conn, corpus: str, ids: Sequence[int]) -> Dict[int, str]:
+    if not ids:
+        return {}
+    table, id_col, text_col = CORPORA[corpus]
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT {id_col}, {text_col} FROM {table} WHERE {id_col} = ANY(%s);", (list(ids),))
+        return {int(r[0]): r[1] or "" for r in cur.fetchall()}
+
+
+def source_version(conn, table: str) -> Optional[str]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.table_versions') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT version FROM table_versions WHERE table_name = %s;", (table,))
+        row = cur.fetchone()
+    return None if row is None else str(row[0])
+
+
+@contextmanager
+def dir_lock(directory: str):
+    """Exclusive cross-process lock on a snapshot directory (no-op if it is not writable)."""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        lf = open(os.path.join(directory, ".lock"), "w")
+    except OSError:
+        # Read-only filesystem: in-memory copies only, nothing to coordinate
+        yield
+        return
+    with lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+# ============================================================
+# PGVECTOR BACKEND (opt-in)
+# ============================================================
+def hashed_vector(text: str, dim: int = PGVECTOR_DIM) -> List[float]:
+    """Feature-hashed, log-tf, L2-normalised term vector (no model download needed)."""
+    vec = [0.0] * dim
+    for term, c in Counter(tokenize(text)).items():
+        h = int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += (1.0 if (h >> 63) & 1 else -1.0) * (1.0 + math.log(c))
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [round(v / norm, 6) for v in vec]
+
+
+def _vector_literal(vec: Sequence[float]) -> str:
+    return "[" + ",".join(str(v) for v in vec) + "]"
+
+
+def _pgvector_sync(conn, corpus: str) -> Dict[str, int]:
+    source = source_hashes(conn, corpus)
+    with conn.cursor() as cur:
+        cur.execute("SELECT doc_id, content_md5 FROM example_vectors WHERE corpus = %s;", (corpus,))
+        have = {int(r[0]): r[1] for r in cur.fetchall()}
+    changed = [d for d, m in source.items() if have.get(d) != m]
+    removed = [d for d in have if d not in source]
+    texts = source_texts(conn, corpus, changed)
+    with conn.cursor() as cur:
+        for doc_id in changed:
+            cur.execute("""
+                INSERT INTO example_vectors (corpus, doc_id, content_md5, embedding)
+                VALUES (%s, %s, %s, %s::vector)
+                ON CONFLICT (corpus, doc_id) DO UPDATE
+                    SET content_md5 = EXCLUDED.content_md5, embedding = EXCLUDED.embedding;
+            """, (corpus, doc_id, source[doc_id], _vector_literal(hashed_vector(texts.get(doc_id, "")))))
+        if removed:
+            cur.execute("DELETE FROM example_vectors WHERE corpus = %s AND doc_id = ANY(%s);", (corpus, removed))
+    conn.commit()
+    return {"upserted": len(changed), "deleted": len(removed)}
+
+
+def _pgvector_search(conn, corpus: str, query: str, k: int, exclude: Sequence[int]) -> List[Tuple[int, float]]:
+    vec = _vector_literal(hashed_vector(query))
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT doc_id, 1 - (embedding <=> %s::vector) AS score
+            FROM example_vectors
+            WHERE corpus = %s AND NOT (doc_id = ANY(%s))
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s;
+        """, (vec, corpus, list(exclude), vec, k))
+        return [(int(r[0]), round(float(r[1]), 4)) for r in cur.fetchall() if r[1] and r[1] > 0]
+
+
+# ============================================================
+# INDEX MANAGER
+# ============================================================
+class ExampleIndex:
+    """
+    Process-wide owner of the per-corpus indexes. Safe to share between request
+    threads; writers across worker processes are serialised with a file lock.
+    """
+    def __init__(self, directory: str = EXAMPLE_INDEX_DIR, backend: str = EXAMPLE_INDEX_BACKEND):
+        self.directory = directory
+        self.backend = backend if backend in ("local", "pgvector") else "local"
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, BM25Index] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._versions: Dict[str, Optional[str]] = {}
+        self._last_sync: Dict[str, Dict[str, Any]] = {}
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self._refresh_lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        # Sync threads don't survive fork; their locks may have been held
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = {}
+
+    def _index(self, corpus: str) -> BM25Index:
+        idx = self._indexes.get(corpus)
+        if idx is None:
+            idx = BM25Index.load(self.directory, corpus) or BM25Index(corpus)
+            self._indexes[corpus] = idx
+        return idx
+
+    def ensure_fresh(self, db, corpus: str, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._checked_at.get(corpus, 0.0) < INDEX_CHECK_INTERVAL_S:
+            return
+        with self._lock:
+            if not force and now - self._checked_at.get(corpus, 0.0) < INDEX_CHECK_INTERVAL_S:
+                return
+            self._checked_at[corpus] = now
+            table = CORPORA[corpus][0]
+            with db.conn() as conn:
+                version = source_version(conn, table)
+                if version is not None and corpus in self._versions and self._versions[corpus] == version:
+                    return
+                if self.backend == "pgvector":
+                    stats = _pgvector_sync(conn, corpus)
+                else:
+                    stats = self._sync_local(conn, corpus)
+            self._versions[corpus] = version
+            stats["ms"] = round((time.time() - now) * 1000, 1)
+            self._last_sync[corpus] = stats
+            if stats.get("upserted") or stats.get("deleted"):
+                _log(f"{corpus} synced | {stats}")
+
+    def refresh_in_background(self, db, corpus: str) -> None:
+        """Starts ensure_fresh on a daemon thread when a check is due and none is running."""
+        if time.time() - self._checked_at.get(corpus, 0.0) < INDEX_CHECK_INTERVAL_S:
+            return
+        with self._refresh_lock:
+            t = self._refreshing.get(corpus)
+            if t is not None and t.is_alive():
+                return
+            t = threading.Thread(target=self._refresh, args=(db, corpus), name=f"example-index-{corpus}", daemon=True)
+            self._refreshing[corpus] = t
+        t.start()
+
+    def _refresh(self, db, corpus: str) -> None:
+        try:
+            self.ensure_fresh(db, corpus)
+        except Exception as e:
+            _log(f"{corpus}: background sync failed ({e})")
+
+    def _sync_local(self, conn, corpus: str) -> Dict[str, Any]:
+        idx = self._index(corpus)
+        # Another worker may have written a newer snapshot
+        if BM25Index.disk_generation(self.directory, corpus) > idx.generation:
+            idx = BM25Index.load(self.directory, corpus) or idx
+            self._indexes[corpus] = idx
+
+        source = source_hashes(conn, corpus)
+        have = idx.md5_by_id()
+        changed = [d for d, m in source.items() if have.get(d) != m]
+        removed = {d for d in have if d not in source}
+        if not changed and not removed:
+            return {"upserted": 0, "deleted": 0, "docs": len(idx)}
+
+        with dir_lock(self.directory):
+            if BM25Index.disk_generation(self.directory, corpus) > idx.generation:
+                idx = BM25Index.load(self.directory, corpus) or idx
+                have = idx.md5_by_id()
+                changed = [d for d, m in source.items() if have.get(d) != m]
+                removed = {d for d in have if d not in source}
+            texts = source_texts(conn, corpus, changed)
+            idx = idx.clone()
+            idx.apply({d: (source[d], texts.get(d, "")) for d in changed}, removed)
+            try:
+                idx.save(self.directory)
+            except OSError as e:
+                # Keep serving from memory
+                _log(f"{corpus}: snapshot not saved ({e})")
+        self._indexes[corpus] = idx
+        return {"upserted": len(changed), "deleted": len(removed), "docs": len(idx)}
+
+    def search(self, db, corpus: str, query: str, k: int, exclude: Sequence[int] = ()) -> List[Tuple[int, float]]:
+        # Serves the current index; a due sync runs in the background, never on the request
+        self.refresh_in_background(db, corpus)
+        if self.backend == "pgvector":
+            with db.conn() as conn:
+                return _pgvector_search(conn, corpus, query, k, exclude)
+        return self._index(corpus).search(query, k, exclude)
+
+    def warm(self, db) -> Dict[str, Any]:
+        for corpus in CORPORA:
+            self.ensure_fresh(db, corpus, force=True)
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "corpora": {
+                c: {
+                    "docs": len(self._indexes[c]) if c in self._indexes else None,
+                    "terms": len(self._indexes[c].vocab) if c in self._indexes else None,
+                    "generation": self._indexes[c].generation if c in self._indexes else None,
+                    "last_sync": self._last_sync.get(c),
+                }
+                for c in CORPORA
+            },
+        }
+
+
+_index_singleton: Optional[ExampleIndex] = None
+_index_singleton_lock = threading.Lock()
+
+
+def get_example_index() -> ExampleIndex:
+    global _index_singleton
+    if np is None and EXAMPLE_INDEX_BACKEND != "pgvector":
+        raise RuntimeError("numpy is not installed; the local example index is unavailable.")
+    if _index_singleton is None:
+        with _index_singleton_lock:
+            if _index_singleton is None:
+                _index_singleton = ExampleIndex()
+    return _index_singleton
+
+
+def suggest_examples(db, corpus: str, query: str, k: int = AUTO_EXAMPLES_DEFAULT_K, exclude: Sequence[int] = ()) -> Tuple[List[Tuple[int, float]], Dict[str, Any]]:
+    """
+    Returns ([(doc_id, score)], info). `corpus` is a key of CORPORA.
+    """
+    if corpus not in CORPORA:
+        raise KeyError(corpus)
+    t0 = time.time()
+    idx = get_example_index()
+    hits = idx.search(db, corpus, query, max(1, min(int(k), AUTO_EXAMPLES_MAX_K)), exclude)
+    return hits, {"backend": idx.backend, "ms": round((time.time() - t0) * 1000, 2)}
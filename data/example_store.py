@@ -0,0 +1,380 @@
+'''
+example_store.py
+Compressed, deduplicated local snapshot of the example texts (BlogData and
+every BlogParts column) used by the /api/chat example fetchers.
+
+- One snapshot per corpus: a blob file of zstd frames compressed with a
+  dictionary trained on that corpus (CTAs and business descriptions share most
+  of their wording), plus a small JSON meta file (doc_id -> offset/length/md5).
+- Identical texts are stored once.
+- The blob is opened with mmap, so every pre-forked worker reads the same pages
+  from the OS page cache instead of holding its own copy of the texts.
+- Refreshes reuse the example-index sync: row hashes are diffed (at most every
+  EXAMPLE_STORE_CHECK_INTERVAL_S, skipped while table_versions is unchanged) and
+  only new/changed rows are read from Postgres. Unchanged frames are copied as-is
+  unless the dictionary is retrained.
+- Fetching examples is then a local decode with no DB round trip. Requests
+  never rebuild: they serve the current snapshot (SQL for ids it lacks) and
+  hand due refreshes to a background thread; warm-up does the first build.
+'''
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from data.example_index import CORPORA, dir_lock, source_hashes, source_texts, source_version
+
+try:
+    import zstandard as zstd  # optional: without it the fetchers read straight from Postgres
+except ImportError:
+    zstd = None
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+EXAMPLE_STORE_ENABLED = os.getenv("EXAMPLE_STORE", "1") == "1"
+EXAMPLE_STORE_DIR = os.getenv(
+    "EXAMPLE_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".example_store"),
+)
+STORE_CHECK_INTERVAL_S = float(os.getenv("EXAMPLE_STORE_CHECK_INTERVAL_S", "30"))
+
+ZSTD_LEVEL = 19
+DICT_SIZE = 32 * 1024
+# Dictionary training needs a handful of samples to be worth it
+DICT_MIN_SAMPLES = 8
+# Retrain once this fraction of a corpus has changed since the last training
+DICT_RETRAIN_FRACTION = 0.25
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[ExampleStore] {msg}")
+
+
+def store_available() -> bool:
+    return EXAMPLE_STORE_ENABLED and zstd is not None
+
+
+# ============================================================
+# SNAPSHOT (one corpus)
+# ============================================================
+class _Snapshot:
+    """
+    Read side of one corpus snapshot. `entries`: doc_id -> (offset, length, md5).
+    """
+    def __init__(self, corpus: str, generation: int, entries: Dict[int, Tuple[int, int, str]],
+                 dict_data: bytes, blob: Any, meta: Dict[str, Any]):
+        self.corpus = corpus
+        self.generation = generation
+        self.entries = entries
+        self.dict_data = dict_data
+        self.blob = blob
+        self.meta = meta
+        self._zdict = zstd.ZstdCompressionDict(dict_data) if dict_data else None
+        self._local = threading.local()
+
+    def _decompressor(self):
+        d = getattr(self._local, "d", None)
+        if d is None:
+            d = zstd.ZstdDecompressor(dict_data=self._zdict) if self._zdict else zstd.ZstdDecompressor()
+            self._local.d = d
+        return d
+
+    def get(self, doc_id: int) -> Optional[str]:
+        e = self.entries.get(doc_id)
+        if e is None:
+            return None
+        offset, length, _ = e
+        return self._decompressor().decompress(self.blob[offset:offset + length]).decode("utf-8")
+
+    def frame(self, doc_id: int) -> Optional[bytes]:
+        e = self.entries.get(doc_id)
+        return None if e is None else bytes(self.blob[e[0]:e[0] + e[1]])
+
+    @classmethod
+    def empty(cls, corpus: str) -> "_Snapshot":
+        return cls(corpus, 0, {}, b"", b"", {})
+
+    @classmethod
+    def load(cls, directory: str, corpus: str) -> Optional["_Snapshot"]:
+        try:
+            with open(os.path.join(directory, f"{corpus}.meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            gen = int(meta["generation"])
+            prefix = os.path.join(directory, f"{corpus}.{gen}")
+            dict_data = b""
+            if meta.get("dict_size"):
+                with open(f"{prefix}.dict", "rb") as f:
+                    dict_data = f.read()
+            blob: Any = b""
+            if meta.get("stored_bytes"):
+                with open(f"{prefix}.blob", "rb") as f:
+                    blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            entries = {int(k): (int(v[0]), int(v[1]), v[2]) for k, v in meta["entries"].items()}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            _log(f"{corpus}: snapshot unreadable, rebuilding ({e})")
+            return None
+        return cls(corpus, gen, entries, dict_data, blob, meta)
+
+
+def _build_snapshot(directory: str, corpus: str, old: _Snapshot, source: Dict[int, str],
+                    texts: Dict[int, str]) -> Tuple[int, Dict[str, Any]]:
+    """
+    Writes generation old.generation + 1. `texts` holds the new/changed rows;
+    unchanged rows are taken from `old` (copied as frames when the dictionary is kept).
+    """
+    changed = set(texts)
+    retrain = (
+        not old.dict_data
+        or len(changed) >= max(1, int(len(source) * DICT_RETRAIN_FRACTION))
+    )
+
+    def _text(doc_id: int) -> str:
+        return texts[doc_id] if doc_id in texts else (old.get(doc_id) or "")
+
+    dict_data = old.dict_data
+    if retrain:
+        samples = [_text(d).encode("utf-8") for d in sorted(source)]
+        samples = [s for s in samples if s]
+        dict_data = b""
+        if len(samples) >= DICT_MIN_SAMPLES:
+            try:
+                dict_data = zstd.train_dictionary(DICT_SIZE, samples).as_bytes()
+            except zstd.ZstdError as e:
+                _log(f"{corpus}: dictionary training skipped ({e})")
+    zdict = zstd.ZstdCompressionDict(dict_data) if dict_data else None
+    cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict) if zdict else zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    reuse_frames = not retrain
+
+    gen = old.generation + 1
+    prefix = os.path.join(directory, f"{corpus}.{gen}")
+    entries: Dict[str, List[Any]] = {}
+    by_md5: Dict[str, Tuple[int, int]] = {}
+    stored_bytes = 0
+    with open(f"{prefix}.blob", "wb") as f:
+        for doc_id in sorted(source):
+            md5 = source[doc_id]
+            if md5 in by_md5:
+                # Exact duplicate text: point at the existing frame
+                offset, length = by_md5[md5]
+            else:
+                frame = old.frame(doc_id) if (reuse_frames and doc_id not in changed) else None
+                if frame is None:
+                    frame = cctx.compress(_text(doc_id).encode("utf-8"))
+                offset, length = stored_bytes, len(frame)
+                f.write(frame)
+                stored_bytes += length
+                by_md5[md5] = (offset, length)
+            entries[str(doc_id)] = [offset, length, md5]
+    if dict_data:
+        with open(f"{prefix}.dict", "wb") as f:
+            f.write(dict_data)
+
+    raw_sizes = {str(d): len(_text(d).encode("utf-8")) for d in changed}
+    for d in source:
+        if d not in changed and str(d) in old.meta.get("raw_sizes", {}):
+            raw_sizes[str(d)] = old.meta["raw_sizes"][str(d)]
+    logical_bytes = sum(raw_sizes.get(str(d), 0) for d in source)
+    meta = {
+        "corpus": corpus,
+        "generation": gen,
+        "entries": entries,
+        "raw_sizes": raw_sizes,
+        "docs": len(source),
+        "unique_frames": len(by_md5),
+        "logical_bytes": logical_bytes,
+        "stored_bytes": stored_bytes,
+        "dict_size": len(dict_data),
+        "dict_retrained": retrain,
+        "built_at": time.time(),
+    }
+    tmp = os.path.join(directory, f"{corpus}.meta.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    # The meta file is the commit point: readers only see complete generations
+    os.replace(tmp, os.path.join(directory, f"{corpus}.meta.json"))
+
+    for fn in os.listdir(directory):
+        if fn.startswith(f"{corpus}.") and fn.endswith((".blob", ".dict")) and not fn.startswith(f"{corpus}.{gen}."):
+            try:
+                os.remove(os.path.join(directory, fn))
+            except OSError:
+                pass
+    return gen, meta
+
+
+# ============================================================
+# STORE
+# ============================================================
+class ExampleStore:
+    """Process-wide owner of the per-corpus snapshots (thread-safe)."""
+    def __init__(self, directory: str = EXAMPLE_STORE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, _Snapshot] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._versions: Dict[str, Optional[str]] = {}
+        self._refreshing: Dict[str, threading.Thread] = {}
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self) -> None:
+        # Refresh threads don't survive fork; their locks may have been held
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._refreshing = {}
+
+    def _snapshot(self, corpus: str) -> _Snapshot:
+        snap = self._snapshots.get(corpus)
+        if snap is None:
+            snap = _Snapshot.load(self.directory, corpus) or _Snapshot.empty(corpus)
+            self._snapshots[corpus] = snap
+        return snap
+
+    def ensure_fresh(self, db, corpus: str, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._checked_at.get(corpus, 0.0) < STORE_CHECK_INTERVAL_S:
+            return
+        with self._lock:
+            if not force and now - self._checked_at.get(corpus, 0.0) < STORE_CHECK_INTERVAL_S:
+                return
+            self._checked_at[corpus] = now
+            with db.conn() as conn:
+                version = source_version(conn, CORPORA[corpus][0])
+                if version is not None and corpus in self._versions and self._versions[corpus] == version:
+                    return
+                self._sync(conn, corpus)
+            self._versions[corpus] = version
+
+    def refresh_in_background(self, db, corpus: str) -> None:
+        """Starts ensure_fresh on a daemon thread when a check is due and none is running."""
+        if time.time() - self._checked_at.get(corpus, 0.0) < STORE_CHECK_INTERVAL_S:
+            return
+        with self._stats_lock:
+            t = self._refreshing.get(corpus)
+            if t is not None and t.is_alive():
+                return
+            t = threading.Thread(target=self._refresh, args=(db, corpus), name=f"example-store-{corpus}", daemon=True)
+            self._refreshing[corpus] = t
+        t.start()
+
+    def _refresh(self, db, corpus: str) -> None:
+        try:
+            self.ensure_fresh(db, corpus)
+        except Exception as e:
+            _log(f"{corpus}: background refresh failed ({e})")
+
+    def _sync(self, conn, corpus: str) -> None:
+        snap = self._snapshot(corpus)
+        on_disk = _Snapshot.load(self.directory, corpus)
+        if on_disk is not None and on_disk.generation > snap.generation:
+            snap = self._snapshots[corpus] = on_disk
+
+        source = source_hashes(conn, corpus)
+        have = {d: e[2] for d, e in snap.entries.items()}
+        if have == source:
+            return
+
+        with dir_lock(self.directory):
+            # Another worker may have rebuilt while we waited for the lock
+            on_disk = _Snapshot.load(self.directory, corpus)
+            if on_disk is not None and on_disk.generation > snap.generation:
+                snap = on_disk
+                if {d: e[2] for d, e in snap.entries.items()} == source:
+                    self._snapshots[corpus] = snap
+                    return
+            changed = [d for d, m in source.items() if snap.entries.get(d, (0, 0, None))[2] != m]
+            texts = source_texts(conn, corpus, changed)
+            t0 = time.time()
+            _, meta = _build_snapshot(self.directory, corpus, snap, source, texts)
+            fresh = _Snapshot.load(self.directory, corpus)
+        if fresh is not None:
+            self._snapshots[corpus] = fresh
+        _log(
+            f"{corpus} gen={meta['generation']} | docs={meta['docs']} changed={len(changed)} | "
+            f"{meta['logical_bytes'] // 1024}KB -> {meta['stored_bytes'] // 1024}KB | "
+            f"dict={'retrained' if meta['dict_retrained'] else 'kept'} | {(time.time() - t0) * 1000:.0f}ms"
+        )
+
+    def get_texts(self, db, corpus: str, ids: Sequence[int]) -> List[str]:
+        """
+        Texts for `ids` in id order (same order as the SQL fetchers). Ids not in the
+        snapshot (new rows before the next refresh) are read from Postgres.
+        Never rebuilds on the caller's thread.
+        """
+        self.refresh_in_background(db, corpus)
+        snap = self._snapshot(corpus)
+        found: Dict[int, str] = {}
+        missing: List[int] = []
+        for doc_id in sorted(set(int(i) for i in ids)):
+            text = snap.get(doc_id)
+            if text is None:
+                missing.append(doc_id)
+            else:
+                found[doc_id] = text
+        hits = len(found)
+        if missing:
+            with db.conn() as conn:
+                found.update({d: t for d, t in source_texts(conn, corpus, missing).items() if t})
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += len(missing)
+        return [found[d] for d in sorted(found)]
+
+    def warm(self, db) -> Dict[str, Any]:
+        for corpus in CORPORA:
+            self.ensure_fresh(db, corpus, force=True)
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        corpora: Dict[str, Any] = {}
+        logical = stored = 0
+        for corpus, snap in self._snapshots.items():
+            m = snap.meta
+            corpora[corpus] = {
+                "generation": snap.generation,
+                "docs": m.get("docs", 0),
+                "unique_frames": m.get("unique_frames", 0),
+                "logical_bytes": m.get("logical_bytes", 0),
+                "stored_bytes": m.get("stored_bytes", 0),
+                "dict_size": m.get("dict_size", 0),
+            }
+            logical += m.get("logical_bytes", 0)
+            stored += m.get("stored_bytes", 0)
+        return {
+            "enabled": store_available(),
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            "ratio": round(logical / stored, 2) if stored else None,
+            "snapshot_hits": self._hits,
+            "sql_fallbacks": self._misses,
+            "corpora": corpora,
+        }
+
+
+_store: Optional[ExampleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_example_store() -> Optional[ExampleStore]:
+    """None when the store is disabled or zstandard is missing (fetchers fall back to SQL)."""
+    global _store
+    if not store_available():
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ExampleStore()
+    return _store
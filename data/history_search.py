@@ -0,0 +1,109 @@
+'''
+history_search.py
+Date-range + full-text search over profileHistory.
+Matches go through the GIN expression index from migration 004 and only
+short ts_headline snippets are returned (never the full texts).
+'''
+from __future__ import annotations
+
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2.extras
+
+from data.database_postgres import get_profilehistory_columns, parse_yyyy_mm_dd
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+SEARCH_TS_CONFIG = "english"
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+SNIPPET_CHARS = 240
+
+# Highlight markers; the frontend escapes the snippet and turns these into <mark>
+HL_START = "[["
+HL_STOP = "]]"
+_HEADLINE_OPTS = f"StartSel={HL_START}, StopSel={HL_STOP}, MaxFragments=2, MaxWords=24, MinWords=8, FragmentDelimiter=\" … \""
+
+
+def search_tsvector_sql(user_col: str, resp_col: str) -> str:
+    """
+    Must stay textually equivalent to the index expression in migration 004,
+    otherwise the planner won't use the GIN index.
+    """
+    return (
+        f"to_tsvector('{SEARCH_TS_CONFIG}'::regconfig, "
+        f"coalesce({user_col}, '') || ' ' || coalesce({resp_col}, ''))"
+    )
+
+
+def parse_cursor(s: str) -> Optional[Tuple[date, int]]:
+    """
+    Cursor format: "YYYY-MM-DD:id" (the last row of the previous page).
+    """
+    s = (s or "").strip()
+    if not s:
+        return None
+    d, _, i = s.partition(":")
+    return parse_yyyy_mm_dd(d), int(i)
+
+
+def search_profile_history(
+    conn,
+    date_from: date,
+    date_to: date,
+    keyword: str,
+    limit: int = SEARCH_PAGE_DEFAULT,
+    cursor: Optional[Tuple[date, int]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Newest first, keyset-paginated on (entry_date, id).
+    Returns (rows, next_cursor).
+    """
+    user_col, resp_col = get_profilehistory_columns(conn)
+    limit = min(max(int(limit), 1), SEARCH_PAGE_MAX)
+    keyword = (keyword or "").strip()
+
+    where = ["entry_date BETWEEN %s AND %s"]
+    params: List[Any] = []
+
+    if keyword:
+        prompt_snip = f"ts_headline('{SEARCH_TS_CONFIG}', coalesce({user_col}, ''), q, %s)"
+        resp_snip = f"ts_headline('{SEARCH_TS_CONFIG}', coalesce({resp_col}, ''), q, %s)"
+        from_sql = f"profileHistory, websearch_to_tsquery('{SEARCH_TS_CONFIG}', %s) AS q"
+        params += [_HEADLINE_OPTS, _HEADLINE_OPTS, keyword]
+        where.append(f"{search_tsvector_sql(user_col, resp_col)} @@ q")
+    else:
+        prompt_snip = f"left(coalesce({user_col}, ''), {SNIPPET_CHARS})"
+        resp_snip = f"left(coalesce({resp_col}, ''), {SNIPPET_CHARS})"
+        from_sql = "profileHistory"
+
+    params += [date_from, date_to]
+    if cursor is not None:
+        where.append("(entry_date, id) < (%s, %s)")
+        params += [cursor[0], cursor[1]]
+    params.append(limit + 1)
+
+    query = f"""
+        SELECT
+            id,
+            entry AS entry,
+            entry_date AS entry_date,
+            {prompt_snip} AS prompt_snippet,
+            {resp_snip} AS response_snippet
+        FROM {from_sql}
+        WHERE {" AND ".join(where)}
+        ORDER BY entry_date DESC, id DESC
+        LIMIT %s;
+    """
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute(query, tuple(params))
+        rows = cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last['entry_date'].isoformat()}:{last['id']}"
+    return rows, next_cursor
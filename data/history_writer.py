@@ -0,0 +1,141 @@
+'''
+history_writer.py
+Off-request-path persistence of chat history (profileHistory) and daily
+section completion flags (progress). Writes are buffered by a BatchWriter
+and flushed as multi-row statements.
+'''
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import psycopg2.extras
+from psycopg2 import sql
+
+from data.batch_writer import BatchWriter
+from data.database_postgres import get_db, get_profilehistory_columns
+from data.migrations import maintain_profilehistory_partitions
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+HISTORY_MAX_BATCH = int(os.getenv("HISTORY_MAX_BATCH", "50"))
+HISTORY_FLUSH_INTERVAL_S = float(os.getenv("HISTORY_FLUSH_INTERVAL_S", "1.0"))
+
+# progress columns that can be flagged (matches the progress table)
+PROGRESS_COLUMNS = {
+    "writing",
+    "intro",
+    "final_cta",
+    "faqs",
+    "business_description",
+    "short_cta",
+    "integrate_references",
+}
+
+_ph_columns: Optional[Tuple[str, str]] = None
+# Day the upcoming profileHistory partitions were last ensured by this worker
+_partitions_checked: Optional[date] = None
+
+
+def _ensure_partitions(conn) -> None:
+    """
+    Once a day, before inserting: startup only covers DB_PARTITION_MONTHS_AHEAD
+    months, and rows past that land in the DEFAULT partition for good.
+    A failure is retried on the next flush and never blocks the insert.
+    """
+    global _partitions_checked
+    today = date.today()
+    if _partitions_checked == today:
+        return
+    try:
+        maintain_profilehistory_partitions(conn)
+        _partitions_checked = today
+    except Exception:
+        conn.rollback()
+
+
+def _flush_history(items: List[Tuple[Any, ...]]) -> None:
+    global _ph_columns
+
+    dates: Dict[date, datetime] = {}
+    history_rows: List[Tuple[date, datetime, str, str]] = []
+    marks: Dict[date, Set[str]] = defaultdict(set)
+
+    for item in items:
+        kind, entry = item[0], item[1]
+        d = entry.date()
+        dates.setdefault(d, entry)
+        if kind == "history":
+            history_rows.append((d, entry, item[2], item[3]))
+        elif kind == "progress":
+            marks[d].add(item[2])
+
+    with get_db().conn() as conn:
+        if _ph_columns is None:
+            _ph_columns = get_profilehistory_columns(conn)
+        user_col, resp_col = _ph_columns
+        if history_rows:
+            _ensure_partitions(conn)
+
+        with conn.cursor() as cur:
+            # profileHistory.entry_date references progress(entry_date)
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO progress (entry_date, entry) VALUES %s ON CONFLICT (entry_date) DO NOTHING",
+                sorted(dates.items()),
+            )
+
+            if history_rows:
+                psycopg2.extras.execute_values(
+                    cur,
+                    f"INSERT INTO profileHistory (entry_date, entry, {user_col}, {resp_col}) VALUES %s",
+                    history_rows,
+                    page_size=len(history_rows),
+                )
+
+            for d, cols in sorted(marks.items()):
+                assignments = sql.SQL(", ").join(
+                    sql.SQL("{} = TRUE").format(sql.Identifier(c)) for c in sorted(cols)
+                )
+                cur.execute(
+                    sql.SQL("UPDATE progress SET {} WHERE entry_date = %s").format(assignments),
+                    (d,),
+                )
+        conn.commit()
+
+
+_writer = BatchWriter(
+    "history",
+    _flush_history,
+    max_batch=HISTORY_MAX_BATCH,
+    flush_interval_s=HISTORY_FLUSH_INTERVAL_S,
+)
+
+
+def record_generation(userprompt: str, chatresponse: str) -> None:
+    """
+    Queue one finished generation for profileHistory. Never blocks and never raises.
+    """
+    try:
+        _writer.submit(("history", datetime.now().astimezone(), userprompt or "", chatresponse or ""))
+    except Exception:
+        pass
+
+
+def record_section_done(column: str) -> None:
+    """
+    Queue a progress flag for today (e.g. "intro", or "writing" for the compiled blog).
+    """
+    if column not in PROGRESS_COLUMNS:
+        return
+    try:
+        _writer.submit(("progress", datetime.now().astimezone(), column))
+    except Exception:
+        pass
+
+
+def history_writer_stats() -> Dict[str, Any]:
+    return _writer.stats()
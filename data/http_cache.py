@@ -0,0 +1,91 @@
+'''
+http_cache.py
+ETag / Last-Modified helpers for the DB viewer and profile history endpoints.
+Validators are computed from cheap metadata (a trigger-maintained per-table
+version counter, or an index-only count/max(id) for one history day), so a
+304 costs neither a table scan nor a re-serialisation.
+'''
+from __future__ import annotations
+
+import hashlib
+from datetime import date, datetime
+from typing import Any, Optional, Tuple
+
+from flask import Response, request
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+# Tables must be revalidated every time (cheap thanks to 304s)
+TABLE_CACHE_CONTROL = "private, no-cache"
+# Past history days never change
+PAST_DAY_CACHE_CONTROL = "private, max-age=86400, immutable"
+TODAY_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    raw = "|".join("" if p is None else str(p) for p in parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def table_version(conn, table_name: str) -> Tuple[str, Optional[datetime]]:
+    """
+    Returns (version_token, last_modified).
+    Uses the table_versions counter (migration 005) when the table has one,
+    otherwise falls back to the cumulative pg_stat tuple counters.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('public.table_versions') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            cur.execute(
+                "SELECT version, updated_at FROM table_versions WHERE table_name = %s;",
+                (table_name.lower(),),
+            )
+            row = cur.fetchone()
+            if row is not None:
+                return f"v{row[0]}", row[1]
+
+        cur.execute("""
+            SELECT n_tup_ins, n_tup_upd, n_tup_del, n_live_tup
+            FROM pg_stat_user_tables
+            WHERE schemaname = 'public' AND relname = %s;
+        """, (table_name,))
+        row = cur.fetchone()
+        if row is None:
+            return "unknown", None
+        return "s" + "-".join(str(x) for x in row), None
+
+
+def history_day_version(conn, day: date) -> str:
+    """
+    count + max(id) for one entry_date (index-only scan on (entry_date, id)).
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM profileHistory WHERE entry_date = %s;",
+            (day,),
+        )
+        n, max_id = cur.fetchone()
+    return f"{n}-{max_id}"
+
+
+def is_not_modified(etag: str, last_modified: Optional[datetime] = None) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime], cache_control: str) -> Response:
+    resp = Response(status=304)
+    return apply_cache_headers(resp, etag, last_modified, cache_control)
+
+
+def apply_cache_headers(resp: Response, etag: str, last_modified: Optional[datetime], cache_control: str) -> Response:
+    resp.set_etag(etag, weak=True)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = cache_control
+    resp.vary.add("Accept")
+    return resp
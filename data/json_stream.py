@@ -0,0 +1,144 @@
+'''
+json_stream.py
+Incremental JSON / NDJSON serialisation of large result sets.
+Rows are read through a named (server-side) cursor in `itersize` chunks and
+encoded one at a time, so peak memory stays flat regardless of row count.
+'''
+from __future__ import annotations
+
+import decimal
+import json
+import os
+import uuid
+from datetime import date
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import psycopg2.extras
+from werkzeug.http import http_date
+
+try:
+    import orjson  # optional: ~5-10x faster encoding of large text columns
+except ImportError:
+    orjson = None
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", "200"))
+# Rows are buffered into chunks of roughly this many bytes before yielding
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", str(64 * 1024)))
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def _default(o: Any) -> Any:
+    # Same representations as Flask's jsonify so both modes render identically
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTS)
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def wants_stream(args, headers) -> Optional[str]:
+    """
+    Returns "ndjson", "json" or None (= classic buffered jsonify response).
+    ?format=ndjson or Accept: application/x-ndjson -> NDJSON; ?stream=1 -> streamed JSON.
+    """
+    fmt = (args.get("format") or "").strip().lower()
+    if fmt == "ndjson" or NDJSON_MIMETYPE in (headers.get("Accept") or ""):
+        return "ndjson"
+    if fmt == "json" or (args.get("stream") or "").strip() in ("1", "true"):
+        return "json"
+    return None
+
+
+def stream_query(
+    db,
+    query: Any,
+    params: Optional[tuple] = None,
+    fmt: str = "json",
+    head: Optional[Dict[str, Any]] = None,
+    rows_path: tuple = ("rows",),
+    count_key: Optional[str] = "row_count",
+    itersize: int = STREAM_ITERSIZE,
+    on_error: Optional[Callable[[Exception], None]] = None,
+) -> Iterator[bytes]:
+    """
+    Generator of response chunks.
+
+    fmt="json":   emits `head` with the row array spliced in at rows_path, e.g.
+                  head={"success": True, "table": {...}}, rows_path=("table", "rows")
+                  -> {"success":true,"table":{...,"rows":[...],"row_count":N}}
+    fmt="ndjson": one JSON object per row per line (head is not emitted).
+
+    The DB connection is held only while the generator is being consumed.
+    """
+    head = dict(head or {})
+    prefix = suffix = b""
+    if fmt == "json":
+        # Build the envelope around a sentinel, then split it into prefix/suffix.
+        sentinel = "__ROWS_SENTINEL__"
+        node = head
+        for key in rows_path[:-1]:
+            node[key] = dict(node.get(key) or {})
+            node = node[key]
+        node[rows_path[-1]] = sentinel
+        envelope = dumps(head)
+        marker = dumps(sentinel)
+        idx = envelope.index(marker)
+        prefix = envelope[:idx] + b"["
+        suffix = b"]" + envelope[idx + len(marker):]
+
+    n = 0
+    buf = bytearray(prefix)
+    try:
+        with db.conn() as conn:
+            # Named cursor = server-side cursor; rows arrive in `itersize` batches
+            with conn.cursor(name="wb_stream", cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.itersize = max(1, int(itersize))
+                cur.execute(query, params)
+                for row in cur:
+                    if fmt == "json":
+                        if n:
+                            buf += b","
+                        buf += dumps(row)
+                    else:
+                        buf += dumps(row)
+                        buf += b"\n"
+                    n += 1
+                    if len(buf) >= STREAM_CHUNK_BYTES:
+                        yield bytes(buf)
+                        buf.clear()
+    except Exception as e:
+        if DEBUGGING_MODE:
+            print(f"[json_stream] stream aborted after {n} rows: {e}")
+        if on_error is not None:
+            on_error(e)
+        if fmt == "ndjson":
+            buf += dumps({"success": False, "code": "STREAM_ABORTED", "message": str(e)}) + b"\n"
+        # For JSON the body is left truncated so clients fail to parse instead of
+        # silently accepting a partial row list.
+        yield bytes(buf)
+        return
+
+    if fmt == "json":
+        if count_key:
+            # Envelope closes with the row array followed by the count (`..."rows":[...],"row_count":N}`)
+            closing = suffix[1:]
+            buf += b"]," + dumps(count_key) + b":" + str(n).encode() + closing
+        else:
+            buf += suffix
+    yield bytes(buf)
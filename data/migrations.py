@@ -0,0 +1,347 @@
+'''
+migrations.py
+Versioned schema migrations applied at startup.
+schema.sql is the base schema; every change after it lives here as a numbered
+migration and is recorded in schema_migrations once applied.
+'''
+from __future__ import annotations
+
+import os
+from typing import List, NamedTuple, Optional
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+# Arbitrary app-wide key so concurrent workers don't race each other
+MIGRATION_LOCK_KEY = 72_411_001
+
+# Opt-in: convert profileHistory to monthly RANGE partitions on entry_date
+PARTITION_PROFILEHISTORY = os.getenv("DB_PARTITION_PROFILEHISTORY", "0") == "1"
+PARTITION_MONTHS_AHEAD = int(os.getenv("DB_PARTITION_MONTHS_AHEAD", "3"))
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    sql: str
+    # When set, the migration only runs once this env var is "1"
+    # (it stays pending, not skipped, until then).
+    opt_in_env: Optional[str] = None
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[Migrations] {msg}")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "llm_call_ledger", """
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id BIGSERIAL PRIMARY KEY,
+            entry TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            agent TEXT NOT NULL,
+            call_kind TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt_tokens INT NOT NULL DEFAULT 0,
+            completion_tokens INT NOT NULL DEFAULT 0,
+            latency_ms INT NOT NULL DEFAULT 0,
+            attempts INT NOT NULL DEFAULT 1,
+            success BOOLEAN NOT NULL DEFAULT TRUE
+        );
+        CREATE TABLE IF NOT EXISTS llm_usage_daily (
+            usage_date DATE PRIMARY KEY,
+            calls BIGINT NOT NULL DEFAULT 0,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            latency_ms_total BIGINT NOT NULL DEFAULT 0,
+            attempts_total BIGINT NOT NULL DEFAULT 0
+        );
+    """),
+
+    Migration(2, "profilehistory_entry_date_id_idx", """
+        CREATE INDEX IF NOT EXISTS profilehistory_entry_date_id_idx
+            ON profileHistory (entry_date, id);
+    """),
+
+    Migration(3, "profilehistory_monthly_partitions", """
+        CREATE OR REPLACE FUNCTION ensure_profilehistory_partition(p_month DATE)
+        RETURNS VOID
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            m_start DATE := date_trunc('month', p_month)::date;
+            m_end DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+            part TEXT := format('profilehistory_%s', to_char(m_start, 'YYYY_MM'));
+        BEGIN
+            IF to_regclass(part) IS NOT NULL THEN
+                RETURN;
+            END IF;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF profileHistory FOR VALUES FROM (%L) TO (%L)',
+                part, m_start, m_end
+            );
+        END;
+        $$;
+
+        DO $$
+        DECLARE
+            m DATE;
+            idx_def TEXT;
+            idx_defs TEXT[] := ARRAY[]::TEXT[];
+        BEGIN
+            IF EXISTS (
+                SELECT 1
+                FROM pg_partitioned_table pt
+                JOIN pg_class c ON c.oid = pt.partrelid
+                WHERE c.relname = 'profilehistory'
+            ) THEN
+                RETURN;
+            END IF;
+
+            -- Secondary indexes are re-created on the partitioned parent after the swap
+            FOR idx_def IN
+                SELECT indexdef FROM pg_indexes
+                WHERE schemaname = 'public' AND tablename = 'profilehistory' AND indexname <> 'profilehistory_pkey'
+            LOOP
+                idx_defs := idx_defs || idx_def;
+            END LOOP;
+
+            ALTER TABLE profileHistory RENAME TO profilehistory_legacy;
+            ALTER TABLE profilehistory_legacy RENAME CONSTRAINT profilehistory_pkey TO profilehistory_legacy_pkey;
+
+            -- LIKE keeps the legacy column names/defaults (incl. the id sequence)
+            CREATE TABLE profileHistory (LIKE profilehistory_legacy INCLUDING DEFAULTS)
+                PARTITION BY RANGE (entry_date);
+            ALTER TABLE profileHistory ADD PRIMARY KEY (entry_date, id);
+            ALTER TABLE profileHistory
+                ADD FOREIGN KEY (entry_date) REFERENCES progress(entry_date) ON DELETE CASCADE ON UPDATE CASCADE;
+            CREATE TABLE profilehistory_default PARTITION OF profileHistory DEFAULT;
+
+            FOR m IN SELECT DISTINCT date_trunc('month', entry_date)::date FROM profilehistory_legacy LOOP
+                PERFORM ensure_profilehistory_partition(m);
+            END LOOP;
+
+            INSERT INTO profileHistory SELECT * FROM profilehistory_legacy;
+            ALTER SEQUENCE IF EXISTS profilehistory_id_seq OWNED BY profileHistory.id;
+            DROP TABLE profilehistory_legacy;
+
+            FOREACH idx_def IN ARRAY idx_defs LOOP
+                EXECUTE idx_def;
+            END LOOP;
+        END $$;
+    """, opt_in_env="DB_PARTITION_PROFILEHISTORY"),
+
+    # Expression must match data/history_search.py:search_tsvector_sql()
+    Migration(4, "profilehistory_fulltext_gin", """
+        DO $$
+        DECLARE
+            u TEXT := 'userprompt';
+            r TEXT := 'chatresponse';
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = 'profilehistory' AND column_name = 'Userprompt'
+            ) THEN
+                u := '"Userprompt"';
+                r := '"chatResponse"';
+            END IF;
+
+            EXECUTE format(
+                'CREATE INDEX IF NOT EXISTS profilehistory_search_idx ON profileHistory '
+                'USING GIN (to_tsvector(%L::regconfig, coalesce(%s, %L) || %L || coalesce(%s, %L)))',
+                'english', u, '', ' ', r, ''
+            );
+        END $$;
+    """),
+
+    # Per-table change counter used for HTTP ETags (data/http_cache.py)
+    Migration(5, "table_versions", """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+
+        CREATE OR REPLACE FUNCTION bump_table_version()
+        RETURNS TRIGGER
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version, updated_at)
+            VALUES (TG_TABLE_NAME, 1, NOW())
+            ON CONFLICT (table_name) DO UPDATE
+                SET version = table_versions.version + 1,
+                    updated_at = NOW();
+            RETURN NULL;
+        END;
+        $$;
+
+        DO $$
+        DECLARE
+            t TEXT;
+        BEGIN
+            FOREACH t IN ARRAY ARRAY['blogdata', 'blogparts', 'promptdata', 'progress'] LOOP
+                IF to_regclass(t) IS NULL THEN
+                    CONTINUE;
+                END IF;
+                INSERT INTO table_versions (table_name) VALUES (t) ON CONFLICT DO NOTHING;
+                EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_version_trg', t);
+                EXECUTE format(
+                    'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()',
+                    t || '_version_trg', t
+                );
+            END LOOP;
+        END $$;
+    """),
+
+    # pgvector backend for data/example_index.py (dimension = PGVECTOR_DIM)
+    Migration(6, "example_vectors_pgvector", """
+        CREATE EXTENSION IF NOT EXISTS vector;
+        CREATE TABLE IF NOT EXISTS example_vectors (
+            corpus TEXT NOT NULL,
+            doc_id INT NOT NULL,
+            content_md5 TEXT NOT NULL,
+            embedding vector(512) NOT NULL,
+            PRIMARY KEY (corpus, doc_id)
+        );
+        CREATE INDEX IF NOT EXISTS example_vectors_embedding_idx
+            ON example_vectors USING hnsw (embedding vector_cosine_ops);
+    """, opt_in_env="DB_EXAMPLE_VECTORS"),
+
+    # Section drafts per pipeline run, for partial regeneration (data/draft_store.py)
+    Migration(7, "pipeline_runs", """
+        CREATE TABLE IF NOT EXISTS pipeline_runs (
+            run_id TEXT PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            variables JSONB NOT NULL,
+            prompts JSONB NOT NULL,
+            drafts JSONB NOT NULL,
+            final TEXT NOT NULL DEFAULT '',
+            temperature REAL NOT NULL,
+            compiler_mode TEXT NOT NULL,
+            revision INT NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS pipeline_runs_updated_at_idx ON pipeline_runs (updated_at);
+    """),
+
+    # Cross-node shared state (data/shared_state_pg.py); UNLOGGED = no WAL, emptied after a crash
+    Migration(8, "shared_state_unlogged", """
+        CREATE UNLOGGED TABLE IF NOT EXISTS shared_kv (
+            ns TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value JSONB NOT NULL,
+            expires_at TIMESTAMPTZ,
+            PRIMARY KEY (ns, key)
+        );
+        CREATE INDEX IF NOT EXISTS shared_kv_expires_at_idx ON shared_kv (expires_at) WHERE expires_at IS NOT NULL;
+        CREATE UNLOGGED TABLE IF NOT EXISTS shared_buckets (
+            ns TEXT NOT NULL,
+            key TEXT NOT NULL,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL,
+            PRIMARY KEY (ns, key)
+        );
+    """),
+]
+
+
+def _is_opted_in(m: Migration) -> bool:
+    return m.opt_in_env is None or os.getenv(m.opt_in_env, "0") == "1"
+
+
+def apply_migrations(db) -> List[int]:
+    """
+    Applies every pending migration (in version order, one transaction each).
+    Returns the versions applied by this call.
+    """
+    applied_now: List[int] = []
+    with db.conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    );
+                """)
+                cur.execute("SELECT version FROM schema_migrations;")
+                done = {r[0] for r in cur.fetchall()}
+            conn.commit()
+
+            for m in sorted(MIGRATIONS, key=lambda x: x.version):
+                if m.version in done:
+                    continue
+                if not _is_opted_in(m):
+                    _log(f"pending (opt-in via {m.opt_in_env}=1): {m.version:03d} {m.name}")
+                    continue
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(m.sql)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);",
+                            (m.version, m.name),
+                        )
+                    conn.commit()
+                    applied_now.append(m.version)
+                    _log(f"applied {m.version:03d} {m.name}")
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            if PARTITION_PROFILEHISTORY:
+                ensure_profilehistory_partitions(conn, PARTITION_MONTHS_AHEAD)
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+            conn.commit()
+    return applied_now
+
+
+def ensure_profilehistory_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
+    """
+    Pre-creates this month's and the next `months_ahead` partitions so new rows
+    never land in the DEFAULT partition. No-op if profileHistory is not partitioned.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regprocedure('ensure_profilehistory_partition(date)') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return
+        for i in range(0, max(0, months_ahead) + 1):
+            cur.execute(
+                "SELECT ensure_profilehistory_partition((CURRENT_DATE + make_interval(months => %s))::date);",
+                (i,),
+            )
+    conn.commit()
+
+
+def maintain_profilehistory_partitions(conn, months_ahead: int = PARTITION_MONTHS_AHEAD) -> bool:
+    """
+    Periodic form of ensure_profilehistory_partitions for long-lived workers.
+    Skips (returns False) when partitioning is off or another worker holds
+    the migration lock; that worker is creating the same partitions.
+    """
+    if not PARTITION_PROFILEHISTORY:
+        return False
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+        locked = cur.fetchone()[0]
+    conn.commit()
+    if not locked:
+        return False
+    try:
+        ensure_profilehistory_partitions(conn, months_ahead)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+        conn.commit()
+    return True
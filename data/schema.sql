@@ -136,3 +136,25 @@ $$;
 --     'Write an intro for a fitness app',
 --     'Here is a concise and engaging introduction for your app...'
 -- );
+-- LLM call ledger (one row per llm.invoke, written in batches by data/token_ledger.py)
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id BIGSERIAL PRIMARY KEY,
+    entry TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    agent TEXT NOT NULL,
+    call_kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INT NOT NULL DEFAULT 0,
+    completion_tokens INT NOT NULL DEFAULT 0,
+    latency_ms INT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 1,
+    success BOOLEAN NOT NULL DEFAULT TRUE
+);
+-- Daily rollup maintained on every ledger flush (read by /api/stats/tokens/month)
+CREATE TABLE IF NOT EXISTS llm_usage_daily (
+    usage_date DATE PRIMARY KEY,
+    calls BIGINT NOT NULL DEFAULT 0,
+    prompt_tokens BIGINT NOT NULL DEFAULT 0,
+    completion_tokens BIGINT NOT NULL DEFAULT 0,
+    latency_ms_total BIGINT NOT NULL DEFAULT 0,
+    attempts_total BIGINT NOT NULL DEFAULT 0
+);
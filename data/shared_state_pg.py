@@ -0,0 +1,196 @@
+'''
+shared_state_pg.py
+Postgres backend for chatbots.shared_state, so every app node sees the same
+router counters, tenant token buckets and job/cancel flags without running
+another service.
+
+- shared_kv / shared_buckets are UNLOGGED: no WAL writes, so they cost about
+  as much as a cache. Postgres empties them after a crash, which is fine for
+  this kind of state.
+- Counters and buckets are single-statement upserts (the row lock makes them
+  atomic across nodes).
+- Expired rows are purged by at most one node at a time: the purge runs under
+  pg_try_advisory_xact_lock and other nodes skip it.
+- If the DB is unreachable, each call falls back to an in-process MemoryState
+  (per-node limits, counted in stats()) instead of failing the request.
+'''
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import psycopg2.extras
+
+from chatbots.shared_state import MemoryState, SharedState
+from data.database_postgres import get_db
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+SHARED_STATE_PURGE_INTERVAL_S = float(os.getenv("SHARED_STATE_PURGE_INTERVAL_S", "60"))
+# Any constant works; it only has to be the same on every node
+_PURGE_LOCK_KEY = 0x5752_4B56  # "WRKV"
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[SharedStatePG] {msg}")
+
+
+def _ttl(ttl_s: Optional[float]) -> Optional[float]:
+    return float(ttl_s) if ttl_s else None
+
+
+class PostgresSharedState(SharedState):
+    name = "postgres"
+
+    def __init__(self):
+        self._fallback = MemoryState()
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._ops = 0
+        self._errors = 0
+        self._purged = 0
+        self._last_error = ""
+
+    # ----------------------------
+    # PLUMBING
+    # ----------------------------
+    def _run(self, sql: str, params: tuple, fetch: str = ""):
+        with get_db().conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if fetch == "all" else cur.fetchone() if fetch == "one" else None
+            self._maybe_purge(conn)
+            conn.commit()
+        with self._lock:
+            self._ops += 1
+        return rows
+
+    def _failed(self, op: str, e: Exception) -> None:
+        with self._lock:
+            self._errors += 1
+            self._last_error = f"{op}: {e}"
+        _log(f"{op} failed, using in-process fallback: {e}")
+
+    def _maybe_purge(self, conn) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < SHARED_STATE_PURGE_INTERVAL_S:
+                return
+            self._last_purge = now
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (_PURGE_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                return
+            cur.execute("DELETE FROM shared_kv WHERE expires_at IS NOT NULL AND expires_at <= NOW();")
+            purged = cur.rowcount
+            # A bucket untouched for a day is full again; dropping it changes nothing
+            cur.execute("DELETE FROM shared_buckets WHERE updated_at < NOW() - INTERVAL '1 day';")
+            purged += cur.rowcount
+        with self._lock:
+            self._purged += max(0, purged)
+
+    # ----------------------------
+    # KEY / VALUE
+    # ----------------------------
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        try:
+            row = self._run(
+                "SELECT value FROM shared_kv WHERE ns = %s AND key = %s "
+                "AND (expires_at IS NULL OR expires_at > NOW());",
+                (ns, key), fetch="one",
+            )
+            return row[0] if row else None
+        except Exception as e:
+            self._failed("get", e)
+            return self._fallback.get(ns, key)
+
+    def get_many(self, ns: str, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        try:
+            rows = self._run(
+                "SELECT key, value FROM shared_kv WHERE ns = %s AND key = ANY(%s) "
+                "AND (expires_at IS NULL OR expires_at > NOW());",
+                (ns, keys), fetch="all",
+            )
+            return {k: v for k, v in rows}
+        except Exception as e:
+            self._failed("get_many", e)
+            return self._fallback.get_many(ns, keys)
+
+    def set(self, ns: str, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+        try:
+            self._run("""
+                INSERT INTO shared_kv (ns, key, value, expires_at)
+                VALUES (%s, %s, %s, NOW() + make_interval(secs => %s))
+                ON CONFLICT (ns, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at;
+            """, (ns, key, psycopg2.extras.Json(value), _ttl(ttl_s)))
+        except Exception as e:
+            self._failed("set", e)
+            self._fallback.set(ns, key, value, ttl_s)
+
+    def delete(self, ns: str, key: str) -> None:
+        try:
+            self._run("DELETE FROM shared_kv WHERE ns = %s AND key = %s;", (ns, key))
+        except Exception as e:
+            self._failed("delete", e)
+            self._fallback.delete(ns, key)
+
+    def incr(self, ns: str, key: str, amount: int = 1, ttl_s: Optional[float] = None) -> int:
+        try:
+            row = self._run("""
+                INSERT INTO shared_kv (ns, key, value, expires_at)
+                VALUES (%(ns)s, %(key)s, to_jsonb(%(amount)s::bigint), NOW() + make_interval(secs => %(ttl)s))
+                ON CONFLICT (ns, key) DO UPDATE SET
+                    value = to_jsonb(
+                        CASE WHEN shared_kv.expires_at IS NOT NULL AND shared_kv.expires_at <= NOW() THEN 0
+                             ELSE (shared_kv.value #>> '{}')::bigint END + %(amount)s
+                    ),
+                    expires_at = EXCLUDED.expires_at
+                RETURNING (value #>> '{}')::bigint;
+            """, {"ns": ns, "key": key, "amount": int(amount), "ttl": _ttl(ttl_s)}, fetch="one")
+            return int(row[0])
+        except Exception as e:
+            self._failed("incr", e)
+            return self._fallback.incr(ns, key, amount, ttl_s)
+
+    # ----------------------------
+    # TOKEN BUCKETS
+    # ----------------------------
+    def take_tokens(self, ns: str, key: str, amount: float, capacity: float, refill_per_s: float) -> float:
+        try:
+            row = self._run("""
+                INSERT INTO shared_buckets (ns, key, tokens, updated_at)
+                VALUES (%(ns)s, %(key)s, %(cap)s - %(amount)s, clock_timestamp())
+                ON CONFLICT (ns, key) DO UPDATE SET
+                    tokens = LEAST(
+                        %(cap)s,
+                        shared_buckets.tokens
+                        + EXTRACT(EPOCH FROM clock_timestamp() - shared_buckets.updated_at) * %(rate)s
+                    ) - %(amount)s,
+                    updated_at = clock_timestamp()
+                RETURNING tokens;
+            """, {"ns": ns, "key": key, "amount": float(amount), "cap": float(capacity), "rate": float(refill_per_s)},
+                fetch="one")
+            return float(row[0])
+        except Exception as e:
+            self._failed("take_tokens", e)
+            return self._fallback.take_tokens(ns, key, amount, capacity, refill_per_s)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "ops": self._ops,
+                "errors": self._errors,
+                "last_error": self._last_error,
+                "purged": self._purged,
+                "fallback": self._fallback.stats(),
+            }
@@ -0,0 +1,153 @@
+'''
+token_ledger.py
+Per-call LLM token / latency ledger.
+Raw rows go to llm_calls through the background BatchWriter; every flush also
+upserts the llm_usage_daily rollup so the dashboard never scans raw rows.
+'''
+from __future__ import annotations
+
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2.extras
+
+from data.batch_writer import BatchWriter
+from data.database_postgres import get_db
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+LEDGER_MAX_BATCH = int(os.getenv("LEDGER_MAX_BATCH", "100"))
+LEDGER_FLUSH_INTERVAL_S = float(os.getenv("LEDGER_FLUSH_INTERVAL_S", "2.0"))
+
+_LLM_CALL_COLUMNS = (
+    "entry",
+    "agent",
+    "call_kind",
+    "model",
+    "prompt_tokens",
+    "completion_tokens",
+    "latency_ms",
+    "attempts",
+    "success",
+)
+
+
+def _flush_llm_calls(records: List[Dict[str, Any]]) -> None:
+    rows = []
+    rollup: Dict[date, List[int]] = defaultdict(lambda: [0, 0, 0, 0, 0])
+    for r in records:
+        entry = r.get("entry") or datetime.now().astimezone()
+        rows.append((
+            entry,
+            r.get("agent") or "",
+            r.get("kind") or "section",
+            r.get("model") or "",
+            int(r.get("prompt_tokens") or 0),
+            int(r.get("completion_tokens") or 0),
+            int(r.get("latency_ms") or 0),
+            int(r.get("attempts") or 1),
+            bool(r.get("success", True)),
+        ))
+        agg = rollup[entry.date()]
+        agg[0] += 1
+        agg[1] += int(r.get("prompt_tokens") or 0)
+        agg[2] += int(r.get("completion_tokens") or 0)
+        agg[3] += int(r.get("latency_ms") or 0)
+        agg[4] += int(r.get("attempts") or 1)
+
+    with get_db().conn() as conn:
+        with conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                f"INSERT INTO llm_calls ({', '.join(_LLM_CALL_COLUMNS)}) VALUES %s",
+                rows,
+                page_size=len(rows),
+            )
+            psycopg2.extras.execute_values(
+                cur,
+                """
+                INSERT INTO llm_usage_daily
+                    (usage_date, calls, prompt_tokens, completion_tokens, latency_ms_total, attempts_total)
+                VALUES %s
+                ON CONFLICT (usage_date) DO UPDATE SET
+                    calls = llm_usage_daily.calls + EXCLUDED.calls,
+                    prompt_tokens = llm_usage_daily.prompt_tokens + EXCLUDED.prompt_tokens,
+                    completion_tokens = llm_usage_daily.completion_tokens + EXCLUDED.completion_tokens,
+                    latency_ms_total = llm_usage_daily.latency_ms_total + EXCLUDED.latency_ms_total,
+                    attempts_total = llm_usage_daily.attempts_total + EXCLUDED.attempts_total
+                """,
+                [(d, *agg) for d, agg in sorted(rollup.items())],
+            )
+        conn.commit()
+
+
+_writer = BatchWriter(
+    "llm_calls",
+    _flush_llm_calls,
+    max_batch=LEDGER_MAX_BATCH,
+    flush_interval_s=LEDGER_FLUSH_INTERVAL_S,
+)
+
+
+def record_llm_call(record: Dict[str, Any]) -> None:
+    """
+    Usage sink for chatbots.llm_usage. Never blocks and never raises.
+    """
+    try:
+        rec = dict(record)
+        rec.setdefault("entry", datetime.now().astimezone())
+        _writer.submit(rec)
+    except Exception:
+        pass
+
+
+def ledger_stats() -> Dict[str, Any]:
+    return _writer.stats()
+
+
+def parse_yyyy_mm(s: str) -> Tuple[int, int]:
+    d = datetime.strptime(s, "%Y-%m")
+    return d.year, d.month
+
+
+def fetch_month_usage(conn, year: int, month: int) -> List[Dict[str, Any]]:
+    """
+    Reads the daily rollup for one calendar month (ordered by day).
+    """
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT usage_date, calls, prompt_tokens, completion_tokens, latency_ms_total, attempts_total
+            FROM llm_usage_daily
+            WHERE usage_date >= %s AND usage_date < %s
+            ORDER BY usage_date ASC;
+        """, (start, end))
+        return cur.fetchall()
+
+
+def build_month_series(year: int, month: int, rows: List[Dict[str, Any]], upto: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    One entry per day of the month (zero-filled), shaped for dbOverview.js.
+    """
+    by_day = {r["usage_date"].day: r for r in rows}
+    last_day = (date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)).toordinal() - date(year, month, 1).toordinal()
+    if upto is not None and upto.year == year and upto.month == month:
+        last_day = upto.day
+
+    out = []
+    for day in range(1, last_day + 1):
+        r = by_day.get(day) or {}
+        calls = int(r.get("calls") or 0)
+        out.append({
+            "day": f"{day:02d}",
+            "calls": calls,
+            "input_tokens": int(r.get("prompt_tokens") or 0),
+            "output_tokens": int(r.get("completion_tokens") or 0),
+            "avg_latency_ms": round(int(r.get("latency_ms_total") or 0) / calls) if calls else 0,
+            "attempts": int(r.get("attempts_total") or 0),
+        })
+    return out
@@ -0,0 +1,82 @@
+'''
+gunicorn.conf.py
+Worker model for Writer's Block.
+
+A /api/chat request spends almost all of its 20-60s waiting on LLM HTTP calls,
+so we run few processes with many threads each (gthread) instead of one
+process per core. Every worker builds its own DB pool after fork.
+'''
+from __future__ import annotations
+
+import multiprocessing
+import os
+import signal
+import time
+
+# -----------------------------
+# SIZING
+# -----------------------------
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", str(max(2, min(multiprocessing.cpu_count(), 4)))))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+
+# One pooled DB connection per request thread + headroom for the background writers.
+# Must be set before app import (database_postgres reads it at import time).
+os.environ.setdefault("DB_POOL_MAX", str(threads + 4))
+
+# The full pipeline (6 agents + compiler, with retries) can take minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+# On SIGTERM, in-flight pipelines get this long to finish before workers are killed
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "180"))
+keepalive = 5
+
+# Import the app in the master once (copy-on-write static assets); app import
+# opens no sockets, so this is fork-safe.
+preload_app = True
+
+# Recycle workers occasionally to bound memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "500"))
+max_requests_jitter = 50
+
+accesslog = "-"
+errorlog = "-"
+
+
+# -----------------------------
+# HOOKS
+# -----------------------------
+def _drain(worker) -> None:
+    from wsgi import begin_drain, inflight_chats
+    begin_drain()
+    worker.log.info(f"draining | inflight_chats={inflight_chats()}")
+
+
+def post_worker_init(worker):
+    # Build this worker's DB pool (+ migrations) and load the LLM stack on a background
+    # thread, so the worker starts accepting immediately. Failed steps are retried
+    # on demand by the first request that needs them.
+    from wsgi import start_background_warmup
+    start_background_warmup()
+
+    # SIGTERM (graceful stop): flip readiness to 503 first, then let gunicorn
+    # wait up to graceful_timeout for in-flight pipelines.
+    default_handle_exit = worker.handle_exit
+
+    def handle_exit(sig, frame):
+        _drain(worker)
+        default_handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit)
+
+
+def worker_int(worker):
+    _drain(worker)
+
+
+def worker_exit(server, worker):
+    # Request threads are done (or graceful_timeout hit); flush queued history/ledger rows
+    from data.batch_writer import close_all_writers
+    t0 = time.time()
+    close_all_writers()
+    server.log.info(f"worker {worker.pid} exited | writers flushed in {(time.time() - t0) * 1000:.0f}ms")
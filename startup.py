@@ -0,0 +1,226 @@
+'''
+startup.py
+Cold-start instrumentation and background warm-up.
+
+- STARTUP_PROFILE=1 installs an import timer before app.py imports anything and
+  reports per-module import times (cumulative and self) once the app is built.
+  Modules imported lazily later (e.g. langchain on the first agent call or during
+  warm-up) keep being recorded.
+- start_warmup() runs the expensive one-off steps (DB pool, LLM client stack) on a
+  daemon thread so the server accepts traffic without waiting for them.
+'''
+from __future__ import annotations
+
+import importlib.abc
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+WARMUP_ENABLED = os.getenv("APP_WARMUP", "1") == "1"
+STARTUP_REPORT_TOP = 25
+
+PROCESS_T0 = time.time()
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[Startup] {msg}")
+
+
+# ============================================================
+# IMPORT TIMER
+# ============================================================
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, timer: "ImportTimer", loader: Any):
+        self._timer = timer
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module) -> None:
+        self._timer._enter()
+        t0 = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._timer._exit(module.__name__, time.perf_counter() - t0)
+
+    def __getattr__(self, name: str) -> Any:
+        # get_resource_reader, is_package, get_code, ... stay on the real loader
+        return getattr(self._loader, name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Meta-path finder that wraps every module loader to time exec_module().
+    Self time excludes nested imports, like `python -X importtime`.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.cumulative: Dict[str, float] = {}
+        self.self_time: Dict[str, float] = {}
+
+    def _finding(self) -> bool:
+        return getattr(self._local, "finding", False)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if self._finding():
+            return None
+        self._local.finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return spec
+        spec.loader = _TimedLoader(self, spec.loader)
+        return spec
+
+    def _enter(self) -> None:
+        stack: List[float] = getattr(self._local, "stack", None) or []
+        stack.append(0.0)
+        self._local.stack = stack
+
+    def _exit(self, name: str, elapsed: float) -> None:
+        stack: List[float] = self._local.stack
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with self._lock:
+            self.cumulative[name] = elapsed
+            self.self_time[name] = max(0.0, elapsed - children)
+
+    def report(self, top: int = STARTUP_REPORT_TOP) -> Dict[str, Any]:
+        with self._lock:
+            rows = sorted(self.cumulative.items(), key=lambda kv: kv[1], reverse=True)
+            self_total = sum(self.self_time.values())
+            modules = [
+                {
+                    "module": name,
+                    "cumulative_ms": round(cum * 1000, 1),
+                    "self_ms": round(self.self_time.get(name, 0.0) * 1000, 1),
+                }
+                for name, cum in rows[:max(1, top)]
+            ]
+            count = len(rows)
+        return {"modules_timed": count, "total_self_ms": round(self_total * 1000, 1), "top": modules}
+
+
+_timer: Optional[ImportTimer] = None
+
+
+def install_import_timer() -> Optional[ImportTimer]:
+    """No-op unless STARTUP_PROFILE=1. Must run before the imports it should see."""
+    global _timer
+    if not STARTUP_PROFILE or _timer is not None:
+        return _timer
+    _timer = ImportTimer()
+    sys.meta_path.insert(0, _timer)
+    return _timer
+
+
+# ============================================================
+# STARTUP REPORT
+# ============================================================
+_marks: List[Tuple[str, float]] = []
+_warmup: Dict[str, Any] = {"state": "idle", "steps": {}}
+_warmup_lock = threading.Lock()
+
+
+def mark(label: str) -> None:
+    """Records a startup milestone (ms since process start)."""
+    _marks.append((label, time.time()))
+
+
+def startup_report(top: int = STARTUP_REPORT_TOP) -> Dict[str, Any]:
+    with _warmup_lock:
+        warmup = {"state": _warmup["state"], "steps": dict(_warmup["steps"])}
+        if "total_ms" in _warmup:
+            warmup["total_ms"] = _warmup["total_ms"]
+    out: Dict[str, Any] = {
+        "pid": os.getpid(),
+        "milestones_ms": {label: round((t - PROCESS_T0) * 1000, 1) for label, t in _marks},
+        "warmup": warmup,
+        "import_profile": None,
+    }
+    if _timer is not None:
+        out["import_profile"] = _timer.report(top)
+    return out
+
+
+def log_import_report(top: int = 15) -> None:
+    if _timer is None:
+        return
+    rep = _timer.report(top)
+    _log(f"imports | modules={rep['modules_timed']} | total_self={rep['total_self_ms']:.0f}ms")
+    for row in rep["top"]:
+        _log(f"  {row['cumulative_ms']:>8.1f}ms cum | {row['self_ms']:>7.1f}ms self | {row['module']}")
+
+
+# ============================================================
+# WARM-UP
+# ============================================================
+def start_warmup(steps: Sequence[Tuple[str, Callable[[], Any]]]) -> Optional[threading.Thread]:
+    """
+    Runs `steps` (name, fn) in order on a daemon thread; a failing step is
+    recorded and the rest still run. Returns None if disabled or already started.
+    """
+    if not WARMUP_ENABLED:
+        return None
+    with _warmup_lock:
+        if _warmup["state"] != "idle":
+            return None
+        _warmup["state"] = "running"
+
+    def _run() -> None:
+        t_all = time.time()
+        for name, fn in steps:
+            t0 = time.time()
+            try:
+                result = fn()
+                step: Dict[str, Any] = {"ok": True, "ms": round((time.time() - t0) * 1000, 1)}
+                if isinstance(result, dict):
+                    step["detail"] = result
+            except Exception as e:
+                step = {"ok": False, "ms": round((time.time() - t0) * 1000, 1), "error": str(e)}
+            with _warmup_lock:
+                _warmup["steps"][name] = step
+            _log(f"warm-up {name} | ok={step['ok']} | {step['ms']:.0f}ms")
+        with _warmup_lock:
+            _warmup["state"] = "done"
+            _warmup["total_ms"] = round((time.time() - t_all) * 1000, 1)
+        mark("warmup_done")
+
+    t = threading.Thread(target=_run, name="startup-warmup", daemon=True)
+    t.start()
+    return t
+
+
+def _reset_after_fork() -> None:
+    # Each worker warms itself; the master's state (if any) doesn't carry over
+    global _warmup_lock
+    _warmup_lock = threading.Lock()
+    _warmup["state"] = "idle"
+    _warmup["steps"] = {}
+    _warmup.pop("total_ms", None)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,258 @@
+'''
+web_assets.py
+Response compression + precompressed, fingerprinted static assets.
+
+- API JSON responses above COMPRESS_MIN_BYTES are gzip/brotli encoded on the way out
+  (streamed responses are compressed chunk by chunk).
+- Every file under web_files is hashed and precompressed once at startup.
+  HTML/CSS references to css/js/pictures are rewritten to content-hashed names
+  (css/chatbot.3f9a1c0d2e.css) that are served with a one-year immutable
+  Cache-Control; the HTML pages themselves keep stable URLs and revalidate via ETag.
+'''
+from __future__ import annotations
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask import Flask, Response, request, send_from_directory
+
+try:
+    import brotli  # optional: better ratios than gzip for text assets
+except ImportError:
+    brotli = None
+
+# -----------------------------
+# CONFIG
+# -----------------------------
+DEBUGGING_MODE = True
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL_DYNAMIC = 6
+BROTLI_QUALITY_DYNAMIC = 5
+GZIP_LEVEL_STATIC = 9
+BROTLI_QUALITY_STATIC = 11
+# Keep a precompressed variant only if it saves at least this fraction
+MIN_SAVING = 0.10
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+_COMPRESSIBLE_MIMETYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/",
+    "image/svg+xml",
+)
+_FINGERPRINT_DIRS = ("css/", "js/", "pictures/")
+_REF_RE = re.compile(r'''((?:href|src)\s*=\s*["']|url\(\s*["']?)([^"')]+)''')
+
+
+def _log(msg: str) -> None:
+    if DEBUGGING_MODE:
+        print(f"[WebAssets] {msg}")
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return any(mimetype.startswith(m) for m in _COMPRESSIBLE_MIMETYPES)
+
+
+def _preferred_encoding(available: Tuple[str, ...] = ("br", "gzip")) -> Optional[str]:
+    accept = request.accept_encodings
+    for enc in available:
+        if enc == "br" and brotli is None:
+            continue
+        if accept.quality(enc) > 0:
+            return enc
+    return None
+
+
+# ============================================================
+# DYNAMIC (API) COMPRESSION
+# ============================================================
+def _compress_stream(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    if encoding == "br":
+        comp = brotli.Compressor(quality=BROTLI_QUALITY_DYNAMIC)
+        for chunk in chunks:
+            out = comp.process(chunk) + comp.flush()
+            if out:
+                yield out
+        yield comp.finish()
+        return
+
+    comp = zlib.compressobj(GZIP_LEVEL_DYNAMIC, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # Sync flush so each DB chunk reaches the client without waiting for the end
+        out = comp.compress(chunk) + comp.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield comp.flush()
+
+
+def compress_response(resp: Response) -> Response:
+    """
+    after_request hook for /api/* responses.
+    """
+    if not request.path.startswith("/api/"):
+        return resp
+    if resp.status_code != 200 or "Content-Encoding" in resp.headers:
+        return resp
+    if not _is_compressible(resp.mimetype or ""):
+        return resp
+
+    resp.vary.add("Accept-Encoding")
+    encoding = _preferred_encoding()
+    if encoding is None:
+        return resp
+
+    if resp.is_streamed:
+        resp.response = _compress_stream(resp.response, encoding)
+        resp.headers["Content-Encoding"] = encoding
+        resp.headers.pop("Content-Length", None)
+        return resp
+
+    body = resp.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return resp
+    if encoding == "br":
+        data = brotli.compress(body, quality=BROTLI_QUALITY_DYNAMIC)
+    else:
+        data = gzip.compress(body, compresslevel=GZIP_LEVEL_DYNAMIC)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
+
+
+# ============================================================
+# STATIC ASSETS
+# ============================================================
+class _Asset:
+    __slots__ = ("path", "mimetype", "etag", "variants")
+
+    def __init__(self, path: str, mimetype: str, body: bytes):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants: Dict[str, bytes] = {"identity": body}
+
+        if not _is_compressible(mimetype) and not mimetype.startswith("image/"):
+            return
+        gz = gzip.compress(body, compresslevel=GZIP_LEVEL_STATIC, mtime=0)
+        if len(gz) <= len(body) * (1 - MIN_SAVING):
+            self.variants["gzip"] = gz
+        if brotli is not None and _is_compressible(mimetype):
+            br = brotli.compress(body, quality=BROTLI_QUALITY_STATIC)
+            if len(br) <= len(body) * (1 - MIN_SAVING):
+                self.variants["br"] = br
+
+
+class StaticAssets:
+    """
+    In-memory, precompressed copy of the static folder (built once at startup;
+    shared copy-on-write by pre-forked workers).
+    """
+    def __init__(self, static_dir: str):
+        self.static_dir = static_dir
+        self.assets: Dict[str, _Asset] = {}
+        # original relative path -> fingerprinted relative path
+        self.manifest: Dict[str, str] = {}
+        self._fingerprinted: Dict[str, str] = {}
+
+    # ---------- build ----------
+    def build(self) -> "StaticAssets":
+        files = []
+        for root, _, names in os.walk(self.static_dir):
+            for n in names:
+                full = os.path.join(root, n)
+                rel = os.path.relpath(full, self.static_dir).replace(os.sep, "/")
+                if rel.startswith(".") or "/." in rel:
+                    continue
+                files.append(rel)
+
+        # Leaf assets first, then CSS (may reference pictures), then HTML (references all)
+        def _order(rel: str) -> int:
+            if rel.endswith(".html"):
+                return 2
+            if rel.endswith(".css"):
+                return 1
+            return 0
+
+        total_raw = total_best = 0
+        for rel in sorted(files, key=lambda r: (_order(r), r)):
+            with open(os.path.join(self.static_dir, rel), "rb") as f:
+                body = f.read()
+            if rel.endswith((".html", ".css")):
+                body = self._rewrite_refs(rel, body)
+
+            mimetype = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            asset = _Asset(rel, mimetype, body)
+            self.assets[rel] = asset
+
+            if rel.startswith(_FINGERPRINT_DIRS):
+                stem, ext = posixpath.splitext(rel)
+                fp = f"{stem}.{asset.etag[:10]}{ext}"
+                self.manifest[rel] = fp
+                self._fingerprinted[fp] = rel
+
+            total_raw += len(body)
+            total_best += min(len(v) for v in asset.variants.values())
+
+        _log(f"built {len(self.assets)} assets | {total_raw // 1024}KB raw -> {total_best // 1024}KB best encoding | brotli={'on' if brotli else 'off'}")
+        return self
+
+    def _rewrite_refs(self, rel: str, body: bytes) -> bytes:
+        base = posixpath.dirname(rel)
+        text = body.decode("utf-8")
+
+        def _sub(m: "re.Match[str]") -> str:
+            ref = m.group(2).strip()
+            if "://" in ref or ref.startswith(("/", "#", "data:")):
+                return m.group(0)
+            target = posixpath.normpath(posixpath.join(base, ref))
+            fp = self.manifest.get(target)
+            if not fp:
+                return m.group(0)
+            new_ref = posixpath.relpath(fp, base or ".")
+            return m.group(1) + new_ref
+
+        return _REF_RE.sub(_sub, text).encode("utf-8")
+
+    # ---------- serve ----------
+    def serve(self, filename: str) -> Response:
+        rel = posixpath.normpath(filename).lstrip("/")
+        immutable = rel in self._fingerprinted
+        asset = self.assets.get(self._fingerprinted.get(rel, rel))
+        if asset is None:
+            # Files added after startup: plain Flask static handling
+            return send_from_directory(self.static_dir, filename)
+
+        if not immutable and request.if_none_match and request.if_none_match.contains(asset.etag):
+            resp = Response(status=304)
+        else:
+            encoding = _preferred_encoding(tuple(e for e in ("br", "gzip") if e in asset.variants))
+            resp = Response(asset.variants[encoding or "identity"], mimetype=asset.mimetype)
+            if encoding:
+                resp.headers["Content-Encoding"] = encoding
+
+        resp.set_etag(asset.etag)
+        resp.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        if len(asset.variants) > 1:
+            resp.vary.add("Accept-Encoding")
+        return resp
+
+
+def init_web_assets(app: Flask) -> StaticAssets:
+    """
+    Precompresses app.static_folder, takes over the static endpoint and
+    registers API response compression.
+    """
+    assets = StaticAssets(app.static_folder).build()
+    app.view_functions["static"] = assets.serve
+    app.after_request(compress_response)
+    return assets
@@ -97,11 +97,11 @@
       .padding(0.15);
 
     const x1 = d3.scaleBand()
-      .domain(["input_words", "output_words"])
+      .domain(["input_tokens", "output_tokens"])
       .range([0, x0.bandwidth()])
       .padding(0.10);
 
-    const maxY = d3.max(data, d => Math.max(d.input_words, d.output_words)) || 0;
+    const maxY = d3.max(data, d => Math.max(d.input_tokens, d.output_tokens)) || 0;
 
     const y = d3.scaleLinear()
       .domain([0, maxY]).nice()
@@ -121,8 +121,8 @@
       .style("opacity", 0.85);
 
     const color = {
-      input_words: "rgba(92,139,192,0.85)",
-      output_words: "rgba(9,133,91,0.80)"
+      input_tokens: "rgba(92,139,192,0.85)",
+      output_tokens: "rgba(9,133,91,0.80)"
     };
 
     const groups = g.selectAll(".day-group")
@@ -133,8 +133,8 @@
 
     groups.selectAll("rect")
       .data(d => ([
-        { key: "input_words", value: d.input_words },
-        { key: "output_words", value: d.output_words }
+        { key: "input_tokens", value: d.input_tokens },
+        { key: "output_tokens", value: d.output_tokens }
       ]))
       .enter()
       .append("rect")
@@ -166,7 +166,7 @@
 
     let running = 0;
     const series = data.map(d => {
-      running += (d.output_words || 0);
+      running += (d.output_tokens || 0);
       return { day: d.day, cumulative: running };
     });
 
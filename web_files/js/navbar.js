@@ -41,6 +41,7 @@ document.addEventListener("DOMContentLoaded", function () {
             'db_promptdata': 'dbPromptData',
             'db_blogparts': 'dbBlogParts',
             'db_progress': 'dbProgress',
+            'opsDashboard': 'opsDashboard',
             'profile': 'profile'
         };
 
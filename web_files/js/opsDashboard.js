@@ -0,0 +1,188 @@
+(() => {
+  const REFRESH_MS = 3000;
+
+  const pauseBtn = document.getElementById("pauseBtn");
+  const workerLabel = document.getElementById("workerLabel");
+  const updatedLabel = document.getElementById("updatedLabel");
+  const outcomesLabel = document.getElementById("outcomesLabel");
+  const windowLabel = document.getElementById("windowLabel");
+  const legend = document.getElementById("legend");
+  const summaryGrid = document.getElementById("summaryGrid");
+  const inflightWrap = document.getElementById("inflightWrap");
+  const recentWrap = document.getElementById("recentWrap");
+  const llmWrap = document.getElementById("llmWrap");
+  const latencyWrap = document.getElementById("latencyWrap");
+  const cacheWrap = document.getElementById("cacheWrap");
+  const opsError = document.getElementById("opsError");
+
+  let paused = false;
+  let timer = null;
+
+  function escapeHtml(str) {
+    return String(str ?? "")
+      .replaceAll("&", "&amp;")
+      .replaceAll("<", "&lt;")
+      .replaceAll(">", "&gt;")
+      .replaceAll('"', "&quot;")
+      .replaceAll("'", "&#039;");
+  }
+
+  async function fetchJSON(url) {
+    const res = await fetch(url, { credentials: "same-origin", cache: "no-store" });
+    if (!res.ok) {
+      const txt = await res.text();
+      throw new Error(txt || `Request failed: ${res.status}`);
+    }
+    return res.json();
+  }
+
+  function ms(v) {
+    if (v === null || v === undefined) return "—";
+    return v >= 10000 ? `${(v / 1000).toFixed(1)}s` : `${Math.round(v)}ms`;
+  }
+
+  function pct(v) {
+    return v === null || v === undefined ? "—" : `${(v * 100).toFixed(1)}%`;
+  }
+
+  function statePill(state, extra = "") {
+    const s = escapeHtml(state);
+    return `<span class="state state-${s}">${s}${extra ? `<span class="ms">${escapeHtml(extra)}</span>` : ""}</span>`;
+  }
+
+  function table(columns, rows, empty) {
+    const head = columns.map(c => `<th>${escapeHtml(c)}</th>`).join("");
+    const body = rows.length
+      ? rows.map(r => `<tr>${r.map(c => `<td>${c}</td>`).join("")}</tr>`).join("")
+      : `<tr><td colspan="${columns.length}">${escapeHtml(empty)}</td></tr>`;
+    return `<table><thead><tr>${head}</tr></thead><tbody>${body}</tbody></table>`;
+  }
+
+  function stat(label, value, hint = "", level = "") {
+    return `<div class="ops-stat ${level}">
+      <div class="label">${escapeHtml(label)}</div>
+      <div class="value">${escapeHtml(value)}</div>
+      <div class="hint">${escapeHtml(hint)}</div>
+    </div>`;
+  }
+
+  function renderSummary(d) {
+    const ex = d.executor;
+    const pool = d.db_pool;
+    const poolLevel = pool && pool.utilization >= 0.9 ? "bad" : pool && pool.utilization >= 0.7 ? "warn" : "";
+    const queueLevel = ex.queue_depth >= ex.queue_max ? "bad" : ex.queue_depth > 0 ? "warn" : "";
+    summaryGrid.innerHTML = [
+      stat("Pipelines", `${ex.pipelines_in_flight} / ${ex.max_pipelines}`, d.draining ? "draining" : "in flight"),
+      stat("Agent calls", `${ex.active} / ${ex.workers}`, "running / workers"),
+      stat("Agent queue", `${ex.queue_depth} / ${ex.queue_max}`, `oldest ${ms(ex.oldest_wait_ms)}`, queueLevel),
+      stat("Queue wait p95", ms(ex.wait_ms.p95), `p50 ${ms(ex.wait_ms.p50)}`),
+      stat("DB pool", pool ? `${pool.in_use} / ${pool.max}` : "not built",
+        pool ? `idle ${pool.idle} · exhausted ${pool.exhausted}` : "", poolLevel),
+      stat("Rejected", ex.rejected, "admission 503/429"),
+      stat("Cancelled", d.cancellation.cancelled_endpoint + d.cancellation.disconnected, "endpoint + disconnect"),
+    ].join("");
+  }
+
+  function sectionCells(p, names) {
+    return names.map(n => {
+      const s = p.sections[n];
+      if (!s) return `<span class="state">—</span>`;
+      const extra = s.ms !== null && s.ms !== undefined ? ms(s.ms) : "";
+      const title = s.model ? ` title="${escapeHtml(s.model)}"` : "";
+      return `<span${title}>${statePill(s.state, extra)}</span>`;
+    });
+  }
+
+  function renderPipelines(el, list, empty) {
+    const names = [...new Set(list.flatMap(p => Object.keys(p.sections)))];
+    const cols = ["id", "kind", "tenant", "stage", "age", ...names];
+    const rows = list.map(p => [
+      `<code>${escapeHtml(p.id)}</code>`,
+      escapeHtml(p.kind),
+      escapeHtml(p.tenant),
+      statePill(p.stage),
+      ms(p.age_ms),
+      ...sectionCells(p, names),
+    ]);
+    el.innerHTML = table(cols, rows, empty);
+  }
+
+  function renderLLM(d) {
+    const rows = Object.entries(d.live.llm)
+      .sort((a, b) => b[1].in_flight - a[1].in_flight || b[1].calls - a[1].calls)
+      .map(([model, m]) => {
+        const width = m.peak ? Math.round((m.in_flight / m.peak) * 100) : 0;
+        return [
+          escapeHtml(model),
+          `${m.in_flight} <div class="bar"><span style="width:${width}%"></span></div>`,
+          m.peak,
+          m.calls,
+          ms(m.p50_ms),
+          ms(m.p95_ms),
+          m.n,
+        ];
+      });
+    llmWrap.innerHTML = table(["model", "in flight", "peak", "calls", "p50", "p95", "samples"], rows, "No LLM calls yet.");
+  }
+
+  function renderLatency(d) {
+    const rows = [];
+    for (const [kind, s] of Object.entries(d.live.pipelines.latency)) {
+      rows.push([`pipeline: ${escapeHtml(kind)}`, ms(s.p50_ms), ms(s.p95_ms), ms(s.max_ms), s.n]);
+    }
+    for (const [name, s] of Object.entries(d.live.sections)) {
+      rows.push([`section: ${escapeHtml(name)}`, ms(s.p50_ms), ms(s.p95_ms), ms(s.max_ms), s.n]);
+    }
+    rows.push(["agent queue wait", ms(d.executor.wait_ms.p50), ms(d.executor.wait_ms.p95), ms(d.executor.wait_ms.max), "—"]);
+    latencyWrap.innerHTML = table(["series", "p50", "p95", "max", "samples"], rows, "No samples yet.");
+  }
+
+  function renderCaches(d) {
+    const c = d.caches;
+    const rows = [["prompt prefix (all models)", "—", pct(c.prompt_prefix.reuse_ratio), "token reuse"]];
+    for (const [model, m] of Object.entries(c.prompt_prefix.models)) {
+      rows.push([`prompt prefix: ${escapeHtml(model)}`, m.calls, pct(m.hit_rate), `reuse ${pct(m.reuse_ratio)}`]);
+    }
+    rows.push(["draft store", c.drafts.lookups, pct(c.drafts.memory_hit_rate), `db ${pct(c.drafts.db_hit_rate)}`]);
+    if (c.example_snapshot) {
+      rows.push(["example snapshot", c.example_snapshot.lookups, pct(c.example_snapshot.hit_rate), "vs SQL fallback"]);
+    }
+    cacheWrap.innerHTML = table(["cache", "lookups", "hit rate", "note"], rows, "No cache activity.");
+  }
+
+  async function refresh() {
+    try {
+      const d = await fetchJSON("/api/ops/live");
+      opsError.classList.add("hidden");
+      workerLabel.textContent = `pid ${d.pid}`;
+      updatedLabel.textContent = `updated ${new Date(d.live.ts * 1000).toLocaleTimeString()}`;
+      windowLabel.textContent = `p95 over last ${Math.round(d.live.window_s / 60)} min`;
+      legend.innerHTML = d.live.section_states.map(s => statePill(s)).join("");
+      outcomesLabel.textContent = Object.entries(d.live.pipelines.outcomes).map(([k, v]) => `${k} ${v}`).join(" · ") || "none yet";
+
+      renderSummary(d);
+      renderPipelines(inflightWrap, d.live.pipelines.in_flight, "No pipelines running.");
+      renderPipelines(recentWrap, d.live.pipelines.recent, "Nothing finished yet.");
+      renderLLM(d);
+      renderLatency(d);
+      renderCaches(d);
+    } catch (err) {
+      opsError.textContent = `Failed to load live status: ${err.message}`;
+      opsError.classList.remove("hidden");
+    }
+  }
+
+  function schedule() {
+    clearTimeout(timer);
+    if (!paused) timer = setTimeout(async () => { await refresh(); schedule(); }, REFRESH_MS);
+  }
+
+  pauseBtn.addEventListener("click", () => {
+    paused = !paused;
+    pauseBtn.textContent = paused ? "Resume" : "Pause";
+    if (!paused) refresh();
+    schedule();
+  });
+
+  refresh().then(schedule);
+})();
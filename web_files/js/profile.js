@@ -162,6 +162,93 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // ===== Range + keyword search =====
+  const searchFrom = document.getElementById("searchFrom");
+  const searchTo = document.getElementById("searchTo");
+  const searchQuery = document.getElementById("searchQuery");
+  const searchBtn = document.getElementById("searchBtn");
+  const searchMoreBtn = document.getElementById("searchMoreBtn");
+  const searchCard = document.getElementById("searchCard");
+  const searchCount = document.getElementById("searchCount");
+  const searchTbody = document.getElementById("searchTbody");
+
+  let searchCursor = null;
+  let searchTotal = 0;
+
+  if (!searchTo.value) searchTo.value = dateInput.value;
+  if (!searchFrom.value) {
+    const d = new Date();
+    d.setMonth(d.getMonth() - 1);
+    searchFrom.value = `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, "0")}-${String(d.getDate()).padStart(2, "0")}`;
+  }
+
+  // Snippets mark hits with [[...]]; escape first, then highlight
+  function renderSnippet(s) {
+    return escapeHtml(s).replaceAll("[[", "<mark>").replaceAll("]]", "</mark>");
+  }
+
+  async function runSearch(append) {
+    showError("");
+    showLoading(true);
+
+    if (!append) {
+      searchCursor = null;
+      searchTotal = 0;
+      searchTbody.innerHTML = "";
+    }
+
+    const params = new URLSearchParams({
+      from: searchFrom.value || "",
+      to: searchTo.value || "",
+      q: (searchQuery.value || "").trim(),
+    });
+    if (searchCursor) params.set("cursor", searchCursor);
+
+    try {
+      const res = await fetch(`/api/profile/history/search?${params.toString()}`, {
+        headers: { "Accept": "application/json" }
+      });
+      const payload = await res.json().catch(() => null);
+
+      if (!res.ok || !payload?.success) {
+        const code = payload?.code ? ` [${payload.code}]` : "";
+        showError(`${payload?.message || `Request failed with ${res.status}`}${code}`);
+        return;
+      }
+
+      const rows = payload.rows || [];
+      searchTotal += rows.length;
+      searchCursor = payload.next_cursor || null;
+
+      searchTbody.insertAdjacentHTML("beforeend", rows.map(r => `
+        <tr>
+          <td class="col-id">${escapeHtml(r.id)}</td>
+          <td class="col-entrydate">${escapeHtml(r.entry_date)}</td>
+          <td><div class="cell-text max-cell">${renderSnippet(r.prompt_snippet)}</div></td>
+          <td><div class="cell-text max-cell">${renderSnippet(r.response_snippet)}</div></td>
+        </tr>
+      `).join(""));
+
+      if (searchTotal === 0) {
+        searchTbody.innerHTML = `<tr><td class="empty-cell" colspan="4">No matches.</td></tr>`;
+      }
+      searchCount.textContent = `${searchTotal} results`;
+      searchMoreBtn.disabled = !searchCursor;
+      searchCard.classList.remove("hidden");
+
+    } catch (err) {
+      showError(err?.message || "Search failed.");
+    } finally {
+      showLoading(false);
+    }
+  }
+
+  searchBtn.addEventListener("click", () => runSearch(false));
+  searchMoreBtn.addEventListener("click", () => runSearch(true));
+  searchQuery.addEventListener("keydown", (e) => {
+    if (e.key === "Enter") runSearch(false);
+  });
+
   loadBtn.addEventListener("click", loadHistory);
   downloadBtn.addEventListener("click", downloadCsv);
 });
@@ -0,0 +1,6 @@
+'''
+wsgi.py
+Production entry point:
+    gunicorn -c gunicorn.conf.py wsgi:application
+'''
+from app import app as application, init_worker, start_background_warmup, begin_drain, inflight_chats  # noqa: F401